@@ -1,20 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
 try:
     from config import settings
 except ImportError:
     from config_simple import settings
 from database import get_db
 from models import User
+from metrics import record_cache
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
+
+class _TTLCache:
+    """按条目过期的LRU缓存（每个worker进程一份）"""
+
+    def __init__(self, name: str, max_entries: int):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        record_cache(self.name, entry is not None)
+        return entry[1] if entry is not None else None
+
+    def put(self, key, value, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# 已验证的token -> user_id：缓存期内跳过签名校验，且不超过token自身的过期时间
+_verified_tokens = _TTLCache("auth_token", settings.auth_cache_max_entries)
+# user_id -> 脱离会话的User快照：缓存期内跳过数据库查询
+_cached_users = _TTLCache("auth_user", settings.auth_cache_max_entries)
+
+
+def invalidate_cached_user(user_id: int) -> None:
+    """丢弃缓存的用户快照，下一个请求重新从数据库读取"""
+    _cached_users.pop(int(user_id))
+
+
+# 会话中已flush但尚未提交的用户更新，session.info 中的键
+_UPDATED_USER_IDS = "auth_updated_user_ids"
+
+
+@event.listens_for(User, "after_update")
+def _collect_updated_user(mapper, connection, target):
+    # flush时事务还没提交，此时失效会让并发请求把旧行重新缓存；先记在会话上，提交后再失效
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_UPDATED_USER_IDS, set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session):
+    # 本进程内任何对用户行的更新（登录更新凭证、停用账户等）提交后立即失效；
+    # 其他worker进程的更新最多延迟 auth_user_cache_ttl_seconds 生效
+    for user_id in session.info.pop(_UPDATED_USER_IDS, ()):
+        invalidate_cached_user(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_users(session):
+    session.info.pop(_UPDATED_USER_IDS, None)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -26,14 +106,22 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    token = credentials.credentials
+    user_id = _verified_tokens.get(token)
+    if user_id is not None:
+        return user_id
     try:
-        payload = jwt.decode(credentials.credentials, settings.secret_key, algorithms=[settings.algorithm])
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Could not validate credentials"
             )
+        ttl = settings.auth_token_cache_ttl_seconds
+        if payload.get("exp") is not None:
+            ttl = min(ttl, payload["exp"] - time.time())
+        _verified_tokens.put(token, user_id, ttl)
         return user_id
     except JWTError:
         raise HTTPException(
@@ -42,10 +130,22 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
         )
 
 def get_current_user(user_id: str = Depends(verify_token), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == int(user_id)).first()
+    """
+    当前用户；返回的是脱离会话的只读快照，在worker内按 auth_user_cache_ttl_seconds 缓存
+    需要修改用户时请在当前会话中重新查询
+    """
+    user_id = int(user_id)
+    user = _cached_users.get(user_id)
+    if user is not None:
+        return user
+
+    user = db.query(User).filter(User.id == user_id).first()
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found"
         )
+    # 列属性都已加载，脱离会话后仍可读取，提交其他修改也不会使其过期
+    db.expunge(user)
+    _cached_users.put(user_id, user, settings.auth_user_cache_ttl_seconds)
     return user
\ No newline at end of file
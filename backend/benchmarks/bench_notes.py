@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+笔记组装基准测试：在合成的 5k 条划线的书籍上测量Markdown生成耗时，
+以及直接生成HTML与 markdown2 转换的对比
+
+用法:
+    python benchmarks/bench_notes.py [--highlights 5000] [--chapters 120] [--runs 20]
+"""
+
+import sys
+import os
+import random
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import note_assembly
+from bench_search import time_query, TITLE_CHARS
+
+
+def build_synthetic_notebook(highlight_count: int, chapter_count: int, seed: int = 42) -> tuple:
+    """生成合成的书签数据和章节列表，结构与 get_bookmarks / get_sorted_chapters 的返回一致"""
+    rng = random.Random(seed)
+    chapters = [(1000 + i, 1, f"第{i + 1}章 " + ''.join(rng.choice(TITLE_CHARS) for _ in range(6)))
+                for i in range(chapter_count)]
+    bookmarks = []
+    for i in range(highlight_count):
+        start = rng.randint(0, 60000)
+        bookmark = {
+            "bookmarkId": f"b{i}",
+            "chapterUid": rng.choice(chapters)[0],
+            "range": f"{start}-{start + rng.randint(5, 200)}",
+            "markText": ''.join(rng.choice(TITLE_CHARS) for _ in range(rng.randint(10, 80))),
+            "style": rng.randint(0, 2),
+            "createTime": 1700000000 + i,
+        }
+        if i % 7 == 0:
+            bookmark["noteText"] = ''.join(rng.choice(TITLE_CHARS) for _ in range(rng.randint(5, 40)))
+        bookmarks.append(bookmark)
+    rng.shuffle(bookmarks)
+    return {"book": {"bookId": "bench"}, "synckey": 1700000000 + highlight_count, "updated": bookmarks}, chapters
+
+
+def legacy_markdown(bookmarks_data: dict, chapters: list) -> str:
+    """旧实现：逐章节按 range 字符串排序（每次渲染都重新排序，"1000-1020" 排在 "200-210" 之前）"""
+    chapter_bookmarks = {}
+    for bookmark in bookmarks_data.get('updated', []):
+        chapter_bookmarks.setdefault(bookmark.get('chapterUid'), []).append(bookmark)
+
+    chunks = []
+    for chapter_uid, level, title in chapters:
+        bookmarks = chapter_bookmarks.get(chapter_uid, [])
+        markdown_lines = [f"{'#' * (level + 1)} {title}", ""]
+        for bookmark in sorted(bookmarks, key=lambda x: x.get('range', '')):
+            marked_text = bookmark.get('markText', '').strip()
+            if marked_text:
+                markdown_lines.append(marked_text)
+                markdown_lines.append("")
+            note_text = bookmark.get('noteText', '').strip()
+            if note_text:
+                markdown_lines.append(f"**笔记：** {note_text}")
+                markdown_lines.append("")
+        if bookmarks:
+            markdown_lines.append("")
+        chunks.append('\n'.join(markdown_lines))
+    return '\n'.join(chunks)
+
+
+def assembled_markdown(bookmarks_data: dict, chapters: list) -> str:
+    grouped = note_assembly.assemble_notes(note_assembly.extract_bookmarks(bookmarks_data))
+    return '\n'.join(note_assembly.iter_markdown_chapters(chapters, grouped))
+
+
+def cached_markdown(bookmarks_data: dict, chapters: list) -> str:
+    """请求路径：同一本书、同一synckey的组装结果和已渲染的章节从 assembled_notebooks 复用"""
+    key = ("bench", bookmarks_data['book']['bookId'], bookmarks_data['synckey'])
+    notebook = note_assembly.assembled_notebooks.assemble(key, note_assembly.extract_bookmarks(bookmarks_data))
+    return '\n'.join(note_assembly.iter_markdown_chapters(
+        chapters, notebook.grouped, segments=notebook.segments('markdown')
+    ))
+
+
+def markdown2_html(chapters: list, grouped: dict) -> str:
+    """旧的HTML路径：先生成Markdown，再交给 markdown2 解析"""
+    import markdown2
+    return markdown2.markdown('\n'.join(note_assembly.iter_markdown_chapters(chapters, grouped)))
+
+
+def direct_html(chapters: list, grouped: dict) -> str:
+    return '\n'.join(note_assembly.iter_html_chapters(chapters, grouped))
+
+
+def misordered_chapters(bookmarks_data: dict) -> int:
+    """按字符串排序时，位置顺序错误的章节数"""
+    grouped = note_assembly.assemble_notes(bookmarks_data['updated'])
+    count = 0
+    for notes in grouped.values():
+        by_string = [note[2] for note in sorted(notes, key=lambda note: note[2]['range'])]
+        if by_string != [note[2] for note in notes]:
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="笔记组装基准测试")
+    parser.add_argument("--highlights", type=int, default=5000)
+    parser.add_argument("--chapters", type=int, default=120)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    bookmarks_data, chapters = build_synthetic_notebook(args.highlights, args.chapters)
+    grouped = note_assembly.assemble_notes(bookmarks_data['updated'])
+
+    cases = [
+        ("legacy (string sort)", lambda: legacy_markdown(bookmarks_data, chapters)),
+        ("assemble + render", lambda: assembled_markdown(bookmarks_data, chapters)),
+        ("cached notebook + render", lambda: cached_markdown(bookmarks_data, chapters)),
+        ("assemble only", lambda: note_assembly.assemble_notes(bookmarks_data['updated'])),
+        ("render pre-assembled", lambda: '\n'.join(note_assembly.iter_markdown_chapters(chapters, grouped))),
+        ("html: direct", lambda: direct_html(chapters, grouped)),
+    ]
+    try:
+        import markdown2  # noqa: F401
+        cases.append(("html: markdown2", lambda: markdown2_html(chapters, grouped)))
+    except ImportError:
+        pass
+
+    print(f"📝 合成笔记: {args.highlights} 条划线, {args.chapters} 个章节, 每项运行 {args.runs} 次")
+    print(f"   字符串排序导致顺序错误的章节: {misordered_chapters(bookmarks_data)}/{len(grouped)}")
+    print(f"{'case':<24}{'median(ms)':>12}{'p95(ms)':>10}")
+    for name, fn in cases:
+        stats = time_query(fn, args.runs)
+        print(f"{name:<24}{stats['median_ms']:>12.2f}{stats['p95_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
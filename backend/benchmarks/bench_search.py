@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+书架搜索基准测试：在合成的 10k 本书书架上测量单次查询延迟
+
+用法:
+    python benchmarks/bench_search.py [--books 10000] [--runs 20]
+"""
+
+import sys
+import os
+import time
+import random
+import argparse
+import statistics
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from weread_api import WeReadAPI
+
+TITLE_CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处理世车"
+AUTHOR_CHARS = "王李张刘陈杨黄赵周吴徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤"
+QUERIES = ["运维", "Google", "经济学原理", "不存在的书名xyz", "的"]
+
+
+def build_synthetic_shelf(book_count: int, seed: int = 42) -> dict:
+    """生成合成书架数据，结构与 get_user_data_enhanced 的返回一致"""
+    rng = random.Random(seed)
+    books = []
+    for i in range(book_count):
+        title = ''.join(rng.choice(TITLE_CHARS) for _ in range(rng.randint(4, 16)))
+        if i % 50 == 0:
+            title += rng.choice(QUERIES[:3])
+        books.append({
+            "bookId": str(100000 + i),
+            "title": title,
+            "author": ''.join(rng.choice(AUTHOR_CHARS) for _ in range(rng.randint(2, 3))),
+            "cover": f"https://wfqqreader-1252317822.image.myqcloud.com/cover/{i}/s_{i}.jpg",
+            "category": "",
+            "finishReading": rng.randint(0, 1),
+            "newRatingDetail": "",
+            "readUpdateTime": 1700000000 - i,
+        })
+    return {"books": books, "source": "synthetic"}
+
+
+def time_query(fn, runs: int) -> dict:
+    """运行 runs 次并返回延迟统计（毫秒）"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "median_ms": statistics.median(samples),
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "min_ms": samples[0],
+    }
+
+
+def legacy_search(user_data: dict, query: str) -> list:
+    """旧实现：逐本调用 fuzzywuzzy，然后整体排序"""
+    from fuzzywuzzy import fuzz
+    results = []
+    for book in user_data.get('books', []):
+        ratio = fuzz.partial_ratio(book.get('title', ''), query)
+        if ratio > 60:
+            results.append({'bookId': book['bookId'], 'ratio': ratio})
+    results.sort(key=lambda x: x['ratio'], reverse=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="search_books 基准测试")
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=10)
+    args = parser.parse_args()
+
+    user_data = build_synthetic_shelf(args.books)
+    weread_api = WeReadAPI("")
+
+    try:
+        import fuzzywuzzy  # noqa: F401
+        has_legacy = True
+    except ImportError:
+        has_legacy = False
+
+    print(f"📚 合成书架: {args.books} 本书, 每个查询运行 {args.runs} 次")
+    print(f"{'query':<16}{'hits':>8}{'batch+topk(ms)':>18}{'legacy(ms)':>14}")
+    for query in QUERIES:
+        _, total = weread_api.search_books_ranked(user_data, query, limit=args.page_size)
+        batch = time_query(lambda: weread_api.search_books_ranked(user_data, query, limit=args.page_size), args.runs)
+        legacy = time_query(lambda: legacy_search(user_data, query), args.runs) if has_legacy else None
+        legacy_text = f"{legacy['median_ms']:.2f}" if legacy else "n/a"
+        print(f"{query:<16}{total:>8}{batch['median_ms']:>18.2f}{legacy_text:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+本地微信读书上游模拟服务：用于压测和回归测试，不请求真实服务
+
+提供 /web/shelf（基于仓库中的 response.html）、/web/shelf/syncBook、/web/book/info、
+/web/book/bookmarklist、/web/book/chapterInfos、/api/user/notebook 和 /web/login/renewal，
+书籍、章节和书签都按 bookId 确定性生成；可注入延迟、401/404/5xx 错误和慢响应体
+
+用法:
+    python benchmarks/fake_weread.py [--port 8900] [--books 10000] [--latency-ms 80] [--error-rate 0.02]
+
+    # 后端指向模拟服务（任意包含 wr_vid / wr_skey / wr_rt 的Cookie都可以登录）
+    WEREAD_WEB_URL=http://127.0.0.1:8900 WEREAD_BASE_URL=http://127.0.0.1:8900 python main.py
+
+运行时可通过 GET/POST /__fake/config 查看或修改故障注入参数，GET /__fake/stats 查看请求统计
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import random
+import secrets
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_search import TITLE_CHARS, AUTHOR_CHARS
+
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                "response.html")
+INITIAL_STATE_PATTERN = re.compile(r'(window\.__INITIAL_STATE__\s*=\s*)({.*?})(;)', re.DOTALL)
+CATEGORIES = ["计算机-计算机综合", "经济理财-财经", "文学-小说", "历史-中国史", "哲学宗教-哲学", "科学技术-自然科学", "心理-心理学"]
+RATING_TITLES = ["神作", "好评如潮", "脍炙人口", "值得一读", "褒贬不一", "不值一读", ""]
+
+
+def _text(rng: random.Random, low: int, high: int, chars: str = TITLE_CHARS) -> str:
+    return ''.join(rng.choice(chars) for _ in range(rng.randint(low, high)))
+
+
+class FakeData:
+    """按 bookId 确定性生成的书架、书籍、章节和书签数据"""
+
+    def __init__(self, template: str, book_count: int = 0, full_ratio: float = 0.12,
+                 chapters_per_book: int = 30, bookmarks_per_book: int = 40, seed: int = 42):
+        self.template = template
+        self.book_count = book_count
+        self.full_ratio = full_ratio
+        self.chapters_per_book = chapters_per_book
+        self.bookmarks_per_book = bookmarks_per_book
+        self.seed = seed
+        match = INITIAL_STATE_PATTERN.search(template)
+        if not match:
+            raise ValueError("模板中没有 window.__INITIAL_STATE__")
+        self._state = json.loads(match.group(2))
+        self._shelf_html = self._build_shelf_html() if book_count else template
+        self._shelf_html_bytes = self._shelf_html.encode('utf-8')
+        # 实际返回的书架数据（模板原样返回时即模板中的书架）
+        self.shelf = json.loads(INITIAL_STATE_PATTERN.search(self._shelf_html).group(2)).get("shelf") or {}
+        self.shelf_book_ids = self._shelf_book_ids()
+
+    def _rng(self, *parts) -> random.Random:
+        return random.Random(':'.join(str(part) for part in (self.seed,) + parts))
+
+    def book(self, book_id: str) -> dict:
+        """完整书籍信息，字段与 rawBooks / syncBook / book/info 的返回一致"""
+        rng = self._rng('book', book_id)
+        category = rng.choice(CATEGORIES)
+        rating_count = rng.randint(0, 5000)
+        return {
+            "bookId": book_id,
+            "title": _text(rng, 4, 16),
+            "author": _text(rng, 2, 3, AUTHOR_CHARS),
+            "translator": "",
+            "cover": f"https://wfqqreader-1252317822.image.myqcloud.com/cover/{book_id[-3:]}/{book_id}/s_{book_id}.jpg",
+            "intro": _text(rng, 40, 160),
+            "publisher": _text(rng, 4, 8) + "出版社",
+            "version": 1700000000,
+            "format": "epub",
+            "type": 0,
+            "price": rng.randint(0, 60),
+            "category": category,
+            "categories": [{"categoryId": 700000, "subCategoryId": 700003, "categoryType": 0, "title": category}],
+            "finished": 1,
+            "totalWords": rng.randint(50000, 800000),
+            "publishTime": f"{rng.randint(1990, 2024)}-01-01 00:00:00",
+            "newRating": rng.randint(500, 1000),
+            "newRatingCount": rating_count,
+            "newRatingDetail": {"good": rating_count, "fair": 0, "poor": 0, "recent": 0,
+                                "title": rng.choice(RATING_TITLES)},
+            "readUpdateTime": 1760000000 - rng.randint(0, 86400 * 1000),
+            "finishReading": rng.randint(0, 1),
+            "paid": 1,
+            "updateTime": 1700000000,
+        }
+
+    def chapters(self, book_id: str) -> list:
+        rng = self._rng('chapters', book_id)
+        chapters = []
+        for idx in range(1, self.chapters_per_book + 1):
+            chapters.append({
+                "chapterUid": idx,
+                "chapterIdx": idx,
+                "updateTime": 1700000000,
+                "title": f"第{idx}章 " + _text(rng, 2, 10),
+                "wordCount": rng.randint(1000, 20000),
+                "price": 0,
+                "isMPChapter": 0,
+                "level": 1 if idx == 1 or rng.random() < 0.4 else 2,
+            })
+        return chapters
+
+    def bookmarks(self, book_id: str) -> list:
+        rng = self._rng('bookmarks', book_id)
+        bookmarks = []
+        for i in range(self.bookmarks_per_book):
+            start = rng.randint(0, 60000)
+            bookmark = {
+                "bookId": book_id,
+                "bookmarkId": f"{book_id}_{i}",
+                "chapterUid": rng.randint(1, max(1, self.chapters_per_book)),
+                "range": f"{start}-{start + rng.randint(5, 200)}",
+                "markText": _text(rng, 10, 80),
+                "style": rng.randint(0, 2),
+                "type": 1,
+                "createTime": 1700000000 + i,
+            }
+            if i % 7 == 0:
+                bookmark["noteText"] = _text(rng, 5, 40)
+            bookmarks.append(bookmark)
+        return bookmarks
+
+    def _build_shelf_html(self) -> str:
+        """把模板中的书架替换为 book_count 本书：前 full_ratio 部分带完整信息，其余只在 rawIndexes 中出现"""
+        book_ids = [str(1000000 + i) for i in range(self.book_count)]
+        full_count = int(len(book_ids) * self.full_ratio)
+        state = dict(self._state)
+        shelf = dict(state.get("shelf") or {})
+        shelf["rawBooks"] = [self.book(book_id) for book_id in book_ids[:full_count]]
+        shelf["rawIndexes"] = [{"bookId": book_id, "type": 0, "idx": idx, "role": "book"}
+                               for idx, book_id in enumerate(book_ids)]
+        shelf["shelfIndexes"] = shelf["rawIndexes"]
+        shelf["booksAndArchives"] = shelf["rawBooks"][:50]
+        shelf["archive"] = []
+        state["shelf"] = shelf
+        payload = json.dumps(state, ensure_ascii=False)
+        return INITIAL_STATE_PATTERN.sub(lambda m: m.group(1) + payload + m.group(3), self.template, count=1)
+
+    def _shelf_book_ids(self) -> list:
+        book_ids = [book.get("bookId") for book in self.shelf.get("rawBooks") or []]
+        book_ids += [index.get("bookId") for index in self.shelf.get("rawIndexes") or [] if index.get("role") == "book"]
+        return list(dict.fromkeys(book_id for book_id in book_ids if book_id))
+
+    @property
+    def shelf_html(self) -> bytes:
+        return self._shelf_html_bytes
+
+
+class FaultConfig:
+    """故障注入参数，各比例互斥地按顺序判定（401、404、5xx）"""
+
+    FIELDS = {
+        "latency_ms": float, "jitter_ms": float, "unauthorized_rate": float, "not_found_rate": float,
+        "error_rate": float, "slow_body_rate": float, "slow_body_ms": float, "endpoints": list,
+    }
+
+    def __init__(self, **values):
+        self.latency_ms = 0.0
+        self.jitter_ms = 0.0
+        self.unauthorized_rate = 0.0
+        self.not_found_rate = 0.0
+        self.error_rate = 0.0
+        self.slow_body_rate = 0.0
+        self.slow_body_ms = 2000.0
+        # 只对这些路径注入故障，空列表表示全部
+        self.endpoints = []
+        self.update(values)
+
+    def update(self, values: dict) -> None:
+        for key, value in values.items():
+            if key in self.FIELDS and value is not None:
+                setattr(self, key, self.FIELDS[key](value))
+
+    def applies_to(self, path: str) -> bool:
+        return not self.endpoints or any(path.endswith(endpoint) for endpoint in self.endpoints)
+
+    def as_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+
+class FakeWeReadServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, data: FakeData, faults: FaultConfig):
+        super().__init__(address, FakeWeReadHandler)
+        self.data = data
+        self.faults = faults
+        # 续期后作废的 wr_skey
+        self.revoked_skeys = set()
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    def record(self, path: str, status: int) -> None:
+        key = f"{path} {status}"
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+
+class FakeWeReadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeWeReadServer
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---- 请求分发 ----
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str) -> None:
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/') or '/'
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self._read_body()
+
+        if path.startswith("/__fake/"):
+            return self._control(method, path, body)
+
+        faults = self.server.faults
+        if faults.latency_ms or faults.jitter_ms:
+            time.sleep(max(0.0, faults.latency_ms + random.uniform(-faults.jitter_ms, faults.jitter_ms)) / 1000)
+
+        if faults.applies_to(path):
+            roll = random.random()
+            if roll < faults.unauthorized_rate:
+                return self._send_json(path, 401, {"errcode": -2012, "errmsg": "登录超时"})
+            roll -= faults.unauthorized_rate
+            if roll < faults.not_found_rate:
+                return self._send_json(path, 404, {"errcode": -2010, "errmsg": "not found"})
+            roll -= faults.not_found_rate
+            if roll < faults.error_rate:
+                return self._send_json(path, random.choice((500, 502, 503)), {"errcode": -1, "errmsg": "server error"})
+
+        cookies = self._cookies()
+        if path == "/web/login/renewal" and method == "POST":
+            return self._renewal(path, cookies)
+        if not cookies.get("wr_skey") or cookies["wr_skey"] in self.server.revoked_skeys:
+            return self._send_json(path, 401, {"errcode": -2012, "errmsg": "登录超时"})
+
+        routes = {
+            ("GET", "/web/shelf"): self._shelf,
+            ("GET", "/web/bookshelf"): self._shelf,
+            ("POST", "/web/shelf/syncBook"): self._sync_book,
+            ("GET", "/web/book/info"): self._book_info,
+            ("GET", "/web/book/bookmarklist"): self._bookmarklist,
+            ("GET", "/book/bookmarklist"): self._bookmarklist,
+            ("POST", "/web/book/chapterInfos"): self._chapter_infos,
+            ("GET", "/api/user/notebook"): self._notebooks,
+        }
+        handler = routes.get((method, path))
+        if handler is None:
+            return self._send_json(path, 404, {"errcode": -2010, "errmsg": "not found"})
+        handler(path, query, body)
+
+    # ---- 接口 ----
+
+    def _shelf(self, path, query, body):
+        self._send(path, 200, self.server.data.shelf_html, "text/html; charset=utf-8")
+
+    def _sync_book(self, path, query, body):
+        book_ids = [str(book_id) for book_id in (body or {}).get("bookIds") or []]
+        data = self.server.data
+        self._send_json(path, 200, {
+            "books": [data.book(book_id) for book_id in book_ids],
+            "bookProgress": [{"bookId": book_id, "progress": random.randint(0, 100), "updateTime": 1760000000}
+                             for book_id in book_ids],
+        })
+
+    def _book_info(self, path, query, body):
+        book_id = query.get("bookId")
+        if not book_id:
+            return self._send_json(path, 404, {"errcode": -2010, "errmsg": "not found"})
+        self._send_json(path, 200, self.server.data.book(book_id))
+
+    def _bookmarklist(self, path, query, body):
+        book_id = query.get("bookId")
+        if not book_id:
+            return self._send_json(path, 404, {"errcode": -2010, "errmsg": "not found"})
+        data = self.server.data
+        bookmarks = data.bookmarks(book_id)
+        try:
+            sync_key = int(query.get("syncKey") or 0)
+        except ValueError:
+            sync_key = 0
+        updated = [bookmark for bookmark in bookmarks if bookmark["createTime"] > sync_key]
+        book = data.book(book_id)
+        self._send_json(path, 200, {
+            "synckey": max([bookmark["createTime"] for bookmark in bookmarks] + [sync_key]),
+            "updated": updated,
+            "removed": [],
+            "chapters": [{"bookId": book_id, "chapterUid": chapter["chapterUid"],
+                          "chapterIdx": chapter["chapterIdx"], "title": chapter["title"]}
+                         for chapter in data.chapters(book_id)],
+            "book": {key: book[key] for key in ("bookId", "title", "author", "cover")},
+        })
+
+    def _chapter_infos(self, path, query, body):
+        data = self.server.data
+        book_ids = [str(book_id) for book_id in (body or {}).get("bookIds") or []]
+        self._send_json(path, 200, {"data": [
+            {"bookId": book_id, "soldOut": 0, "clearAll": 0, "chapterUpdateTime": 1700000000,
+             "updated": data.chapters(book_id)}
+            for book_id in book_ids
+        ]})
+
+    def _notebooks(self, path, query, body):
+        data = self.server.data
+        books = []
+        for book_id in data.shelf_book_ids[:200]:
+            book = data.book(book_id)
+            books.append({
+                "bookId": book_id,
+                "book": {key: book[key] for key in ("bookId", "title", "author", "cover")},
+                "reviewCount": 0,
+                "noteCount": sum(1 for bookmark in data.bookmarks(book_id) if bookmark.get("noteText")),
+                "bookmarkCount": data.bookmarks_per_book,
+                "sort": book["readUpdateTime"],
+            })
+        self._send_json(path, 200, {"synckey": 1760000000, "totalBookCount": len(books), "books": books})
+
+    def _renewal(self, path, cookies):
+        if not cookies.get("wr_rt"):
+            return self._send_json(path, 200, {"errcode": -2012, "errmsg": "登录超时"})
+        old_skey = cookies.get("wr_skey")
+        if old_skey:
+            self.server.revoked_skeys.add(old_skey)
+        new_skey = secrets.token_hex(4)
+        self._send(path, 200, b'{"succ":1}', "application/json",
+                   extra_headers=[("Set-Cookie", f"wr_skey={new_skey}; Path=/; HttpOnly")])
+
+    def _control(self, method, path, body):
+        if path == "/__fake/config":
+            if method == "POST":
+                self.server.faults.update(body or {})
+            return self._send_json(path, 200, self.server.faults.as_dict(), record=False)
+        if path == "/__fake/stats":
+            with self.server.stats_lock:
+                stats = dict(self.server.stats)
+            return self._send_json(path, 200, stats, record=False)
+        if path == "/__fake/revoke":
+            # 作废指定的 wr_skey，模拟凭证过期
+            self.server.revoked_skeys.add((body or {}).get("wr_skey", ""))
+            return self._send_json(path, 200, {"revoked": len(self.server.revoked_skeys)}, record=False)
+        self._send_json(path, 404, {"errmsg": "not found"}, record=False)
+
+    # ---- 工具 ----
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return None
+        raw = self.rfile.read(length)
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    def _cookies(self) -> dict:
+        cookies = {}
+        for item in (self.headers.get("Cookie") or "").split(';'):
+            key, _, value = item.strip().partition('=')
+            if key:
+                cookies[key] = value
+        return cookies
+
+    def _send_json(self, path: str, status: int, payload, record: bool = True) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self._send(path, status, body, "application/json; charset=utf-8", record=record)
+
+    def _send(self, path: str, status: int, body: bytes, content_type: str,
+              extra_headers=(), record: bool = True) -> None:
+        if record:
+            self.server.record(path, status)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in extra_headers:
+            self.send_header(key, value)
+        self.end_headers()
+
+        faults = self.server.faults
+        if record and faults.applies_to(path) and random.random() < faults.slow_body_rate:
+            # 慢响应体：在 slow_body_ms 内分块写出
+            chunks = 10
+            size = max(1, -(-len(body) // chunks))
+            for start in range(0, len(body), size):
+                self.wfile.write(body[start:start + size])
+                self.wfile.flush()
+                time.sleep(faults.slow_body_ms / 1000 / chunks)
+        else:
+            self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地微信读书上游模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, help="书架页面模板（默认仓库中的 response.html）")
+    parser.add_argument("--books", type=int, default=0, help="合成书架的书籍数，0 表示原样返回模板中的书架")
+    parser.add_argument("--full-ratio", type=float, default=0.12, help="带完整信息（rawBooks）的书籍比例")
+    parser.add_argument("--chapters", type=int, default=30, help="每本书的章节数")
+    parser.add_argument("--bookmarks", type=int, default=40, help="每本书的书签数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--unauthorized-rate", type=float, default=0)
+    parser.add_argument("--not-found-rate", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0, help="返回 500/502/503 的比例")
+    parser.add_argument("--slow-body-rate", type=float, default=0)
+    parser.add_argument("--slow-body-ms", type=float, default=2000)
+    parser.add_argument("--fault-endpoints", default="", help="只对这些路径注入故障，逗号分隔，如 /web/book/info,syncBook")
+    args = parser.parse_args()
+
+    with open(args.template, encoding='utf-8') as f:
+        template = f.read()
+    data = FakeData(template, book_count=args.books, full_ratio=args.full_ratio,
+                    chapters_per_book=args.chapters, bookmarks_per_book=args.bookmarks, seed=args.seed)
+    faults = FaultConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, unauthorized_rate=args.unauthorized_rate,
+        not_found_rate=args.not_found_rate, error_rate=args.error_rate, slow_body_rate=args.slow_body_rate,
+        slow_body_ms=args.slow_body_ms, endpoints=[item for item in args.fault_endpoints.split(',') if item],
+    )
+    server = FakeWeReadServer((args.host, args.port), data, faults)
+    print(f"📚 模拟微信读书服务: http://{args.host}:{args.port}, 书架 {len(data.shelf_book_ids)} 本书, "
+          f"页面 {len(data.shelf_html) / 1024:.0f} KB")
+    print(f"   故障注入: {json.dumps(faults.as_dict(), ensure_ascii=False)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
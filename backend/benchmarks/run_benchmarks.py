@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+后端热点路径基准测试套件：结果按提交保存为JSON，可与之前任意提交的结果对比
+
+覆盖：
+- _extract_books_from_html：仓库中的 response.html 和合成的 10k 本书书架
+- _normalize_book_data_from_html
+- search_books_ranked（不限条数：全书架打分 + 全部命中排序）
+- 笔记Markdown / HTML 生成
+- get_books 分页（临时SQLite数据库 + TestClient，经过认证、查询、补全、序列化的完整路径）
+- books_data 的JSON序列化/反序列化和ORM加载
+
+用法:
+    python benchmarks/run_benchmarks.py                      # 运行全部并保存到 benchmarks/results/<commit>.json
+    python benchmarks/run_benchmarks.py -k search --runs 50  # 只运行名称包含 search 的基准
+    python benchmarks/run_benchmarks.py --compare HEAD~1     # 与指定提交（或结果文件）对比
+    python benchmarks/run_benchmarks.py --compare latest --fail-on-regression
+"""
+
+import os
+import sys
+import tempfile
+
+# 数据库配置在导入时读取：始终使用临时数据库，不会写入开发或生产数据库
+_TMP_DIR = tempfile.mkdtemp(prefix="weread-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP_DIR, 'bench.db')}"
+os.environ["SHELF_REFRESH_ENABLED"] = "false"
+
+import json
+import shutil
+import argparse
+import platform
+import itertools
+import contextlib
+import subprocess
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_search import build_synthetic_shelf, time_query, QUERIES
+from bench_notes import build_synthetic_notebook
+from fake_weread import FakeData, DEFAULT_TEMPLATE
+from weread_api import WeReadAPI
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# name -> (setup, runs)；setup 返回被计时的无参函数
+BENCHMARKS: Dict[str, tuple] = {}
+
+
+def benchmark(name: str, runs: int = 20):
+    def register(setup: Callable[["BenchContext"], Callable[[], object]]):
+        BENCHMARKS[name] = (setup, runs)
+        return setup
+    return register
+
+
+@contextlib.contextmanager
+def quiet():
+    """被测代码的 print 照常执行（格式化开销计入耗时），但不输出到终端"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+class BenchContext:
+    """各基准共享的测试数据，按需构建一次"""
+
+    def __init__(self, books: int):
+        self.books = books
+        self._cache = {}
+        self._cleanups: List[Callable[[], object]] = []
+
+    def add_cleanup(self, fn: Callable[[], object]) -> None:
+        self._cleanups.append(fn)
+
+    def close(self) -> None:
+        # TestClient 的事件循环线程属于线程池，解释器退出时会先等待它结束，atexit 来不及关闭，因此需要显式关闭
+        with quiet():
+            while self._cleanups:
+                self._cleanups.pop()()
+
+    def _get(self, key, build):
+        if key not in self._cache:
+            with quiet():
+                self._cache[key] = build()
+        return self._cache[key]
+
+    @property
+    def template(self) -> str:
+        def build():
+            with open(DEFAULT_TEMPLATE, encoding='utf-8') as f:
+                return f.read()
+        return self._get("template", build)
+
+    @property
+    def synthetic_shelf(self) -> FakeData:
+        """与真实书架结构相同的合成书架页面（部分书籍只有ID）"""
+        return self._get("synthetic_shelf", lambda: FakeData(self.template, book_count=self.books))
+
+    @property
+    def shelf_data(self) -> dict:
+        """get_user_data_enhanced 返回结构的书架数据"""
+        return self._get("shelf_data", lambda: build_synthetic_shelf(self.books))
+
+    @property
+    def api(self) -> WeReadAPI:
+        return self._get("api", lambda: WeReadAPI(""))
+
+
+# ---- 书架页面解析 ----
+
+@benchmark("extract_books_from_html/response.html")
+def bench_extract_response_html(ctx: BenchContext):
+    html = ctx.template
+    return lambda: ctx.api._extract_books_from_html(html, "0")
+
+
+@benchmark("extract_books_from_html/synthetic", runs=5)
+def bench_extract_synthetic_html(ctx: BenchContext):
+    html = ctx.synthetic_shelf.shelf_html.decode('utf-8')
+    return lambda: ctx.api._extract_books_from_html(html, "0")
+
+
+@benchmark("normalize_book_data_from_html/rawBooks")
+def bench_normalize_raw_books(ctx: BenchContext):
+    raw_books = ctx.synthetic_shelf.shelf['rawBooks']
+    normalize = ctx.api._normalize_book_data_from_html
+    return lambda: [normalize(book, "rawBooks") for book in raw_books]
+
+
+# ---- 搜索 ----
+
+@benchmark("search_books_ranked/synthetic")
+def bench_search_books(ctx: BenchContext):
+    # 不传 limit：计时覆盖全部命中的排序，不被 top-k 截断掩盖
+    user_data = ctx.shelf_data
+    queries = itertools.cycle(QUERIES)
+    return lambda: ctx.api.search_books_ranked(user_data, next(queries))
+
+
+# ---- 笔记生成 ----
+
+def _notebook(ctx: BenchContext):
+    return ctx._get("notebook", lambda: build_synthetic_notebook(5000, 120))
+
+
+@benchmark("notes/markdown")
+def bench_notes_markdown(ctx: BenchContext):
+    bookmarks_data, chapters = _notebook(ctx)
+    return lambda: ctx.api.get_markdown_content_simple("bench", 1, bookmarks_data, chapters)
+
+
+@benchmark("notes/html")
+def bench_notes_html(ctx: BenchContext):
+    bookmarks_data, chapters = _notebook(ctx)
+    return lambda: ''.join(ctx.api.iter_html_chapters("bench", 1, bookmarks_data, chapters))
+
+
+# ---- books_data 序列化 ----
+
+@benchmark("books_data/json_dumps")
+def bench_books_data_dumps(ctx: BenchContext):
+    books_data = ctx.shelf_data
+    return lambda: json.dumps(books_data, ensure_ascii=False)
+
+
+@benchmark("books_data/json_loads")
+def bench_books_data_loads(ctx: BenchContext):
+    payload = json.dumps(ctx.shelf_data, ensure_ascii=False)
+    return lambda: json.loads(payload)
+
+
+# ---- 端到端 ----
+
+def _e2e_client(ctx: BenchContext):
+    """临时数据库中的一个用户和 books 本书的书架，以及已进入生命周期的 TestClient"""
+    def build():
+        from fastapi.testclient import TestClient
+        import main
+        from auth import create_access_token
+        from database import SessionLocal
+        from models import User
+        from shelf_store import save_user_books
+
+        db = SessionLocal()
+        try:
+            db.add(User(id=1, wr_vid="1", wr_skey="bench", wr_rt="bench", wr_gid="bench",
+                        wr_name="bench", is_active=True))
+            db.commit()
+            save_user_books(db, 1, ctx.shelf_data)
+        finally:
+            db.close()
+
+        client = TestClient(main.app)
+        client.__enter__()
+        ctx.add_cleanup(lambda: client.__exit__(None, None, None))
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': '1'})}"}
+        return client, headers
+    return ctx._get("e2e_client", build)
+
+
+@benchmark("get_books/pagination")
+def bench_get_books_pagination(ctx: BenchContext):
+    client, headers = _e2e_client(ctx)
+    pages = itertools.cycle(range(1, min(50, ctx.books // 20) + 1))
+
+    def request_page():
+        response = client.get(f"/api/books?page={next(pages)}&page_size=20", headers=headers)
+        if response.status_code != 200 or not response.json().get('success'):
+            raise RuntimeError(f"get_books 失败: {response.status_code} {response.text[:200]}")
+    return request_page
+
+
+@benchmark("books_data/orm_load")
+def bench_books_data_orm_load(ctx: BenchContext):
+    _e2e_client(ctx)
+    from database import SessionLocal
+    from models import UserBooks
+
+    def load():
+        db = SessionLocal()
+        try:
+            return db.query(UserBooks).filter(UserBooks.user_id == 1).first().books_data
+        finally:
+            db.close()
+    return load
+
+
+# ---- 运行和结果存储 ----
+
+def git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(["git", *args], cwd=BENCH_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def current_revision() -> Dict:
+    commit = git("rev-parse", "--short", "HEAD") or "unknown"
+    dirty = bool(git("status", "--porcelain", "--untracked-files=no"))
+    return {
+        "commit": commit,
+        "subject": git("log", "-1", "--format=%s") or "",
+        "dirty": dirty,
+        "label": f"{commit}-dirty" if dirty else commit,
+    }
+
+
+def run(names: List[str], books: int, runs: Optional[int]) -> Dict[str, Dict]:
+    ctx = BenchContext(books)
+    results = {}
+    print(f"{'benchmark':<42}{'median(ms)':>12}{'p95(ms)':>10}{'min(ms)':>10}")
+    try:
+        for name in names:
+            setup, default_runs = BENCHMARKS[name]
+            fn = setup(ctx)
+            with quiet():
+                # 预热一次，排除首次导入和缓存构建
+                fn()
+                stats = time_query(fn, runs or default_runs)
+            stats["runs"] = runs or default_runs
+            results[name] = stats
+            print(f"{name:<42}{stats['median_ms']:>12.2f}{stats['p95_ms']:>10.2f}{stats['min_ms']:>10.2f}")
+    finally:
+        ctx.close()
+    return results
+
+
+def result_path(label: str) -> str:
+    return os.path.join(RESULTS_DIR, f"{label}.json")
+
+
+def load_baseline(ref: str, exclude: str) -> Optional[Dict]:
+    """ref 可以是结果文件路径、提交（任意git引用）或 latest（最近一次保存的其他结果）"""
+    if os.path.isfile(ref):
+        path = ref
+    elif ref == "latest":
+        candidates = [
+            os.path.join(RESULTS_DIR, name) for name in os.listdir(RESULTS_DIR)
+            if name.endswith(".json") and name != f"{exclude}.json"
+        ] if os.path.isdir(RESULTS_DIR) else []
+        if not candidates:
+            return None
+        path = max(candidates, key=os.path.getmtime)
+    else:
+        commit = git("rev-parse", "--short", ref) or ref
+        path = result_path(commit)
+        if not os.path.isfile(path):
+            return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(baseline: Dict, results: Dict[str, Dict], threshold: float) -> List[str]:
+    """打印与基线的对比，返回中位数变慢超过 threshold 的基准"""
+    regressions = []
+    print(f"\n对比基线 {baseline.get('label')} ({baseline.get('subject', '')})")
+    print(f"{'benchmark':<42}{'base(ms)':>12}{'now(ms)':>10}{'change':>10}")
+    for name, stats in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"{name:<42}{'n/a':>12}{stats['median_ms']:>10.2f}{'new':>10}")
+            continue
+        change = stats["median_ms"] / base["median_ms"] - 1 if base["median_ms"] else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  ⚠️ 变慢"
+        elif change < -threshold:
+            flag = "  ✅ 变快"
+        print(f"{name:<42}{base['median_ms']:>12.2f}{stats['median_ms']:>10.2f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="后端热点路径基准测试")
+    parser.add_argument("-k", "--filter", default="", help="只运行名称包含该字符串的基准")
+    parser.add_argument("--books", type=int, default=10000, help="合成书架的书籍数")
+    parser.add_argument("--runs", type=int, default=None, help="每个基准的运行次数（默认按基准设置）")
+    parser.add_argument("--compare", default=None, help="对比的基线：git引用、结果文件路径或 latest")
+    parser.add_argument("--threshold", type=float, default=0.10, help="中位数变化超过该比例视为回归")
+    parser.add_argument("--fail-on-regression", action="store_true", help="出现回归时以非零状态退出")
+    parser.add_argument("--no-save", action="store_true", help="不保存本次结果")
+    parser.add_argument("--list", action="store_true", help="列出所有基准")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    if args.list:
+        print('\n'.join(names))
+        return
+
+    revision = current_revision()
+    print(f"📊 基准测试 @ {revision['label']}: {len(names)} 项, 合成书架 {args.books} 本书")
+    try:
+        results = run(names, args.books, args.runs)
+    finally:
+        shutil.rmtree(_TMP_DIR, ignore_errors=True)
+
+    report = dict(revision)
+    report.update({
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "books": args.books,
+        "results": results,
+    })
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = result_path(revision["label"])
+        # 只运行部分基准时合并到该提交已有的结果中
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                previous = json.load(f)
+            report["results"] = dict(previous.get("results", {}), **results)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {os.path.relpath(path)}")
+
+    if args.compare:
+        baseline = load_baseline(args.compare, revision["label"])
+        if baseline is None:
+            print(f"⚠️ 没有找到基线结果: {args.compare}")
+            return
+        regressions = compare(baseline, results, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
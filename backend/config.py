@@ -19,6 +19,42 @@ class Settings(BaseSettings):
     # WeRead API
     weread_base_url: str = "https://i.weread.qq.com"
     weread_web_url: str = "https://weread.qq.com"
+    # Shared HTTP connection pool size and number of cached per-user API clients
+    weread_http_pool_size: int = 32
+    weread_client_cache_size: int = 1024
+
+    # Shelf loading: "enhanced" waits for syncBook on every id-only book,
+    # "progressive" saves rawBooks first and enriches the rest in the background,
+    # "lazy" only enriches id-only books on requested pages plus a prefetch window
+    shelf_load_mode: str = "progressive"
+    lazy_enrich_prefetch_pages: int = 1
+    # Enriched id-only books are re-synced through syncBook after this many seconds
+    shelf_detail_resync_seconds: int = 86400
+
+    # Background shelf refresh
+    shelf_refresh_enabled: bool = True
+    shelf_refresh_interval_seconds: int = 30 * 60
+    shelf_refresh_min_interval_seconds: int = 10 * 60
+    shelf_refresh_max_interval_seconds: int = 6 * 60 * 60
+    shelf_refresh_concurrency: int = 2
+    shelf_refresh_jitter: float = 0.2
+
+    # Bulk notes export
+    notes_export_concurrency: int = 4
+    notes_export_job_ttl_seconds: int = 7 * 24 * 60 * 60
+
+    # WeRead credentials: how long a 401'd wr_skey is short-circuited,
+    # and how old credentials get before the background scheduler renews them via wr_rt
+    credential_expired_ttl_seconds: int = 10 * 60
+    credential_renew_after_seconds: int = 60 * 60
+
+    # Auth caches (per worker): verified JWTs and user rows
+    auth_token_cache_ttl_seconds: int = 300
+    auth_user_cache_ttl_seconds: int = 60
+    auth_cache_max_entries: int = 4096
+
+    # Metrics: how often the event loop lag probe wakes up
+    metrics_loop_lag_interval_seconds: float = 0.5
 
     # CORS
     cors_origins: List[str] = ["http://localhost:3000", "http://127.0.0.1:3000"]
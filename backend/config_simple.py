@@ -12,8 +12,44 @@ class Settings:
         self.access_token_expire_minutes = 30 * 24 * 60  # 30 days
 
         # WeRead API
-        self.weread_base_url = "https://i.weread.qq.com"
-        self.weread_web_url = "https://weread.qq.com"
+        self.weread_base_url = os.getenv("WEREAD_BASE_URL", "https://i.weread.qq.com")
+        self.weread_web_url = os.getenv("WEREAD_WEB_URL", "https://weread.qq.com")
+        # Shared HTTP connection pool size and number of cached per-user API clients
+        self.weread_http_pool_size = int(os.getenv("WEREAD_HTTP_POOL_SIZE", 32))
+        self.weread_client_cache_size = int(os.getenv("WEREAD_CLIENT_CACHE_SIZE", 1024))
+
+        # Shelf loading: "enhanced" waits for syncBook on every id-only book,
+        # "progressive" saves rawBooks first and enriches the rest in the background,
+        # "lazy" only enriches id-only books on requested pages plus a prefetch window
+        self.shelf_load_mode = os.getenv("SHELF_LOAD_MODE", "progressive")
+        self.lazy_enrich_prefetch_pages = int(os.getenv("LAZY_ENRICH_PREFETCH_PAGES", 1))
+        # Enriched id-only books are re-synced through syncBook after this many seconds
+        self.shelf_detail_resync_seconds = int(os.getenv("SHELF_DETAIL_RESYNC_SECONDS", 86400))
+
+        # Background shelf refresh
+        self.shelf_refresh_enabled = os.getenv("SHELF_REFRESH_ENABLED", "true").lower() == "true"
+        self.shelf_refresh_interval_seconds = int(os.getenv("SHELF_REFRESH_INTERVAL_SECONDS", 30 * 60))
+        self.shelf_refresh_min_interval_seconds = int(os.getenv("SHELF_REFRESH_MIN_INTERVAL_SECONDS", 10 * 60))
+        self.shelf_refresh_max_interval_seconds = int(os.getenv("SHELF_REFRESH_MAX_INTERVAL_SECONDS", 6 * 60 * 60))
+        self.shelf_refresh_concurrency = int(os.getenv("SHELF_REFRESH_CONCURRENCY", 2))
+        self.shelf_refresh_jitter = float(os.getenv("SHELF_REFRESH_JITTER", 0.2))
+
+        # Bulk notes export
+        self.notes_export_concurrency = int(os.getenv("NOTES_EXPORT_CONCURRENCY", 4))
+        self.notes_export_job_ttl_seconds = int(os.getenv("NOTES_EXPORT_JOB_TTL_SECONDS", 7 * 24 * 60 * 60))
+
+        # WeRead credentials: how long a 401'd wr_skey is short-circuited,
+        # and how old credentials get before the background scheduler renews them via wr_rt
+        self.credential_expired_ttl_seconds = int(os.getenv("CREDENTIAL_EXPIRED_TTL_SECONDS", 10 * 60))
+        self.credential_renew_after_seconds = int(os.getenv("CREDENTIAL_RENEW_AFTER_SECONDS", 60 * 60))
+
+        # Auth caches (per worker): verified JWTs and user rows
+        self.auth_token_cache_ttl_seconds = int(os.getenv("AUTH_TOKEN_CACHE_TTL_SECONDS", 300))
+        self.auth_user_cache_ttl_seconds = int(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", 60))
+        self.auth_cache_max_entries = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", 4096))
+
+        # Metrics: how often the event loop lag probe wakes up
+        self.metrics_loop_lag_interval_seconds = float(os.getenv("METRICS_LOOP_LAG_INTERVAL_SECONDS", 0.5))
 
         # CORS
         self.cors_origins = ["http://localhost:3000", "http://127.0.0.1:3000"]
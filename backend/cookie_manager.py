@@ -5,12 +5,17 @@ import os
 from typing import Dict, Optional, Tuple
 from datetime import datetime, timedelta
 
+try:
+    from config import settings
+except ImportError:
+    from config_simple import settings
+
 
 class CookieManager:
     """微信读书Cookie管理器，参考mcp-server-weread项目实现"""
     
     def __init__(self):
-        self.weread_base_url = "https://i.weread.qq.com"
+        self.weread_base_url = settings.weread_base_url
         self.cookie_cache = {}
         self.cache_expiry = {}
     
@@ -79,11 +84,11 @@ class CookieManager:
                 'Sec-Fetch-Mode': 'navigate',
                 'Sec-Fetch-Site': 'same-origin',
                 'Cookie': cookie_string,
-                'Referer': 'https://weread.qq.com/'
+                'Referer': f'{settings.weread_web_url}/'
             }
             
             # 使用新的web shelf API进行验证
-            test_url = f"https://weread.qq.com/web/shelf"
+            test_url = f"{settings.weread_web_url}/web/shelf"
             response = requests.get(test_url, headers=headers, timeout=15, verify=False)
             
             if response.status_code == 200:
@@ -204,11 +209,11 @@ class CookieManager:
                 'Sec-Fetch-Mode': 'navigate',
                 'Sec-Fetch-Site': 'same-origin',
                 'Cookie': cookie_string,
-                'Referer': 'https://weread.qq.com/',
+                'Referer': f'{settings.weread_web_url}/',
             }
             
             # 使用新的web shelf API获取书架信息
-            url = f"https://weread.qq.com/web/shelf"
+            url = f"{settings.weread_web_url}/web/shelf"
             response = requests.get(url, headers=headers, timeout=15, verify=False)
             
             if response.status_code == 200:
@@ -18,6 +18,16 @@ def create_note_sync_table():
         print("✅ book_note_sync 表创建成功")
     except Exception as e:
         print(f"❌ 创建表失败: {e}")
+        return
+
+    try:
+        # 已有的表补建 (user_id, book_id) 唯一索引；存在重复记录时需先清理
+        for index in BookNoteSync.__table__.indexes:
+            if index.unique:
+                index.create(engine, checkfirst=True)
+        print("✅ book_note_sync 唯一索引创建成功")
+    except Exception as e:
+        print(f"❌ 创建唯一索引失败（可能存在重复的笔记记录）: {e}")
 
 if __name__ == "__main__":
     create_note_sync_table()
\ No newline at end of file
@@ -0,0 +1,152 @@
+# 微信读书凭证管理：第一次401即判定 wr_skey 失效，同一凭证的后续请求直接短路；
+# 有 wr_rt 时先尝试续期，续期成功后写回用户记录，其他持有旧凭证的客户端直接换用新的 wr_skey
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from database import SessionLocal
+from models import User
+
+try:
+    from config import settings
+except ImportError:
+    from config_simple import settings
+
+# (wr_vid, wr_skey)
+CredentialKey = Tuple[str, str]
+
+
+class CredentialManager:
+    """
+    进程内的凭证状态
+
+    - 失效标记：一次401后该凭证在 credential_expired_ttl_seconds 内的所有请求不再发往微信读书
+    - 续期：同一凭证的并发401只触发一次续期请求，其他请求等待并复用结果
+    """
+
+    def __init__(self, expired_ttl_seconds: float = 600):
+        self.expired_ttl_seconds = expired_ttl_seconds
+        # 凭证 -> 失效标记的过期时间
+        self._expired: Dict[CredentialKey, float] = {}
+        # 旧凭证 -> (续期得到的 wr_skey, 续期时间)
+        self._renewed: Dict[CredentialKey, Tuple[str, float]] = {}
+        self._key_locks: Dict[CredentialKey, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def is_expired(self, key: CredentialKey) -> bool:
+        expires_at = self._expired.get(key)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            with self._lock:
+                self._expired.pop(key, None)
+            return False
+        return True
+
+    def renewed_skey(self, key: CredentialKey) -> Optional[str]:
+        """该凭证已被续期时返回新的 wr_skey"""
+        entry = self._renewed.get(key)
+        if entry is None:
+            return None
+        if entry[1] + self.expired_ttl_seconds < time.monotonic():
+            with self._lock:
+                self._renewed.pop(key, None)
+            return None
+        return entry[0]
+
+    def mark_expired(self, key: CredentialKey) -> None:
+        with self._lock:
+            self._prune()
+            self._expired[key] = time.monotonic() + self.expired_ttl_seconds
+        print(f"🔐 凭证已失效，{self.expired_ttl_seconds:.0f}s 内该用户的微信读书请求将直接返回: vid={key[0]}")
+
+    def handle_unauthorized(self, weread_api) -> bool:
+        """
+        请求返回401时调用：尝试续期，成功时客户端已换用新的 wr_skey
+
+        Returns:
+            是否可以用新凭证重试
+        """
+        key = weread_api.credential_key
+        with self._key_lock(key):
+            new_skey = self.renewed_skey(key)
+            if new_skey is None:
+                if self.is_expired(key):
+                    return False
+                new_skey = self._renew(weread_api, key)
+                if new_skey is None:
+                    self.mark_expired(key)
+                    return False
+        weread_api.apply_skey(new_skey)
+        return True
+
+    def renew_if_due(self, db, user: User, weread_api) -> bool:
+        """
+        距上次更新凭证超过 credential_renew_after_seconds 时主动续期（由后台刷新调度调用）
+
+        Returns:
+            是否续期成功
+        """
+        last_update = user.updated_at or user.created_at
+        if not user.wr_rt or last_update is None:
+            return False
+        if last_update.tzinfo is None:
+            last_update = last_update.replace(tzinfo=timezone.utc)
+        age = (datetime.now(timezone.utc) - last_update).total_seconds()
+        if age < settings.credential_renew_after_seconds:
+            return False
+
+        key = weread_api.credential_key
+        with self._key_lock(key):
+            if self.renewed_skey(key) or self.is_expired(key):
+                return False
+            new_skey = self._renew(weread_api, key)
+        if new_skey is None:
+            return False
+        weread_api.apply_skey(new_skey)
+        db.refresh(user)
+        return True
+
+    def _renew(self, weread_api, key: CredentialKey) -> Optional[str]:
+        new_skey = weread_api.renew_session()
+        if not new_skey or new_skey == key[1]:
+            return None
+        with self._lock:
+            self._renewed[key] = (new_skey, time.monotonic())
+        self._persist(key, new_skey)
+        print(f"🔑 凭证续期成功: vid={key[0]}")
+        return new_skey
+
+    def _persist(self, key: CredentialKey, new_skey: str) -> None:
+        """把新的 wr_skey 写回持有旧凭证的用户（按对象更新，触发用户缓存失效）"""
+        db = SessionLocal()
+        try:
+            for user in db.query(User).filter(User.wr_vid == key[0], User.wr_skey == key[1]):
+                user.wr_skey = new_skey
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ 续期后的凭证保存失败: vid={key[0]} - {e}")
+        finally:
+            db.close()
+
+    def _key_lock(self, key: CredentialKey) -> threading.Lock:
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, expires_at in self._expired.items() if expires_at < now]:
+            del self._expired[key]
+            self._key_locks.pop(key, None)
+        for key in [key for key, (_, renewed_at) in self._renewed.items()
+                    if renewed_at + self.expired_ttl_seconds < now]:
+            del self._renewed[key]
+            self._key_locks.pop(key, None)
+
+
+credential_manager = CredentialManager(expired_ttl_seconds=settings.credential_expired_ttl_seconds)
@@ -0,0 +1,127 @@
+# 书架分面索引：分类、阅读状态、评分档位的倒排位图，筛选和计数都不需要重新扫描书架
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from metrics import record_cache
+from shelf_store import on_shelf_change
+
+# 与前端 getRatingImage 保持一致的评分档位
+RATING_TIERS = ['神作', '好评如潮', '脍炙人口', '值得一读', '褒贬不一', '不值一读']
+UNRATED = '暂无评级'
+FACET_FIELDS = ('category', 'finishReading', 'rating')
+
+
+def rating_tier(book: Dict) -> str:
+    """将 newRatingDetail 归入评分档位，'评分: 743/1000' 之类的纯数字评分归为暂无评级"""
+    detail = book.get('newRatingDetail', '')
+    if isinstance(detail, dict):
+        detail = detail.get('title', '')
+    detail = (detail or '').strip() if isinstance(detail, str) else ''
+    return detail if detail in RATING_TIERS else UNRATED
+
+
+def facet_values(book: Dict) -> Dict[str, str]:
+    """书籍在各个分面上的取值"""
+    return {
+        'category': book.get('category') or '未分类',
+        'finishReading': '1' if book.get('finishReading') == 1 else '0',
+        'rating': rating_tier(book),
+    }
+
+
+class FacetIndex:
+    """
+    单个用户书架的分面位图
+    第 i 本书对应位图的第 i 位，用Python大整数做按位与/或，用 bit_count 计数
+    """
+
+    def __init__(self, books: List[Dict], version: int = 0):
+        self.version = version
+        self.book_ids: List[str] = []
+        self.position: Dict[str, int] = {}
+        self.postings: Dict[str, Dict[str, int]] = {field: {} for field in FACET_FIELDS}
+
+        for book in books:
+            book_id = book.get('bookId')
+            if not book_id or book_id in self.position:
+                continue
+            idx = len(self.book_ids)
+            self.book_ids.append(book_id)
+            self.position[book_id] = idx
+            bit = 1 << idx
+            for field, value in facet_values(book).items():
+                postings = self.postings[field]
+                postings[value] = postings.get(value, 0) | bit
+
+        self.all_bits = (1 << len(self.book_ids)) - 1
+
+    def filter_bitmap(self, filters: Dict[str, Optional[str]]) -> int:
+        """同一分面内单值匹配，不同分面之间取交集；未指定的分面不限制"""
+        bitmap = self.all_bits
+        for field, value in filters.items():
+            if value is None or value == '' or field not in self.postings:
+                continue
+            bitmap &= self.postings[field].get(str(value), 0)
+        return bitmap
+
+    def bitmap_of(self, book_ids: Iterable[str]) -> int:
+        """把一组 bookId 转为位图（先写入bytearray，避免逐位做大整数运算）"""
+        bits = bytearray((len(self.book_ids) + 7) // 8)
+        for book_id in book_ids:
+            idx = self.position.get(book_id)
+            if idx is not None:
+                bits[idx >> 3] |= 1 << (idx & 7)
+        return int.from_bytes(bits, 'little')
+
+    def contains(self, bitmap: int, book_id: str) -> bool:
+        idx = self.position.get(book_id)
+        return idx is not None and bool(bitmap >> idx & 1)
+
+    def counts(self, bitmap: Optional[int] = None) -> Dict[str, Dict[str, int]]:
+        """各分面取值在 bitmap 范围内的数量，按数量降序"""
+        if bitmap is None:
+            bitmap = self.all_bits
+        result = {}
+        for field, postings in self.postings.items():
+            field_counts = {value: (bits & bitmap).bit_count() for value, bits in postings.items()}
+            result[field] = dict(sorted(
+                ((value, count) for value, count in field_counts.items() if count > 0),
+                key=lambda item: item[1], reverse=True
+            ))
+        return result
+
+
+class FacetRegistry:
+    """按用户缓存 FacetIndex，版本落后时用调用方提供的书籍列表重建"""
+
+    def __init__(self):
+        self._indexes: Dict[int, FacetIndex] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, version: int, books: Optional[List[Dict]] = None) -> Optional[FacetIndex]:
+        index = self._indexes.get(user_id)
+        hit = index is not None and index.version >= version
+        record_cache("facet_index", hit)
+        if hit:
+            return index
+        if books is None:
+            return None
+        return self.build(user_id, books, version)
+
+    def build(self, user_id: int, books: List[Dict], version: int) -> FacetIndex:
+        index = FacetIndex(books, version)
+        with self._lock:
+            current = self._indexes.get(user_id)
+            if current is None or current.version <= version:
+                self._indexes[user_id] = index
+        return index
+
+
+# 全局分面索引实例
+facet_registry = FacetRegistry()
+
+
+@on_shelf_change
+def _rebuild_facets_on_shelf_change(db, user_id: int, old_data, new_data: Dict, version: int) -> None:
+    books = new_data.get('books', []) if isinstance(new_data, dict) else []
+    facet_registry.build(user_id, books, version)
@@ -1,5 +1,6 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, status, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 import uvicorn
@@ -13,6 +14,9 @@ from database import get_db, engine
 from models import Base
 from routers import auth, books, notes, search
 from config import settings
+from refresh_scheduler import shelf_refresh_scheduler
+from weread_api import CookieExpiredException
+from metrics import CONTENT_TYPE_LATEST, loop_lag_monitor, render_metrics
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -32,6 +36,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Disposition", "X-Export-Job-Id"],
 )
 
 # Include routers
@@ -40,6 +45,30 @@ app.include_router(books.router, prefix="/api/books", tags=["books"])
 app.include_router(notes.router, prefix="/api/notes", tags=["notes"])
 app.include_router(search.router, prefix="/api/search", tags=["search"])
 
+@app.exception_handler(CookieExpiredException)
+async def cookie_expired_handler(request: Request, exc: CookieExpiredException):
+    """微信读书凭证失效且续期失败：统一返回401，前端据此跳转登录"""
+    return JSONResponse(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        content={
+            "success": False,
+            "message": "登录已过期，请重新登录",
+            "detail": "登录已过期，请重新登录",
+            "data": {"error": "LOGIN_EXPIRED", "need_login": True}
+        }
+    )
+
+@app.on_event("startup")
+async def start_background_refresh():
+    loop_lag_monitor.start()
+    if settings.shelf_refresh_enabled:
+        shelf_refresh_scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_background_refresh():
+    await shelf_refresh_scheduler.stop()
+    await loop_lag_monitor.stop()
+
 @app.get("/")
 async def root():
     return {"message": "WeRead Tool API is running", "docs": "/docs"}
@@ -48,6 +77,11 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now()}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: upstream latency/status/bytes per endpoint, cache hit ratios, event loop lag"""
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
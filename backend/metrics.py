@@ -0,0 +1,149 @@
+# 进程内指标（prometheus_client）：上游请求耗时/状态码/响应大小、各缓存层命中率、事件循环延迟
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import disable_created_metrics
+from prometheus_client.core import GaugeMetricFamily
+
+try:
+    from config import settings
+except ImportError:
+    from config_simple import settings
+
+# 不输出每个时间序列的 *_created 样本
+disable_created_metrics()
+
+# 独立的注册表：只输出本服务的指标
+registry = CollectorRegistry()
+
+upstream_latency = Histogram(
+    "weread_upstream_request_duration_seconds",
+    "Latency of requests to WeRead by named endpoint",
+    ("endpoint", "method"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30),
+    registry=registry,
+)
+upstream_requests = Counter(
+    "weread_upstream_requests_total",
+    "Requests to WeRead by named endpoint and status code (timeout / error when no response)",
+    ("endpoint", "status"),
+    registry=registry,
+)
+upstream_response_bytes = Histogram(
+    "weread_upstream_response_bytes",
+    "Response body size of requests to WeRead by named endpoint",
+    ("endpoint",),
+    buckets=(1024, 10240, 102400, 512000, 1048576, 5242880, 20971520),
+    registry=registry,
+)
+upstream_short_circuits = Counter(
+    "weread_upstream_short_circuit_total",
+    "Requests not sent because the user's credential is marked expired",
+    ("endpoint",),
+    registry=registry,
+)
+cache_requests = Counter(
+    "weread_cache_requests_total",
+    "Cache lookups by cache layer and result (hit / miss)",
+    ("cache", "result"),
+    registry=registry,
+)
+event_loop_lag = Histogram(
+    "weread_event_loop_lag_seconds",
+    "Delay of a periodic event loop wake-up beyond its scheduled time",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    registry=registry,
+)
+event_loop_lag_last = Gauge(
+    "weread_event_loop_lag_last_seconds",
+    "Most recently measured event loop lag",
+    registry=registry,
+)
+
+
+def observe_upstream(endpoint: str, method: str, status: str, seconds: float,
+                     response_bytes: Optional[int] = None) -> None:
+    """记录一次上游请求"""
+    upstream_latency.labels(endpoint=endpoint, method=method).observe(seconds)
+    upstream_requests.labels(endpoint=endpoint, status=status).inc()
+    if response_bytes is not None:
+        upstream_response_bytes.labels(endpoint=endpoint).observe(response_bytes)
+
+
+def record_short_circuit(endpoint: str) -> None:
+    """记录一次因凭证已失效而未发出的上游请求"""
+    upstream_short_circuits.labels(endpoint=endpoint).inc()
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """记录一次缓存查找"""
+    cache_requests.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def cache_counts() -> Dict[str, List[float]]:
+    """各缓存层自进程启动以来的 [命中数, 未命中数]"""
+    totals: Dict[str, List[float]] = {}
+    for metric in cache_requests.collect():
+        for sample in metric.samples:
+            if not sample.name.endswith("_total"):
+                continue
+            counts = totals.setdefault(sample.labels["cache"], [0, 0])
+            counts[0 if sample.labels["result"] == "hit" else 1] += sample.value
+    return totals
+
+
+class _CacheHitRatioCollector:
+    """抓取时由 cache_requests 计算各缓存层命中率"""
+
+    def collect(self):
+        ratio = GaugeMetricFamily(
+            "weread_cache_hit_ratio",
+            "Hit ratio of each cache layer since process start",
+            labels=("cache",),
+        )
+        for cache, (hits, misses) in sorted(cache_counts().items()):
+            if hits + misses:
+                ratio.add_metric((cache,), hits / (hits + misses))
+        yield ratio
+
+
+registry.register(_CacheHitRatioCollector())
+
+
+class EventLoopLagMonitor:
+    """定期在事件循环上醒来，实际醒来时间超出预定时间的部分即为事件循环延迟"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - expected)
+            event_loop_lag.observe(lag)
+            event_loop_lag_last.set(lag)
+
+
+loop_lag_monitor = EventLoopLagMonitor(interval=settings.metrics_loop_lag_interval_seconds)
+
+
+def render_metrics() -> str:
+    return generate_latest(registry).decode("utf-8")
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, Index
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 from database import Base
 
@@ -38,6 +39,10 @@ class BookCache(Base):
 
 class BookNoteSync(Base):
     __tablename__ = "book_note_sync"
+    __table_args__ = (
+        # 每个用户每本书只有一份笔记文档，并发首次打开时由唯一约束兜底
+        Index("ix_book_note_sync_user_book", "user_id", "book_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, index=True)
@@ -47,3 +52,100 @@ class BookNoteSync(Base):
     notes_data = Column(JSON)  # 存储笔记数据
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+class NoteSearchEntry(Base):
+    __tablename__ = "note_search_entries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, index=True)
+    book_id = Column(String, index=True)
+    bookmark_id = Column(String, index=True)
+    book_title = Column(String, default="")
+    chapter_uid = Column(Integer)
+    chapter_title = Column(String, default="")
+    mark_text = Column(Text, default="")
+    note_text = Column(Text, default="")
+    create_time = Column(Integer, default=0)  # 划线创建时间（秒）
+    tokens = Column(Text, default="")  # 分词后的检索文本，供FTS索引使用
+
+class ShelfState(Base):
+    __tablename__ = "shelf_state"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, unique=True, index=True)
+    version = Column(Integer, default=0)  # 书架数据每次写入递增，用于各级缓存失效
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+class ShelfStats(Base):
+    __tablename__ = "shelf_stats"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, unique=True, index=True)
+    version = Column(Integer, default=0)  # 统计对应的书架版本
+    stats = Column(JSON)  # 按状态、分类、评分档位、完读月份的计数
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+class ReadingProgress(Base):
+    __tablename__ = "reading_progress"
+    __table_args__ = (
+        Index("ix_reading_progress_user_book", "user_id", "book_id", unique=True),
+        Index("ix_reading_progress_user_update", "user_id", "update_time"),
+        Index("ix_reading_progress_user_finish_update", "user_id", "finish_reading", "update_time"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    book_id = Column(String, nullable=False)
+    title = Column(String, default="")
+    author = Column(String, default="")
+    cover = Column(String, default="")
+    progress = Column(Integer, default=0)  # 阅读进度百分比
+    chapter_uid = Column(Integer)
+    chapter_idx = Column(Integer)
+    reading_time = Column(Integer, default=0)  # 累计阅读时长（秒）
+    finish_reading = Column(Boolean, default=False)
+    update_time = Column(Integer, default=0)  # 进度更新时间（秒）
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+class RefreshLease(Base):
+    __tablename__ = "refresh_leases"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, unique=True, index=True)
+    owner = Column(String, nullable=True)  # 持有者标识（进程ID+随机串），为空表示未被占用
+    expires_at = Column(Integer, default=0)  # 租约到期时间（Unix秒），持有者崩溃后到期自动失效
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+class NotesExportJob(Base):
+    __tablename__ = "notes_export_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String, unique=True, index=True)
+    user_id = Column(Integer, index=True)
+    format = Column(String, default="markdown")  # markdown / html
+    option = Column(Integer, default=1)  # 1: 全部章节, 2: 仅有笔记的章节
+    status = Column(String, default="running")  # running / partial / complete
+    total = Column(Integer, default=0)
+    completed = Column(Integer, default=0)  # 已处理的书籍数（含失败和无笔记）
+    failed = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+class NotesExportItem(Base):
+    __tablename__ = "notes_export_items"
+    __table_args__ = (
+        Index("ix_notes_export_items_job_book", "job_id", "book_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String, nullable=False)
+    book_id = Column(String, nullable=False)
+    title = Column(String, default="")
+    filename = Column(String, default="")  # ZIP内的文件名，创建任务时确定，续传时保持一致
+    status = Column(String, default="pending")  # pending / done / empty / failed
+    content = deferred(Column(Text))  # 渲染好的笔记文件，续传时直接输出，不再请求微信读书；按需单独读取
+    error = Column(String)
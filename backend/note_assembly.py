@@ -0,0 +1,244 @@
+# 笔记组装：划线位置只解析一次为整数 (start, end)，一次遍历按章节分组并排序，再由生成器逐行输出Markdown或HTML
+import sys
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from html import escape
+from operator import itemgetter
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+from metrics import record_cache
+
+# 无法解析的位置排在章节末尾
+UNKNOWN_POSITION = sys.maxsize
+
+# (start, end, bookmark)
+AssembledNote = Tuple[int, int, Dict]
+
+_by_position = itemgetter(0, 1)
+
+# 划线位置字符串解析结果的LRU缓存容量；同一本书的笔记每次请求都是同一批 range，解析结果跨请求复用
+POSITION_CACHE_SIZE = 65536
+
+# HTML输出时划线样式对应的标签，与 WeReadAPI.set_content_style 的Markdown样式一致
+HTML_MARK_STYLES = {1: ('<strong>', '</strong>')}
+
+
+def parse_range(value: Any) -> Tuple[int, int]:
+    """把书签的 range（如 "1024-1060"）解析为整数 (start, end)"""
+    if not value:
+        return UNKNOWN_POSITION, UNKNOWN_POSITION
+    start, _, end = str(value).partition('-')
+    try:
+        start = int(start)
+    except ValueError:
+        return UNKNOWN_POSITION, UNKNOWN_POSITION
+    try:
+        end = int(end) if end else start
+    except ValueError:
+        end = start
+    return start, end
+
+
+@lru_cache(maxsize=POSITION_CACHE_SIZE)
+def _parse_range_text(value: str) -> Tuple[int, int]:
+    return parse_range(value)
+
+
+def range_position(value: Any) -> Tuple[int, int]:
+    """parse_range 的缓存版本：字符串 range 走有界、线程安全的LRU缓存"""
+    if value.__class__ is str:
+        return _parse_range_text(value)
+    return parse_range(value)
+
+
+def extract_bookmarks(bookmarks_data: Any) -> List[Dict]:
+    """兼容不同的书签数据结构，取出书签列表"""
+    if isinstance(bookmarks_data, list):
+        return bookmarks_data
+    if not isinstance(bookmarks_data, dict):
+        return []
+    # 增量同步格式 / 传统格式 / data 字段
+    if 'updated' in bookmarks_data:
+        return bookmarks_data.get('updated') or []
+    if 'bookmarks' in bookmarks_data:
+        return bookmarks_data.get('bookmarks') or []
+    return bookmarks_data.get('data') or []
+
+
+def assemble_notes(bookmarks: List[Dict]) -> Dict[Any, List[AssembledNote]]:
+    """
+    按章节分组书签并按划线位置排序
+
+    Returns:
+        chapterUid -> [(start, end, bookmark), ...]，同一位置保持原有顺序
+    """
+    grouped: Dict[Any, List[AssembledNote]] = {}
+    parse_text = _parse_range_text
+    for bookmark in bookmarks:
+        value = bookmark.get('range')
+        # 字符串位置直接查LRU缓存，省掉一层函数调用
+        position = parse_text(value) if value.__class__ is str else parse_range(value)
+        chapter_uid = bookmark.get('chapterUid')
+        notes = grouped.get(chapter_uid)
+        if notes is None:
+            notes = grouped[chapter_uid] = []
+        notes.append(position + (bookmark,))
+
+    for notes in grouped.values():
+        notes.sort(key=_by_position)
+    return grouped
+
+
+class AssembledNotebook:
+    """一本书的组装结果，以及按输出格式缓存的各章节片段"""
+
+    def __init__(self, grouped: Dict[Any, List[AssembledNote]]):
+        self.grouped = grouped
+        self._segments: Dict[Hashable, Dict[Tuple, str]] = {}
+
+    def segments(self, fmt: str, styled: bool = False) -> Dict[Tuple, str]:
+        """(chapterUid, level, title) -> 已渲染的章节片段，渲染函数按需填充"""
+        return self._segments.setdefault((fmt, styled), {})
+
+
+class AssembledNotebookCache:
+    """
+    组装结果的LRU缓存，按 (用户, 书籍, 书签synckey) 缓存
+    synckey 随书签增删改变化，同一本书重复打开/导出时不再重新分组排序，已渲染的章节直接复用
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, AssembledNotebook]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def assemble(self, key: Optional[Hashable], bookmarks: List[Dict]) -> AssembledNotebook:
+        """
+        Args:
+            key: 缓存键，None 表示不缓存（没有synckey时无法判断书签是否变化）
+        """
+        if key is None:
+            return AssembledNotebook(assemble_notes(bookmarks))
+        # 书签数一并作为键，防止同一synckey下返回的书签不完整
+        key = (key, len(bookmarks))
+        with self._lock:
+            notebook = self._entries.get(key)
+            if notebook is not None:
+                self._entries.move_to_end(key)
+        record_cache("note_assembly", notebook is not None)
+        if notebook is not None:
+            return notebook
+
+        notebook = AssembledNotebook(assemble_notes(bookmarks))
+        with self._lock:
+            self._entries[key] = notebook
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return notebook
+
+
+# 全局组装结果缓存实例
+assembled_notebooks = AssembledNotebookCache()
+
+
+def sort_chapter_notes(bookmarks: Iterable[Dict]) -> List[AssembledNote]:
+    """单个章节的书签按划线位置排序"""
+    notes = [range_position(bookmark.get('range')) + (bookmark,) for bookmark in bookmarks]
+    notes.sort(key=_by_position)
+    return notes
+
+
+def render_chapter_markdown(level: int, title: str, notes: List[AssembledNote],
+                            mark_formatter: Optional[Callable[[int, str], str]] = None) -> str:
+    """
+    生成一个章节的Markdown片段：标题和每段文字各占一行，段与段之间空一行
+
+    Args:
+        mark_formatter: 划线文字的样式处理（如 WeReadAPI.set_content_style），默认原样输出
+    """
+    parts = [f"{'#' * (level + 1)} {title}\n"]
+    append = parts.append
+    for _, _, bookmark in notes:
+        marked_text = (bookmark.get('markText') or '').strip()
+        if marked_text:
+            if mark_formatter is not None:
+                marked_text = mark_formatter(bookmark.get('style', 0), marked_text)
+            append(marked_text + "\n")
+
+        note_text = (bookmark.get('noteText') or '').strip()
+        if note_text:
+            append(f"**笔记：** {note_text}\n")
+
+    return '\n'.join(parts) + ("\n" if notes else "")
+
+
+def iter_markdown_chapters(chapters: List[Tuple], grouped: Dict[Any, List[AssembledNote]],
+                           only_with_notes: bool = False,
+                           mark_formatter: Optional[Callable[[int, str], str]] = None,
+                           segments: Optional[Dict[Tuple, str]] = None) -> Iterator[str]:
+    """
+    逐章节生成Markdown片段，用 '\n' 连接即为完整内容
+
+    Args:
+        chapters: [(chapterUid, level, title), ...]
+        grouped: assemble_notes 的结果
+        only_with_notes: 跳过没有笔记的章节
+        segments: AssembledNotebook.segments 的章节片段缓存，已渲染的章节直接复用
+    """
+    for chapter_uid, level, title in chapters:
+        notes = grouped.get(chapter_uid, ())
+        if only_with_notes and not notes:
+            continue
+        if segments is None:
+            yield render_chapter_markdown(level, title, notes, mark_formatter)
+            continue
+        chapter = (chapter_uid, level, title)
+        segment = segments.get(chapter)
+        if segment is None:
+            segment = segments[chapter] = render_chapter_markdown(level, title, notes, mark_formatter)
+        yield segment
+
+
+def iter_chapter_html(level: int, title: str, notes: List[AssembledNote], styled: bool = False) -> Iterator[str]:
+    """
+    直接生成一个章节的HTML元素（不经过Markdown），所有文字都做HTML转义
+
+    Args:
+        styled: 按划线样式加粗（HTML_MARK_STYLES），默认原样输出
+    """
+    tag = f"h{min(level + 1, 6)}"
+    yield f"<{tag}>{escape(title)}</{tag}>"
+
+    for _, _, bookmark in notes:
+        marked_text = (bookmark.get('markText') or '').strip()
+        if marked_text:
+            prefix, suffix = HTML_MARK_STYLES.get(bookmark.get('style'), ('', '')) if styled else ('', '')
+            yield f"<p>{prefix}{escape(marked_text)}{suffix}</p>"
+
+        note_text = (bookmark.get('noteText') or '').strip()
+        if note_text:
+            yield f"<p><strong>笔记：</strong> {escape(note_text)}</p>"
+
+
+def render_chapter_html(level: int, title: str, notes: List[AssembledNote], styled: bool = False) -> str:
+    """一个章节的HTML片段"""
+    return '\n\n'.join(iter_chapter_html(level, title, notes, styled)) + '\n'
+
+
+def iter_html_chapters(chapters: List[Tuple], grouped: Dict[Any, List[AssembledNote]],
+                       only_with_notes: bool = False, styled: bool = False,
+                       segments: Optional[Dict[Tuple, str]] = None) -> Iterator[str]:
+    """逐章节生成HTML片段，参数同 iter_markdown_chapters"""
+    for chapter_uid, level, title in chapters:
+        notes = grouped.get(chapter_uid, ())
+        if only_with_notes and not notes:
+            continue
+        if segments is None:
+            yield render_chapter_html(level, title, notes, styled)
+            continue
+        chapter = (chapter_uid, level, title)
+        segment = segments.get(chapter)
+        if segment is None:
+            segment = segments[chapter] = render_chapter_html(level, title, notes, styled)
+        yield segment
@@ -0,0 +1,286 @@
+# 按章节分段存储的笔记文档：书签增量同步时只重新渲染受影响的章节，再拼接缓存的Markdown/HTML
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import flag_modified
+
+import note_assembly
+from metrics import record_cache
+from models import BookNoteSync
+from weread_api import WeReadAPI, CookieExpiredException
+
+# notes_data 结构版本，结构变化时旧文档会被全量重建
+DOCUMENT_VERSION = 1
+
+# 存储时保留的书签字段
+BOOKMARK_FIELDS = ('bookmarkId', 'chapterUid', 'range', 'markText', 'noteText', 'style', 'createTime')
+
+
+def _compact_bookmark(bookmark: Dict) -> Dict:
+    return {key: bookmark[key] for key in BOOKMARK_FIELDS if key in bookmark}
+
+
+def _bookmark_id(item) -> str:
+    return str(item.get('bookmarkId', '') if isinstance(item, dict) else item)
+
+
+def _render_segment(level: int, title: str, bookmarks: Iterable[Dict]) -> Dict:
+    """渲染一个章节的Markdown和HTML片段，与 iter_markdown_chapters / iter_html_chapters 的输出一致"""
+    notes = note_assembly.sort_chapter_notes(bookmarks)
+    return {
+        "markdown": note_assembly.render_chapter_markdown(level, title, notes),
+        "html": note_assembly.render_chapter_html(level, title, notes),
+    }
+
+
+def _render_chapters(doc: Dict, chapter_keys: Iterable[str]) -> None:
+    chapter_info = {str(uid): (level, title) for uid, level, title in doc['chapters']}
+    for key in chapter_keys:
+        chapter = doc['notes'].get(key)
+        if chapter is None:
+            continue
+        if not chapter['bookmarks']:
+            del doc['notes'][key]
+            continue
+        if key not in chapter_info:
+            # 不在章节列表中的书签（与全量渲染一致）不输出
+            chapter.pop('markdown', None)
+            chapter.pop('html', None)
+            continue
+        level, title = chapter_info[key]
+        chapter.update(_render_segment(level, title, chapter['bookmarks'].values()))
+
+
+def build_document(bookmarks_data: Dict, chapters: List[Tuple], book_title: str = "") -> Dict:
+    """从一次全量书签同步的结果构建文档"""
+    doc = {
+        "version": DOCUMENT_VERSION,
+        "book_title": book_title,
+        "chapters": [list(chapter) for chapter in chapters],
+        "notes": {},
+        "locations": {},
+    }
+    for bookmark in note_assembly.extract_bookmarks(bookmarks_data):
+        _add_bookmark(doc, bookmark)
+    _render_chapters(doc, list(doc['notes']))
+    return doc
+
+
+def _add_bookmark(doc: Dict, bookmark: Dict) -> str:
+    bookmark_id = _bookmark_id(bookmark)
+    key = str(bookmark.get('chapterUid'))
+    chapter = doc['notes'].setdefault(key, {"bookmarks": {}})
+    chapter['bookmarks'][bookmark_id] = _compact_bookmark(bookmark)
+    doc['locations'][bookmark_id] = key
+    return key
+
+
+def _remove_bookmark(doc: Dict, bookmark_id: str) -> Optional[str]:
+    key = doc['locations'].pop(bookmark_id, None)
+    if key is not None and key in doc['notes']:
+        doc['notes'][key]['bookmarks'].pop(bookmark_id, None)
+    return key
+
+
+def apply_delta(doc: Dict, bookmarks_data: Dict) -> Set[str]:
+    """
+    把一次增量同步的 updated / removed 应用到文档，只重新渲染受影响的章节
+
+    Returns:
+        重新渲染的章节（chapterUid 字符串）
+    """
+    affected: Set[str] = set()
+    for item in bookmarks_data.get('removed') or []:
+        key = _remove_bookmark(doc, _bookmark_id(item))
+        if key is not None:
+            affected.add(key)
+
+    for bookmark in note_assembly.extract_bookmarks(bookmarks_data):
+        # 书签可能被移动到其他章节，先从原章节移除
+        old_key = _remove_bookmark(doc, _bookmark_id(bookmark))
+        if old_key is not None:
+            affected.add(old_key)
+        affected.add(_add_bookmark(doc, bookmark))
+
+    _render_chapters(doc, affected)
+    return affected
+
+
+def document_chapters(doc: Dict, option: int = 1) -> List[List]:
+    """
+    文档实际输出的章节 [chapterUid, level, title]
+
+    与 WeReadAPI.iter_markdown_chapters 一致：完整/精选模式只输出一级章节，精选模式跳过没有笔记的章节
+    """
+    chapters = doc['chapters']
+    if option in (1, 2):
+        chapters = [chapter for chapter in chapters if chapter[1] == 1]
+    if option == 2:
+        chapters = [chapter for chapter in chapters if 'markdown' in doc['notes'].get(str(chapter[0]), {})]
+    return chapters
+
+
+def chapter_segment(doc: Dict, chapter: List, fmt: str = "markdown") -> str:
+    """一个章节的缓存片段，没有笔记的章节只输出标题"""
+    uid, level, title = chapter
+    segment = doc['notes'].get(str(uid), {}).get(fmt)
+    if segment is not None:
+        return segment
+    if fmt == "html":
+        return note_assembly.render_chapter_html(level, title, [])
+    return note_assembly.render_chapter_markdown(level, title, [])
+
+
+def iter_document_chapters(doc: Dict, option: int = 1, fmt: str = "markdown") -> Iterator[str]:
+    """
+    按章节拼接缓存的片段，输出与全量渲染相同的内容
+
+    Args:
+        option: 1 全部章节, 2 仅有笔记的章节
+        fmt: markdown / html
+    """
+    for chapter in document_chapters(doc, option):
+        yield chapter_segment(doc, chapter, fmt)
+
+
+def document_toc(doc: Dict, option: int = 1) -> List[Dict]:
+    """目录：文档输出的每个章节及其划线、想法数量，index 与 chapter_range 的位置一致"""
+    toc = []
+    for index, (uid, level, title) in enumerate(document_chapters(doc, option)):
+        bookmarks = doc['notes'].get(str(uid), {}).get('bookmarks') or {}
+        toc.append({
+            "index": index,
+            "chapterUid": uid,
+            "level": level,
+            "title": title,
+            "highlight_count": sum(1 for bookmark in bookmarks.values() if (bookmark.get('markText') or '').strip()),
+            "note_count": sum(1 for bookmark in bookmarks.values() if (bookmark.get('noteText') or '').strip()),
+        })
+    return toc
+
+
+def chapter_range(doc: Dict, option: int = 1, start: int = 0, limit: int = 20,
+                  fmt: str = "markdown") -> Tuple[List[Dict], int]:
+    """
+    按目录位置取一段章节的内容
+
+    Returns:
+        (章节列表, 章节总数)
+    """
+    chapters = document_chapters(doc, option)
+    sections = [
+        {"index": index, "chapterUid": chapter[0], "title": chapter[2], "content": chapter_segment(doc, chapter, fmt)}
+        for index, chapter in enumerate(chapters[start:start + limit], start)
+    ]
+    return sections, len(chapters)
+
+
+def document_bookmark_count(doc: Dict) -> int:
+    return len(doc.get('locations') or {})
+
+
+def load_note_document(db: Session, user_id: int, book_id: str) -> Optional[Dict]:
+    """读取已存储的笔记文档（不请求微信读书），没有或结构版本不一致时返回 None"""
+    row = (
+        db.query(BookNoteSync.notes_data)
+        .filter(BookNoteSync.user_id == user_id, BookNoteSync.book_id == book_id)
+        .first()
+    )
+    doc = row[0] if row else None
+    if not isinstance(doc, dict) or doc.get('version') != DOCUMENT_VERSION:
+        return None
+    return doc
+
+
+def sync_note_document(db: Session, user_id: int, book_id: str,
+                       weread_api: WeReadAPI) -> Tuple[Optional[Dict], Dict]:
+    """
+    用书签增量同步更新用户的笔记文档
+
+    已有文档时带上次的 synckey 请求，只应用 updated / removed；没有文档、结构版本变化
+    或书签引用了未知章节时全量重建
+
+    Returns:
+        (文档, 本次同步的书签数据)；书签接口失败且没有缓存时文档为 None，
+        凭证失效且没有缓存时抛出 CookieExpiredException
+        本次同步的书签数据带 full_sync 标记，供笔记索引判断是否全量替换
+    """
+    row = (
+        db.query(BookNoteSync)
+        .filter(BookNoteSync.user_id == user_id, BookNoteSync.book_id == book_id)
+        .first()
+    )
+    doc = row.notes_data if row and isinstance(row.notes_data, dict) else None
+    if doc is not None and doc.get('version') != DOCUMENT_VERSION:
+        doc = None
+    record_cache("note_document", doc is not None)
+
+    if doc is not None:
+        try:
+            bookmarks_data = weread_api.get_bookmarks(book_id, row.sync_key or "0")
+        except CookieExpiredException:
+            # 凭证失效时仍可返回已缓存的文档
+            print(f"🔐 登录已过期，使用已缓存的笔记文档: {book_id}")
+            return doc, {"updated": [], "removed": [], "full_sync": False}
+        if not bookmarks_data or bookmarks_data.get('error'):
+            print(f"⚠️ 笔记增量同步失败，使用已缓存的文档: {book_id}")
+            return doc, {"updated": [], "removed": [], "full_sync": False}
+
+        known_chapters = {str(chapter[0]) for chapter in doc['chapters']}
+        new_chapters = {
+            str(bookmark.get('chapterUid')) for bookmark in note_assembly.extract_bookmarks(bookmarks_data)
+        } - known_chapters
+        if not new_chapters:
+            affected = apply_delta(doc, bookmarks_data)
+            print(f"📝 笔记增量同步: {book_id}, 重新渲染 {len(affected)} 个章节")
+            bookmarks_data['full_sync'] = False
+            sync_key = str(bookmarks_data.get('synckey', row.sync_key) or "0")
+            if affected:
+                _save_document(db, row, user_id, book_id, doc, sync_key)
+            elif sync_key != (row.sync_key or "0"):
+                # 文档没有变化，只推进 synckey，不重写整份文档
+                row.sync_key = sync_key
+                row.last_sync_time = datetime.now(timezone.utc)
+                db.commit()
+            return doc, bookmarks_data
+        print(f"📝 笔记引用了新的章节，全量重建: {book_id}")
+
+    bookmarks_data = weread_api.get_bookmarks(book_id, "0")
+    if not bookmarks_data or (bookmarks_data.get('error') and not bookmarks_data.get('updated')):
+        return doc, {"updated": [], "removed": [], "full_sync": False}
+
+    chapters = weread_api.get_sorted_chapters(book_id)
+    book_title = (bookmarks_data.get('book') or {}).get('title') or ''
+    doc = build_document(bookmarks_data, chapters, book_title)
+    print(f"📝 笔记文档全量构建: {book_id}, {document_bookmark_count(doc)} 条书签, {len(doc['notes'])} 个章节有笔记")
+    bookmarks_data['full_sync'] = True
+    _save_document(db, row, user_id, book_id, doc, bookmarks_data.get('synckey', "0"))
+    return doc, bookmarks_data
+
+
+def _fill_document(row: BookNoteSync, doc: Dict, sync_key) -> None:
+    row.notes_data = doc
+    # 文档是原地修改的JSON，需要显式标记
+    flag_modified(row, 'notes_data')
+    row.sync_key = str(sync_key or "0")
+    row.last_sync_time = datetime.now(timezone.utc)
+
+
+def _save_document(db: Session, row: Optional[BookNoteSync], user_id: int, book_id: str,
+                   doc: Dict, sync_key) -> None:
+    if row is not None:
+        _fill_document(row, doc, sync_key)
+        db.commit()
+        return
+
+    row = BookNoteSync(user_id=user_id, book_id=book_id)
+    _fill_document(row, doc, sync_key)
+    db.add(row)
+    try:
+        db.commit()
+    except IntegrityError:
+        # 同一本书的两次首次打开同时全量构建，对方已先保存：两份文档来自同一次全量同步，沿用已保存的即可
+        db.rollback()
+        print(f"ℹ️ 笔记文档已由并发请求保存: {book_id}")
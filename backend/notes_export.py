@@ -0,0 +1,321 @@
+# 笔记导出：单本笔记文件渲染，以及全库笔记的并发抓取 + 流式ZIP（任务状态落库，失败后可续传）
+import html
+import io
+import itertools
+import re
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+from urllib.parse import quote
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import NotesExportJob, NotesExportItem
+from weread_api import WeReadAPI
+from weread_clients import weread_clients
+
+try:
+    from config import settings
+except ImportError:
+    from config_simple import settings
+
+NOTES_HTML_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+    <title>《{title}》笔记</title>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/github-markdown-css/5.1.0/github-markdown.min.css"/>
+    <style>
+        .markdown-body {{
+            box-sizing: border-box;
+            min-width: 200px;
+            max-width: 980px;
+            margin: 0 auto;
+            padding: 45px;
+        }}
+        @media(max-width:767px) {{
+            .markdown-body {{
+                padding: 15px;
+            }}
+        }}
+    </style>
+</head>
+<body class="markdown-body">
+    <h1>《{title}》笔记</h1>
+"""
+NOTES_HTML_TAIL = """</body>
+</html>
+"""
+
+# 文件名中不允许出现的字符（兼容Windows解压）
+_UNSAFE_FILENAME_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+FAILED_LIST_FILENAME = "_导出失败的书籍.txt"
+
+
+def content_disposition(filename: str) -> str:
+    """附件下载头：ASCII回退文件名 + RFC 5987 编码的UTF-8文件名"""
+    fallback = filename.encode('ascii', 'ignore').decode() or "notes"
+    fallback = fallback.replace('"', '').replace('\\', '')
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def render_notes_file(book_title: str, chunks: Iterable[str], is_html: bool) -> Iterator[str]:
+    """把逐章节的笔记片段（iter_markdown_chapters / iter_html_chapters）包装成完整的笔记文件，逐段输出"""
+    if is_html:
+        yield NOTES_HTML_HEAD.format(title=html.escape(book_title))
+    else:
+        yield f"# 《{book_title}》笔记\n\n"
+
+    for chunk in chunks:
+        yield chunk if is_html else chunk + "\n"
+
+    if is_html:
+        yield NOTES_HTML_TAIL
+
+
+def render_book_notes(weread_api: WeReadAPI, book_id: str, book_title: str,
+                      option: int, is_html: bool) -> Optional[str]:
+    """抓取并渲染一本书的笔记（书签 + 章节两次请求），没有笔记时返回 None"""
+    bookmarks_data = weread_api.get_bookmarks(book_id, "0")
+    # get_bookmarks 不抛异常：所有地址都失败时返回带 error 的空数据，这种情况记为失败以便续传时重试
+    error = (bookmarks_data or {}).get('error') or ''
+    if error.startswith('无法获取书签'):
+        raise Exception(error)
+    chapters = weread_api.get_sorted_chapters(book_id)
+
+    iter_chapters = weread_api.iter_html_chapters if is_html else weread_api.iter_markdown_chapters
+    chunks = iter_chapters(book_id, option, bookmarks_data, chapters)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        return None
+    return ''.join(render_notes_file(book_title, itertools.chain([first_chunk], chunks), is_html))
+
+
+def _zip_filename(title: str, book_id: str, extension: str, used: set) -> str:
+    name = _UNSAFE_FILENAME_CHARS.sub('_', title).strip().strip('.')[:80] or book_id
+    filename = f"{name}.{extension}"
+    if filename in used:
+        filename = f"{name}_{book_id}.{extension}"
+    used.add(filename)
+    return filename
+
+
+def prune_export_jobs(db: Session, user_id: int) -> None:
+    """删除用户过期的导出任务（连同已渲染的内容）"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.notes_export_job_ttl_seconds)
+    expired = [
+        row[0] for row in db.query(NotesExportJob.job_id)
+        .filter(NotesExportJob.user_id == user_id, NotesExportJob.created_at < cutoff)
+    ]
+    if not expired:
+        return
+    db.query(NotesExportItem).filter(NotesExportItem.job_id.in_(expired)).delete(synchronize_session=False)
+    db.query(NotesExportJob).filter(NotesExportJob.job_id.in_(expired)).delete(synchronize_session=False)
+    db.commit()
+
+
+def create_export_job(db: Session, user_id: int, notebooks: List[Dict],
+                      format: str, option: int) -> NotesExportJob:
+    """为笔记本列表中的每本书创建一个待导出条目，ZIP内的文件名在此时确定"""
+    prune_export_jobs(db, user_id)
+
+    extension = "html" if format == "html" else "md"
+    job = NotesExportJob(job_id=uuid.uuid4().hex, user_id=user_id, format=format, option=option)
+    used: set = set()
+    seen: set = set()
+    items = []
+    for notebook in notebooks:
+        book_id = str(notebook['bookId'])
+        if book_id in seen:
+            continue
+        seen.add(book_id)
+        title = (notebook.get('book') or {}).get('title') or book_id
+        items.append(NotesExportItem(
+            job_id=job.job_id, book_id=book_id, title=title,
+            filename=_zip_filename(title, book_id, extension, used)
+        ))
+
+    job.total = len(items)
+    db.add(job)
+    db.add_all(items)
+    db.commit()
+    return job
+
+
+def get_export_job(db: Session, user_id: int, job_id: str) -> Optional[NotesExportJob]:
+    return (
+        db.query(NotesExportJob)
+        .filter(NotesExportJob.job_id == job_id, NotesExportJob.user_id == user_id)
+        .first()
+    )
+
+
+def export_job_summary(db: Session, job: NotesExportJob) -> Dict:
+    counts = {status: 0 for status in ('pending', 'done', 'empty', 'failed')}
+    counts.update(
+        db.query(NotesExportItem.status, func.count(NotesExportItem.id))
+        .filter(NotesExportItem.job_id == job.job_id)
+        .group_by(NotesExportItem.status)
+        .all()
+    )
+    failed_books = [
+        {"book_id": row.book_id, "title": row.title, "error": row.error}
+        for row in db.query(NotesExportItem).filter(
+            NotesExportItem.job_id == job.job_id, NotesExportItem.status == 'failed')
+    ]
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "format": job.format,
+        "option": job.option,
+        "total": job.total,
+        "completed": job.completed,
+        "counts": counts,
+        "failed_books": failed_books
+    }
+
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """
+    zipfile 的写入目标：不可seek，写入的字节暂存，由生成器在每个条目写完后取走
+    不可seek时 zipfile 使用数据描述符（data descriptor），无需回写本地文件头
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def seekable(self) -> bool:
+        return False
+
+    def seek(self, *args):
+        raise io.UnsupportedOperation("seek")
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _release_job_content(db: Session, job: NotesExportJob) -> None:
+    """任务全部完成后不再需要续传，清空已渲染的内容，只保留条目状态供进度查询，并清理该用户的过期任务"""
+    db.query(NotesExportItem).filter(
+        NotesExportItem.job_id == job.job_id, NotesExportItem.content.isnot(None)
+    ).update({NotesExportItem.content: None}, synchronize_session=False)
+    db.commit()
+    prune_export_jobs(db, job.user_id)
+
+
+def stream_export_zip(job_id: str, cookies: str, concurrency: Optional[int] = None) -> Iterator[bytes]:
+    """
+    按任务状态输出ZIP
+
+    - 已完成的条目直接从数据库写入ZIP（续传时不再请求微信读书），内容逐条读取，不整体载入内存
+    - 其余条目在有界线程池中并发抓取，哪本先完成先写入ZIP并立即输出
+    - 每个条目的结果立即落库；客户端断开或部分失败后，用同一个 job_id 重新请求即可从断点继续
+    - 全部成功后清空任务中保存的内容（之后再用该 job_id 请求会重新抓取）
+    """
+    concurrency = max(1, concurrency or settings.notes_export_concurrency)
+    db = SessionLocal()
+    buffer = _ZipStreamBuffer()
+    executor = None
+    try:
+        job = db.query(NotesExportJob).filter(NotesExportJob.job_id == job_id).first()
+        if job is None:
+            print(f"⚠️ 导出任务不存在或已过期 job={job_id}")
+            return
+        is_html = job.format == "html"
+        items = (
+            db.query(NotesExportItem)
+            .filter(NotesExportItem.job_id == job_id)
+            .order_by(NotesExportItem.id)
+            .all()
+        )
+        stored = {
+            row[0] for row in db.query(NotesExportItem.id).filter(
+                NotesExportItem.job_id == job_id, NotesExportItem.content.isnot(None))
+        }
+        job.status = 'running'
+        db.commit()
+
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            resumable = [item for item in items if item.status == 'done' and item.id in stored]
+            for item in resumable:
+                content = db.query(NotesExportItem.content).filter(NotesExportItem.id == item.id).scalar()
+                archive.writestr(item.filename, content or '')
+                yield buffer.drain()
+
+            resumed_ids = {item.id for item in resumable}
+            pending = [
+                item for item in items
+                if item.status in ('pending', 'failed') or (item.status == 'done' and item.id not in resumed_ids)
+            ]
+            if pending:
+                print(f"📦 批量导出笔记 job={job_id}: 共 {len(items)} 本, 待抓取 {len(pending)} 本, 并发 {concurrency}")
+                weread_api = weread_clients.for_cookies(cookies, job.user_id)
+                executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="notes-export")
+                futures = {
+                    executor.submit(render_book_notes, weread_api, item.book_id, item.title, job.option, is_html): item
+                    for item in pending
+                }
+                for future in as_completed(futures):
+                    item = futures[future]
+                    try:
+                        content = future.result()
+                    except Exception as e:
+                        print(f"⚠️ 导出笔记失败: {item.book_id} - {e}")
+                        item.status, item.error = 'failed', str(e)[:500]
+                    else:
+                        if content is None:
+                            item.status, item.error = 'empty', None
+                        else:
+                            # 内容直接写库，不挂在已加载的条目上，条目刷新时不会把所有内容载入内存
+                            db.query(NotesExportItem).filter(NotesExportItem.id == item.id).update(
+                                {NotesExportItem.content: content}, synchronize_session=False)
+                            item.status, item.error = 'done', None
+                            archive.writestr(item.filename, content)
+
+                    job.completed = sum(1 for row in items if row.status != 'pending')
+                    db.commit()
+                    yield buffer.drain()
+
+            failed = [item for item in items if item.status == 'failed']
+            if failed:
+                lines = [f"以下 {len(failed)} 本书籍的笔记导出失败，可使用 job_id={job_id} 重新请求以续传：", ""]
+                lines += [f"{item.title} ({item.book_id}): {item.error}" for item in failed]
+                archive.writestr(FAILED_LIST_FILENAME, '\n'.join(lines) + '\n')
+
+        job.failed = len(failed)
+        job.completed = len(items)
+        job.status = 'partial' if failed else 'complete'
+        db.commit()
+        print(f"✅ 批量导出笔记完成 job={job_id}: {job.status}, 失败 {len(failed)} 本")
+        if not failed:
+            _release_job_content(db, job)
+        # 关闭ZIP时写入的中央目录
+        yield buffer.drain()
+    finally:
+        if executor is not None:
+            # 客户端中途断开时取消尚未开始的抓取
+            executor.shutdown(wait=False, cancel_futures=True)
+        db.close()
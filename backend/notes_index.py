@@ -0,0 +1,403 @@
+# 笔记全文检索：对已同步的划线(markText)和笔记(noteText)建立索引
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text, or_
+from sqlalchemy.orm import Session
+
+from database import engine, SessionLocal
+from models import NoteSearchEntry
+from weread_api import CookieExpiredException
+from weread_clients import weread_clients
+
+# CJK字符（含日文假名、韩文）逐字切分，让 unicode61 分词器按单字建立倒排
+_CJK_RE = re.compile(r'([\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff])')
+_FTS_TABLE = "note_search_fts"
+# PostgreSQL：tokens 已按CJK逐字切分，用 simple 配置建表达式GIN索引即可支持中文
+_PG_TSVECTOR = "to_tsvector('simple', tokens)"
+_PG_INDEX = "note_search_tokens_gin"
+_WORD_RE = re.compile(r'\w')
+# 建表/FTS5初始化失败后的重试间隔（秒）
+SCHEMA_RETRY_SECONDS = 60
+
+
+def tokenize_for_index(content: str) -> str:
+    """将文本转换为检索用的token串：CJK逐字以空格分隔，其余小写保留"""
+    if not content:
+        return ""
+    return ' '.join(_CJK_RE.sub(r' \1 ', content.lower()).split())
+
+
+class NotesSearchIndex:
+    """
+    笔记全文索引
+    NoteSearchEntry 表保存原文和上下文；SQLite下额外维护一个 external content 的 FTS5 表（bm25排序），
+    PostgreSQL下在 tokens 上建 tsvector GIN 索引（ts_rank_cd排序），其他数据库退化为按时间排序的 LIKE 匹配
+    """
+
+    def __init__(self, bind=engine):
+        self.engine = bind
+        self._schema_ready = False
+        self._next_attempt = 0.0
+        self.fts_enabled = False
+
+    def ensure_schema(self) -> None:
+        """
+        创建全文索引（幂等）：SQLite为FTS5虚拟表及同步触发器，PostgreSQL为GIN表达式索引
+        DDL全部成功后才标记为就绪；失败时先用LIKE匹配，SCHEMA_RETRY_SECONDS 后再次尝试
+        """
+        if self._schema_ready or time.monotonic() < self._next_attempt:
+            return
+        self._next_attempt = time.monotonic() + SCHEMA_RETRY_SECONDS
+
+        NoteSearchEntry.__table__.create(self.engine, checkfirst=True)
+        dialect = self.engine.dialect.name
+        if dialect == "postgresql":
+            statements = [
+                f"CREATE INDEX IF NOT EXISTS {_PG_INDEX} ON note_search_entries USING GIN ({_PG_TSVECTOR})",
+            ]
+        elif dialect == "sqlite":
+            statements = [
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {_FTS_TABLE} USING fts5("
+                f"tokens, content='note_search_entries', content_rowid='id', tokenize='unicode61')",
+                f"CREATE TRIGGER IF NOT EXISTS note_search_ai AFTER INSERT ON note_search_entries BEGIN "
+                f"INSERT INTO {_FTS_TABLE}(rowid, tokens) VALUES (new.id, new.tokens); END",
+                f"CREATE TRIGGER IF NOT EXISTS note_search_ad AFTER DELETE ON note_search_entries BEGIN "
+                f"INSERT INTO {_FTS_TABLE}({_FTS_TABLE}, rowid, tokens) VALUES ('delete', old.id, old.tokens); END",
+                f"CREATE TRIGGER IF NOT EXISTS note_search_au AFTER UPDATE ON note_search_entries BEGIN "
+                f"INSERT INTO {_FTS_TABLE}({_FTS_TABLE}, rowid, tokens) VALUES ('delete', old.id, old.tokens); "
+                f"INSERT INTO {_FTS_TABLE}(rowid, tokens) VALUES (new.id, new.tokens); END",
+            ]
+        else:
+            print(f"ℹ️ {dialect} 数据库不支持全文索引，笔记检索使用LIKE匹配")
+            self._schema_ready = True
+            return
+
+        try:
+            with self.engine.begin() as conn:
+                for statement in statements:
+                    conn.execute(text(statement))
+            self.fts_enabled = True
+            self._schema_ready = True
+            print(f"✅ 笔记全文索引已就绪 ({dialect})")
+        except Exception as e:
+            print(f"⚠️ 笔记全文索引初始化失败，暂时使用LIKE匹配: {e}")
+
+    def index_bookmarks(self, db: Session, user_id: int, book_id: str, book_title: str,
+                        bookmarks_data: Dict, chapters: Optional[List[Tuple]] = None,
+                        replace: bool = False) -> int:
+        """
+        将一次书签同步的结果写入索引
+
+        Args:
+            bookmarks_data: get_bookmarks 的返回值，使用其中的 updated / removed
+            chapters: (chapterUid, level, title) 列表，用于补充章节标题；None 时取书签数据中的 chapters
+            replace: 全量同步(synckey=0)时为True，先清空该书的旧索引
+
+        Returns:
+            写入或更新的条目数
+        """
+        if not bookmarks_data or bookmarks_data.get('error'):
+            return 0
+        self.ensure_schema()
+
+        if chapters is not None:
+            chapter_titles = {chapter[0]: chapter[2] for chapter in chapters}
+        else:
+            # 未提供目录时使用书签接口自带的章节列表
+            chapter_titles = {
+                chapter.get('chapterUid'): chapter.get('title', '')
+                for chapter in bookmarks_data.get('chapters') or [] if isinstance(chapter, dict)
+            }
+        updated = bookmarks_data.get('updated') or bookmarks_data.get('bookmarks') or []
+        removed = bookmarks_data.get('removed') or []
+
+        query = db.query(NoteSearchEntry).filter(
+            NoteSearchEntry.user_id == user_id,
+            NoteSearchEntry.book_id == book_id
+        )
+        if replace:
+            query.delete(synchronize_session=False)
+            existing = {}
+        else:
+            removed_ids = [str(item.get('bookmarkId') if isinstance(item, dict) else item) for item in removed]
+            if removed_ids:
+                query.filter(NoteSearchEntry.bookmark_id.in_(removed_ids)).delete(synchronize_session=False)
+            updated_ids = [str(item.get('bookmarkId', '')) for item in updated]
+            existing = {
+                entry.bookmark_id: entry
+                for entry in query.filter(NoteSearchEntry.bookmark_id.in_(updated_ids)).all()
+            } if updated_ids else {}
+
+        count = 0
+        for bookmark in updated:
+            mark_text = (bookmark.get('markText') or '').strip()
+            note_text = (bookmark.get('noteText') or '').strip()
+            if not mark_text and not note_text:
+                continue
+
+            bookmark_id = str(bookmark.get('bookmarkId', ''))
+            chapter_uid = bookmark.get('chapterUid')
+            entry = existing.get(bookmark_id)
+            if entry is None:
+                entry = NoteSearchEntry(user_id=user_id, book_id=book_id, bookmark_id=bookmark_id)
+                db.add(entry)
+
+            entry.book_title = book_title or ''
+            entry.chapter_uid = chapter_uid
+            entry.chapter_title = chapter_titles.get(chapter_uid, '')
+            entry.mark_text = mark_text
+            entry.note_text = note_text
+            entry.create_time = bookmark.get('createTime', 0) or 0
+            entry.tokens = tokenize_for_index(f"{mark_text} {note_text}")
+            count += 1
+
+        db.commit()
+        print(f"🔎 笔记索引更新: book_id={book_id}, 写入 {count} 条, 删除 {len(removed)} 条")
+        return count
+
+    def indexed_book_ids(self, db: Session, user_id: int) -> set:
+        """已建立索引的书籍ID"""
+        self.ensure_schema()
+        return {
+            row[0] for row in
+            db.query(NoteSearchEntry.book_id).filter(NoteSearchEntry.user_id == user_id).distinct()
+        }
+
+    def search(self, db: Session, user_id: int, query: str,
+               offset: int = 0, limit: int = 20) -> Tuple[List[Dict], int]:
+        """
+        按相关度检索用户的笔记
+
+        Returns:
+            (当前页结果, 命中总数)
+        """
+        self.ensure_schema()
+        terms = [term for term in query.split() if term.strip()]
+        if not terms:
+            return [], 0
+
+        if self.fts_enabled:
+            try:
+                if self.engine.dialect.name == "postgresql":
+                    return self._search_pg(db, user_id, terms, offset, limit)
+                return self._search_fts(db, user_id, terms, offset, limit)
+            except Exception as e:
+                db.rollback()
+                print(f"⚠️ 全文检索失败，回退到LIKE匹配: {e}")
+
+        return self._search_like(db, user_id, terms, offset, limit)
+
+    def _search_fts(self, db: Session, user_id: int, terms: List[str],
+                    offset: int, limit: int) -> Tuple[List[Dict], int]:
+        match_expr = self._build_match_expression(terms)
+        if not match_expr:
+            return [], 0
+
+        params = {"match": match_expr, "user_id": user_id, "limit": limit, "offset": offset}
+        total = db.execute(text(
+            f"SELECT COUNT(*) FROM {_FTS_TABLE} JOIN note_search_entries e ON e.id = {_FTS_TABLE}.rowid "
+            f"WHERE {_FTS_TABLE} MATCH :match AND e.user_id = :user_id"
+        ), params).scalar() or 0
+
+        rows = db.execute(text(
+            f"SELECT e.id, bm25({_FTS_TABLE}) AS rank FROM {_FTS_TABLE} "
+            f"JOIN note_search_entries e ON e.id = {_FTS_TABLE}.rowid "
+            f"WHERE {_FTS_TABLE} MATCH :match AND e.user_id = :user_id "
+            f"ORDER BY rank LIMIT :limit OFFSET :offset"
+        ), params).all()
+
+        # bm25 越小越相关，转换为正数得分
+        return self._load_results(db, rows, terms, lambda rank: -float(rank)), total
+
+    def _search_pg(self, db: Session, user_id: int, terms: List[str],
+                   offset: int, limit: int) -> Tuple[List[Dict], int]:
+        tsquery = self._build_tsquery(terms)
+        if not tsquery:
+            return [], 0
+
+        params = {"tsquery": tsquery, "user_id": user_id, "limit": limit, "offset": offset}
+        where = f"{_PG_TSVECTOR} @@ to_tsquery('simple', :tsquery) AND user_id = :user_id"
+        total = db.execute(text(f"SELECT COUNT(*) FROM note_search_entries WHERE {where}"), params).scalar() or 0
+
+        rows = db.execute(text(
+            f"SELECT id, ts_rank_cd({_PG_TSVECTOR}, to_tsquery('simple', :tsquery)) AS rank "
+            f"FROM note_search_entries WHERE {where} "
+            f"ORDER BY rank DESC, create_time DESC LIMIT :limit OFFSET :offset"
+        ), params).all()
+
+        return self._load_results(db, rows, terms, float), total
+
+    def _load_results(self, db: Session, rows, terms: List[str], to_score) -> List[Dict]:
+        """按检索结果的 (id, rank) 顺序加载条目并格式化"""
+        entries = {
+            entry.id: entry
+            for entry in db.query(NoteSearchEntry).filter(NoteSearchEntry.id.in_([row.id for row in rows])).all()
+        } if rows else {}
+        return [
+            self._format_result(entries[row.id], terms, to_score(row.rank))
+            for row in rows if row.id in entries
+        ]
+
+    def _search_like(self, db: Session, user_id: int, terms: List[str],
+                     offset: int, limit: int) -> Tuple[List[Dict], int]:
+        query = db.query(NoteSearchEntry).filter(NoteSearchEntry.user_id == user_id)
+        for term in terms:
+            pattern = f"%{term}%"
+            query = query.filter(or_(
+                NoteSearchEntry.mark_text.ilike(pattern),
+                NoteSearchEntry.note_text.ilike(pattern)
+            ))
+
+        total = query.count()
+        entries = query.order_by(NoteSearchEntry.create_time.desc()).offset(offset).limit(limit).all()
+        return [self._format_result(entry, terms, 0.0) for entry in entries], total
+
+    @staticmethod
+    def _build_match_expression(terms: List[str]) -> str:
+        """每个查询词转为一个FTS5短语，CJK按单字组成连续短语，多个词之间为AND"""
+        phrases = []
+        for term in terms:
+            tokens = tokenize_for_index(term).replace('"', ' ').split()
+            if not tokens:
+                continue
+            phrase = '"' + ' '.join(tokens) + '"'
+            if not _CJK_RE.search(term):
+                phrase += '*'  # 英文词支持前缀匹配
+            phrases.append(phrase)
+        return ' AND '.join(phrases)
+
+    @staticmethod
+    def _build_tsquery(terms: List[str]) -> str:
+        """
+        PostgreSQL tsquery：每个查询词的token用 <-> 连成短语（CJK即连续单字），英文词末尾前缀匹配，
+        多个词之间为 &；token逐个加引号转义，查询词中的运算符不会被解析
+        """
+        phrases = []
+        for term in terms:
+            lexemes = [
+                "'" + token.replace("\\", "\\\\").replace("'", "''") + "'"
+                for token in tokenize_for_index(term).split() if _WORD_RE.search(token)
+            ]
+            if not lexemes:
+                continue
+            if not _CJK_RE.search(term):
+                lexemes[-1] += ':*'  # 英文词支持前缀匹配
+            phrases.append('(' + ' <-> '.join(lexemes) + ')')
+        return ' & '.join(phrases)
+
+    @staticmethod
+    def _make_snippet(content: str, terms: List[str], radius: int = 40) -> Dict:
+        """截取命中位置附近的片段，并给出片段内的命中区间"""
+        if not content:
+            return {"text": "", "matches": []}
+
+        lower = content.lower()
+        positions = []
+        for term in terms:
+            term_lower = term.lower()
+            pos = lower.find(term_lower)
+            if pos >= 0:
+                positions.append((pos, pos + len(term_lower)))
+
+        if not positions:
+            snippet = content[:radius * 2]
+            return {"text": snippet + ('…' if len(content) > len(snippet) else ''), "matches": []}
+
+        first = min(positions)[0]
+        start = max(0, first - radius)
+        end = min(len(content), first + radius * 2)
+        prefix = '…' if start > 0 else ''
+        suffix = '…' if end < len(content) else ''
+        matches = [
+            [s - start + len(prefix), e - start + len(prefix)]
+            for s, e in sorted(positions) if s >= start and e <= end
+        ]
+        return {"text": prefix + content[start:end] + suffix, "matches": matches}
+
+    def _format_result(self, entry: NoteSearchEntry, terms: List[str], score: float) -> Dict:
+        return {
+            "bookId": entry.book_id,
+            "bookTitle": entry.book_title,
+            "chapterUid": entry.chapter_uid,
+            "chapterTitle": entry.chapter_title,
+            "bookmarkId": entry.bookmark_id,
+            "createTime": entry.create_time,
+            "markText": self._make_snippet(entry.mark_text, terms),
+            "noteText": self._make_snippet(entry.note_text, terms),
+            "score": round(score, 6)
+        }
+
+
+# 全局笔记索引实例
+notes_index = NotesSearchIndex()
+
+
+class NotesIndexBackfill:
+    """
+    笔记索引回填：索引原本只在用户打开某本书的笔记时写入，
+    用户第一次检索笔记时在后台把笔记本列表中尚未建立索引的书籍补齐
+    """
+
+    def __init__(self, index: NotesSearchIndex = notes_index):
+        self.index = index
+        self._states: Dict[int, Dict] = {}
+        self._lock = threading.Lock()
+        # 单线程逐本同步，避免批量请求书签接口
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notes-backfill")
+
+    def status(self, user_id: int) -> Optional[Dict]:
+        state = self._states.get(user_id)
+        return dict(state) if state else None
+
+    def schedule(self, user_id: int, cookies: str) -> bool:
+        """本进程内每个用户只回填一次（失败后下次检索重试），已在回填时不重复安排"""
+        with self._lock:
+            state = self._states.get(user_id)
+            if state and state['status'] in ('running', 'complete'):
+                return False
+            self._states[user_id] = {"status": "running", "indexed_books": 0, "total_books": 0}
+        self._executor.submit(self._run, user_id, cookies)
+        return True
+
+    def _run(self, user_id: int, cookies: str) -> None:
+        db = SessionLocal()
+        state = self._states[user_id]
+        try:
+            weread_api = weread_clients.for_cookies(cookies, user_id)
+            indexed = self.index.indexed_book_ids(db, user_id)
+            missing = [
+                notebook for notebook in weread_api.get_notebooks()
+                if str(notebook['bookId']) not in indexed
+            ]
+            state['total_books'] = len(missing)
+            print(f"🔎 笔记索引回填开始: user_id={user_id}, {len(missing)} 本书未建立索引")
+
+            for notebook in missing:
+                book_id = str(notebook['bookId'])
+                # 索引需要全量书签，章节标题取书签接口自带的 chapters
+                bookmarks_data = weread_api.get_bookmarks(book_id, "0")
+                book_title = (
+                    (notebook.get('book') or {}).get('title')
+                    or ((bookmarks_data or {}).get('book') or {}).get('title', '')
+                )
+                self.index.index_bookmarks(db, user_id, book_id, book_title, bookmarks_data, replace=True)
+                state['indexed_books'] += 1
+
+            state['status'] = 'complete'
+            print(f"✅ 笔记索引回填完成: user_id={user_id}, {state['indexed_books']} 本")
+        except CookieExpiredException as e:
+            state['status'] = 'failed'
+            print(f"🔐 笔记索引回填中止 user_id={user_id}: {e}")
+        except Exception as e:
+            state['status'] = 'failed'
+            print(f"❌ 笔记索引回填出错 user_id={user_id}: {e}")
+        finally:
+            db.close()
+
+
+# 全局笔记索引回填实例
+notes_backfill = NotesIndexBackfill()
@@ -0,0 +1,137 @@
+# 阅读进度：把 syncBook 返回的 bookProgress 落到 reading_progress 表，"在读"和进度时间线走索引查询
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import ReadingProgress
+from shelf_store import on_shelf_change
+from shelf_stats import to_seconds
+
+def _to_int(value, default: Optional[int] = 0) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def progress_fields(progress: Dict, book: Optional[Dict] = None) -> Dict:
+    """bookProgress 条目（及书架上对应的书籍）转换为 ReadingProgress 的列值"""
+    book = book or {}
+    return {
+        'title': book.get('title') or '',
+        'author': book.get('author') or '',
+        'cover': book.get('cover') or '',
+        'progress': _to_int(progress.get('progress')),
+        'chapter_uid': _to_int(progress.get('chapterUid'), None),
+        'chapter_idx': _to_int(progress.get('chapterIdx'), None),
+        'reading_time': _to_int(progress.get('readingTime')),
+        'finish_reading': book.get('finishReading') == 1,
+        'update_time': to_seconds(progress.get('updateTime')),
+    }
+
+
+def sync_reading_progress(db: Session, user_id: int, user_data: Dict) -> Tuple[int, int]:
+    """
+    用书架数据中的 bookProgress 同步 reading_progress 表
+    只写入有变化的记录；只删除已离开书架的书籍的进度，本批 bookProgress 中缺少的在架书籍保留原记录
+
+    Returns:
+        (写入条数, 删除条数)
+    """
+    books = {str(book.get('bookId')): book for book in user_data.get('books') or [] if book.get('bookId')}
+    incoming = {}
+    for progress in user_data.get('bookProgress') or []:
+        if isinstance(progress, dict) and progress.get('bookId'):
+            book_id = str(progress['bookId'])
+            incoming[book_id] = progress_fields(progress, books.get(book_id))
+
+    existing = {
+        row.book_id: row
+        for row in db.query(ReadingProgress).filter(ReadingProgress.user_id == user_id)
+    }
+
+    written = 0
+    for book_id, fields in incoming.items():
+        row = existing.get(book_id)
+        if row is None:
+            db.add(ReadingProgress(user_id=user_id, book_id=book_id, **fields))
+            written += 1
+        elif any(getattr(row, name) != value for name, value in fields.items()):
+            for name, value in fields.items():
+                setattr(row, name, value)
+            written += 1
+
+    removed = 0
+    # 书架数据不含书籍列表时无法判断哪些书已移出书架，不做删除
+    for book_id, row in existing.items():
+        if books and book_id not in books and book_id not in incoming:
+            db.delete(row)
+            removed += 1
+
+    if written or removed:
+        db.commit()
+    return written, removed
+
+
+def _serialize(row: ReadingProgress) -> Dict:
+    return {
+        "bookId": row.book_id,
+        "title": row.title,
+        "author": row.author,
+        "cover": row.cover,
+        "progress": row.progress,
+        "chapterUid": row.chapter_uid,
+        "chapterIdx": row.chapter_idx,
+        "readingTime": row.reading_time,
+        "finishReading": 1 if row.finish_reading else 0,
+        "updateTime": row.update_time
+    }
+
+
+def get_currently_reading(db: Session, user_id: int, limit: int = 10) -> List[Dict]:
+    """未读完且已有进度的书籍，按最近阅读时间降序（命中 user_id, finish_reading, update_time 索引）"""
+    rows = (
+        db.query(ReadingProgress)
+        .filter(
+            ReadingProgress.user_id == user_id,
+            ReadingProgress.finish_reading == False,  # noqa: E712
+            ReadingProgress.progress > 0
+        )
+        .order_by(ReadingProgress.update_time.desc())
+        .limit(limit)
+        .all()
+    )
+    return [_serialize(row) for row in rows]
+
+
+def get_progress_timeline(db: Session, user_id: int, since: Optional[int] = None,
+                          until: Optional[int] = None, offset: int = 0,
+                          limit: int = 20) -> Tuple[List[Dict], int]:
+    """
+    按进度更新时间降序的阅读时间线（命中 user_id, update_time 索引）
+
+    Args:
+        since / until: 时间范围（秒），闭区间
+    """
+    query = db.query(ReadingProgress).filter(
+        ReadingProgress.user_id == user_id,
+        ReadingProgress.update_time > 0
+    )
+    if since is not None:
+        query = query.filter(ReadingProgress.update_time >= since)
+    if until is not None:
+        query = query.filter(ReadingProgress.update_time <= until)
+
+    total = query.count()
+    rows = query.order_by(ReadingProgress.update_time.desc()).offset(offset).limit(limit).all()
+    return [_serialize(row) for row in rows], total
+
+
+@on_shelf_change
+def _sync_progress_on_shelf_change(db: Session, user_id: int, old_data, new_data: Dict, version: int) -> None:
+    # 没有 bookProgress 的书架数据（仅解析HTML得到的数据、syncBook失败）不改动已有进度
+    if not isinstance(new_data, dict) or not new_data.get('bookProgress'):
+        return
+    written, removed = sync_reading_progress(db, user_id, new_data)
+    if written or removed:
+        print(f"📈 阅读进度已同步: user_id={user_id}, 写入 {written} 条, 删除 {removed} 条")
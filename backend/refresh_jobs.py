@@ -0,0 +1,163 @@
+# 书架刷新任务：刷新放到工作线程池执行，接口立即返回任务ID，进度通过轮询或SSE获取
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from database import SessionLocal
+from models import User
+from shelf_refresh import refresh_user_shelf_exclusive
+
+# 进度阶段的提示文字
+STAGE_MESSAGES = {
+    'queued': '刷新任务已排队',
+    'started': '开始获取书架数据',
+    'html_fetched': '书架HTML已获取',
+    'batch_synced': '书籍详情同步中',
+    'persisted': '书架数据已保存',
+    'shared': '已使用同时进行的另一次刷新的结果',
+    'succeeded': '书架刷新完成',
+    'failed': '书架刷新失败',
+}
+
+
+class RefreshJob:
+    def __init__(self, user_id: int):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.status = 'queued'  # queued / running / succeeded / failed
+        self.events: List[Dict] = []
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self.add_event('queued')
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('succeeded', 'failed')
+
+    def add_event(self, stage: str, info: Optional[Dict] = None) -> None:
+        with self._lock:
+            self._append_event(stage, info)
+
+    def _append_event(self, stage: str, info: Optional[Dict] = None) -> None:
+        self.events.append({
+            "seq": len(self.events) + 1,
+            "stage": stage,
+            "message": STAGE_MESSAGES.get(stage, stage),
+            "info": info or {},
+            "time": time.time()
+        })
+
+    def finish(self, status: str, result: Optional[Dict] = None, error: Optional[str] = None) -> None:
+        """
+        结束任务：在同一把锁内先追加最终事件再设置状态，
+        看到任务已结束的轮询/SSE读者一定也能读到最终事件
+        """
+        with self._lock:
+            self._append_event(status, result or {"error": error})
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self.status = status
+
+    def events_since(self, seq: int) -> List[Dict]:
+        with self._lock:
+            return self.events[seq:]
+
+    def to_dict(self, include_events: bool = True) -> Dict:
+        with self._lock:
+            data = {
+                "job_id": self.id,
+                "status": self.status,
+                "progress": self.events[-1] if self.events else None,
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at
+            }
+            if include_events:
+                data["events"] = list(self.events)
+            return data
+
+
+class RefreshJobManager:
+    """
+    刷新任务管理
+    同一用户同时只有一个进行中的任务，重复提交返回已有任务；已结束的任务保留 ttl_seconds 供查询
+    """
+
+    def __init__(self, max_workers: int = 4, ttl_seconds: int = 600):
+        self.ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, RefreshJob] = {}
+        self._active: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shelf-refresh")
+
+    def submit(self, user_id: int, cookies: str) -> RefreshJob:
+        with self._lock:
+            self._prune()
+            active_id = self._active.get(user_id)
+            if active_id and active_id in self._jobs:
+                return self._jobs[active_id]
+
+            job = RefreshJob(user_id)
+            self._jobs[job.id] = job
+            self._active[user_id] = job.id
+
+        self._executor.submit(self._run, job, cookies)
+        return job
+
+    def get(self, job_id: str, user_id: int) -> Optional[RefreshJob]:
+        job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    def _prune(self) -> None:
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at and now - job.finished_at > self.ttl_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _run(self, job: RefreshJob, cookies: str) -> None:
+        job.status = 'running'
+        job.add_event('started')
+        status, result, error = 'failed', None, None
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.id == job.user_id).first()
+            if user is None:
+                raise Exception("用户不存在")
+
+            user_data, _ = refresh_user_shelf_exclusive(db, user, cookies, progress_callback=job.add_event)
+            if user_data.get('error'):
+                error = user_data['error']
+                result = {"error": user_data['error'], "need_login": user_data.get('need_login', False)}
+            else:
+                result = {
+                    "total_books": len(user_data.get('books', [])),
+                    "source": user_data.get('source', 'unknown'),
+                    "html_book_count": user_data.get('html_book_count', 0),
+                    "synced_book_count": user_data.get('synced_book_count', 0)
+                }
+                status = 'succeeded'
+        except Exception as e:
+            print(f"❌ 书架刷新任务失败 job={job.id}: {e}")
+            error = str(e)
+        finally:
+            db.close()
+            job.finish(status, result, error)
+            with self._lock:
+                if self._active.get(job.user_id) == job.id:
+                    del self._active[job.user_id]
+
+
+# 全局刷新任务管理实例
+refresh_jobs = RefreshJobManager()
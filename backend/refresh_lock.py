@@ -0,0 +1,110 @@
+# 书架刷新租约：基于数据库行的按用户互斥，多个worker/线程同时刷新同一用户时只有一个真正抓取
+import asyncio
+import os
+import time
+import uuid
+from typing import Optional
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal
+from models import RefreshLease
+
+# 租约有效期；持有者在刷新过程中的每个进度节点续期
+LEASE_TTL_SECONDS = 300
+WAIT_POLL_SECONDS = 0.5
+
+
+def _new_owner() -> str:
+    return f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+
+
+def acquire_refresh_lease(user_id: int, ttl: int = LEASE_TTL_SECONDS) -> Optional[str]:
+    """
+    尝试获取用户的刷新租约
+
+    Returns:
+        持有者标识（释放/续期时使用）；租约被其他持有者占用时返回 None
+    """
+    owner = _new_owner()
+    db = SessionLocal()
+    try:
+        if db.query(RefreshLease.id).filter(RefreshLease.user_id == user_id).first() is None:
+            try:
+                db.add(RefreshLease(user_id=user_id, owner=None, expires_at=0))
+                db.commit()
+            except IntegrityError:
+                # 其他worker同时插入了该用户的租约行
+                db.rollback()
+
+        now = int(time.time())
+        # 条件更新是原子的：只有租约空闲或已过期时才能抢到
+        acquired = (
+            db.query(RefreshLease)
+            .filter(
+                RefreshLease.user_id == user_id,
+                or_(RefreshLease.owner.is_(None), RefreshLease.expires_at < now)
+            )
+            .update({RefreshLease.owner: owner, RefreshLease.expires_at: now + ttl}, synchronize_session=False)
+        )
+        db.commit()
+        return owner if acquired == 1 else None
+    finally:
+        db.close()
+
+
+def renew_refresh_lease(user_id: int, owner: str, ttl: int = LEASE_TTL_SECONDS) -> bool:
+    db = SessionLocal()
+    try:
+        renewed = (
+            db.query(RefreshLease)
+            .filter(RefreshLease.user_id == user_id, RefreshLease.owner == owner)
+            .update({RefreshLease.expires_at: int(time.time()) + ttl}, synchronize_session=False)
+        )
+        db.commit()
+        return renewed == 1
+    finally:
+        db.close()
+
+
+def release_refresh_lease(user_id: int, owner: str) -> None:
+    db = SessionLocal()
+    try:
+        (
+            db.query(RefreshLease)
+            .filter(RefreshLease.user_id == user_id, RefreshLease.owner == owner)
+            .update({RefreshLease.owner: None, RefreshLease.expires_at: 0}, synchronize_session=False)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def is_refresh_in_progress(user_id: int) -> bool:
+    db = SessionLocal()
+    try:
+        lease = db.query(RefreshLease).filter(RefreshLease.user_id == user_id).first()
+        return bool(lease and lease.owner and lease.expires_at >= int(time.time()))
+    finally:
+        db.close()
+
+
+def wait_for_refresh(user_id: int, timeout: float = LEASE_TTL_SECONDS) -> bool:
+    """阻塞等待进行中的刷新结束（用于工作线程），超时返回 False"""
+    deadline = time.monotonic() + timeout
+    while is_refresh_in_progress(user_id):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(WAIT_POLL_SECONDS)
+    return True
+
+
+async def wait_for_refresh_async(user_id: int, timeout: float = LEASE_TTL_SECONDS) -> bool:
+    """在请求处理协程中等待进行中的刷新结束，不阻塞事件循环"""
+    deadline = time.monotonic() + timeout
+    while is_refresh_in_progress(user_id):
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(WAIT_POLL_SECONDS)
+    return True
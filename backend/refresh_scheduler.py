@@ -0,0 +1,161 @@
+# 后台书架刷新调度：定期为活跃用户刷新书架，请求始终读取最近一次保存的快照
+import asyncio
+import random
+import time
+from typing import Dict, Optional
+
+from credentials import credential_manager
+from database import SessionLocal
+from models import User, UserBooks
+from shelf_refresh import refresh_user_shelf_exclusive
+from weread_clients import get_user_cookies, weread_clients
+
+try:
+    from config import settings
+except ImportError:
+    from config_simple import settings
+
+
+class _UserSchedule:
+    __slots__ = ('interval', 'next_due', 'running')
+
+    def __init__(self, interval: float, next_due: float):
+        self.interval = interval
+        self.next_due = next_due
+        self.running = False
+
+
+class ShelfRefreshScheduler:
+    """
+    进程内的书架刷新调度器
+
+    - 每个用户有独立的刷新间隔：书架有变化时间隔减半，没有变化时逐步放大，限制在 [min, max] 之间
+    - 每次安排的时间加上随机抖动，避免大量用户在同一时刻请求微信读书
+    - 全局信号量限制同时进行的刷新数量；刷新本身是阻塞的requests调用，放到线程池执行
+    """
+
+    def __init__(self, base_interval: float, min_interval: float, max_interval: float,
+                 concurrency: int = 2, jitter: float = 0.2, tick_seconds: float = 30):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.tick_seconds = tick_seconds
+        self.concurrency = concurrency
+        self._schedules: Dict[int, _UserSchedule] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _jittered(self, interval: float) -> float:
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        print(f"⏰ 书架后台刷新已启动: 基础间隔 {self.base_interval:.0f}s, 并发上限 {self.concurrency}")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _active_user_ids(self) -> list:
+        db = SessionLocal()
+        try:
+            # 只刷新已有书架缓存的活跃用户
+            rows = (
+                db.query(User.id)
+                .join(UserBooks, UserBooks.user_id == User.id)
+                .filter(User.is_active == True)  # noqa: E712
+                .all()
+            )
+            return [row[0] for row in rows]
+        finally:
+            db.close()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                user_ids = await loop.run_in_executor(None, self._active_user_ids)
+                now = time.monotonic()
+
+                for user_id in set(self._schedules) - set(user_ids):
+                    if not self._schedules[user_id].running:
+                        del self._schedules[user_id]
+
+                for user_id in user_ids:
+                    schedule = self._schedules.get(user_id)
+                    if schedule is None:
+                        # 新用户的首次刷新随机分散在一个基础间隔内
+                        schedule = self._schedules[user_id] = _UserSchedule(
+                            self.base_interval, now + random.uniform(0, self.base_interval)
+                        )
+                    if not schedule.running and schedule.next_due <= now:
+                        schedule.running = True
+                        loop.create_task(self._refresh(user_id, schedule))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ 书架后台刷新调度出错: {e}")
+
+            await asyncio.sleep(self.tick_seconds)
+
+    async def _refresh(self, user_id: int, schedule: _UserSchedule) -> None:
+        try:
+            async with self._semaphore:
+                status = await asyncio.get_running_loop().run_in_executor(None, self._refresh_blocking, user_id)
+
+            if status == 'changed':
+                schedule.interval = max(self.min_interval, schedule.interval / 2)
+            elif status == 'unchanged':
+                schedule.interval = min(self.max_interval, schedule.interval * 1.5)
+            elif status == 'refresh_in_progress':
+                # 刚被其他刷新更新过，保持当前间隔
+                pass
+            else:
+                # cookie过期或刷新失败，按最长间隔重试
+                schedule.interval = self.max_interval
+            print(f"⏰ 后台刷新 user_id={user_id}: {status}, 下次间隔约 {schedule.interval:.0f}s")
+        except Exception as e:
+            schedule.interval = self.max_interval
+            print(f"⚠️ 后台刷新失败 user_id={user_id}: {e}")
+        finally:
+            schedule.next_due = time.monotonic() + self._jittered(schedule.interval)
+            schedule.running = False
+
+    def _refresh_blocking(self, user_id: int) -> str:
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.id == user_id, User.is_active == True).first()  # noqa: E712
+            if not user:
+                return 'skipped'
+            # 凭证临近过期时先用 wr_rt 续期，避免请求路径上才遇到第一次401
+            try:
+                credential_manager.renew_if_due(db, user, weread_clients.get(user))
+            except Exception as e:
+                print(f"⚠️ 凭证续期失败: user={user_id} - {e}")
+            # 其他worker或手动刷新正在进行时跳过本轮，不等待
+            user_data, saved = refresh_user_shelf_exclusive(db, user, get_user_cookies(user),
+                                                            skip_unchanged=True, wait=False)
+            if user_data.get('error'):
+                return user_data['error']
+            return 'changed' if saved else 'unchanged'
+        finally:
+            db.close()
+
+
+shelf_refresh_scheduler = ShelfRefreshScheduler(
+    base_interval=settings.shelf_refresh_interval_seconds,
+    min_interval=settings.shelf_refresh_min_interval_seconds,
+    max_interval=settings.shelf_refresh_max_interval_seconds,
+    concurrency=settings.shelf_refresh_concurrency,
+    jitter=settings.shelf_refresh_jitter,
+)
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from sqlalchemy.orm import Session
 from datetime import timedelta, datetime
+from typing import Dict, Tuple
+import asyncio
 import json
 import uuid
 import requests
@@ -9,12 +11,15 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import get_db
-from models import User, UserBooks
+from database import get_db, SessionLocal
+from models import User
 from schemas import WeReadLogin, Token, User as UserSchema, APIResponse
 from auth import create_access_token, get_current_user
 from weread_api import WeReadAPI
+from weread_clients import weread_clients
 from cookie_manager import cookie_manager
+from shelf_store import save_user_books
+from refresh_jobs import refresh_jobs
 # 现在使用前端微信JS SDK登录，不再需要后端Selenium登录服务
 try:
     from config import settings
@@ -23,6 +28,124 @@ except ImportError:
 
 router = APIRouter()
 
+# 登录验证最多等待的时间（秒），各项检查自身的请求超时为10~15秒
+LOGIN_CHECK_TIMEOUT = 20
+
+# 登录返回后仍在运行的书架预览收尾任务，保持引用避免被回收
+_preview_tasks: set = set()
+
+
+def _check_api_login(cookie_string: str) -> Tuple[bool, str]:
+    """使用WeReadAPI验证登录状态"""
+    try:
+        api_valid = WeReadAPI(cookie_string).login_success()
+        api_message = "API验证成功" if api_valid else "API验证失败"
+        print(f"🔍 WeReadAPI验证结果: {api_message}")
+        return api_valid, api_message
+    except UnicodeEncodeError as encoding_error:
+        print(f"❌ 编码错误: {encoding_error}")
+        # 当遇到编码错误时，提供具体的解决建议
+        print(f"💡 建议: 请确保从浏览器Network面板获取完整的Cookie字符串")
+        return False, "Cookie包含特殊字符导致编码错误，请尝试重新获取Cookie"
+    except Exception as api_error:
+        print(f"⚠️ WeReadAPI验证出错: {api_error}")
+        return False, f"API验证出错: {str(api_error)}"
+
+
+def decide_login_mode(checks: Dict[str, tuple]) -> str:
+    """
+    根据已完成的验证结果决定登录模式
+    checks: cookie -> test_cookie_validity 结果, api -> _check_api_login 结果, shelf -> get_bookshelf_preview 结果
+    """
+    is_valid = checks.get('cookie', (False,))[0]
+    api_valid = checks.get('api', (False,))[0]
+    bookshelf_valid = checks.get('shelf', (False,))[0]
+    if api_valid and bookshelf_valid:
+        return "verified"  # 完全验证通过
+    if api_valid or (is_valid and bookshelf_valid):
+        return "partial"   # 部分验证通过
+    if is_valid:
+        return "basic"     # 基本验证通过
+    return "dev"           # 开发模式，允许继续
+
+
+def _log_late_check(name: str, future: asyncio.Future) -> None:
+    if future.cancelled():
+        return
+    try:
+        print(f"🔍 登录后台验证完成: {name} -> {future.result()[0]}")
+    except Exception as e:
+        print(f"⚠️ 登录后台验证出错: {name} - {e}")
+
+
+async def run_login_checks(cookie_string: str, wr_vid: str) -> Tuple[Dict[str, tuple], Dict[str, asyncio.Future]]:
+    """
+    在线程池中并发执行三项登录验证（都是对微信读书的网络请求）
+
+    任一结果使登录模式达到 verified/partial 即返回，其余验证在后台继续，仅记录日志；
+    所有验证都未给出正向结果时等全部完成（或超时）后按已有结果判定
+
+    Returns:
+        (已完成的验证结果, 仍在进行的验证名称 -> future)
+    """
+    loop = asyncio.get_running_loop()
+    futures = {
+        loop.run_in_executor(None, cookie_manager.test_cookie_validity, cookie_string): 'cookie',
+        loop.run_in_executor(None, _check_api_login, cookie_string): 'api',
+        loop.run_in_executor(None, cookie_manager.get_bookshelf_preview, cookie_string, wr_vid): 'shelf',
+    }
+    checks: Dict[str, tuple] = {}
+    pending = set(futures)
+    deadline = loop.time() + LOGIN_CHECK_TIMEOUT
+    while pending:
+        done, pending = await asyncio.wait(
+            pending, timeout=max(0, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED
+        )
+        if not done:
+            print("⚠️ 登录验证超时，按已完成的结果判定")
+            break
+        for future in done:
+            checks[futures[future]] = future.result()
+        if decide_login_mode(checks) in ("verified", "partial"):
+            break
+
+    for future in pending:
+        future.add_done_callback(lambda f, name=futures[future]: _log_late_check(name, f))
+    return checks, {futures[future]: future for future in pending}
+
+
+def _save_shelf_preview(user_id: int, bookshelf_data: Dict) -> None:
+    db = SessionLocal()
+    try:
+        save_user_books(db, user_id, bookshelf_data)
+        print(f"📚 登录后到达的书架预览已缓存: user_id={user_id}, {len(bookshelf_data['books'])}本书")
+    finally:
+        db.close()
+
+
+async def finish_shelf_preview(user_id: int, cookie_string: str, preview: asyncio.Future,
+                               refresh_on_failure: bool) -> None:
+    """
+    令牌签发时书架预览仍在获取：预览带书籍时直接保存，不再提交会重新抓取 /web/shelf 的刷新任务；
+    预览失败或没有书籍时才提交后台刷新任务
+    """
+    try:
+        bookshelf_valid, _, bookshelf_data = await preview
+    except Exception as e:
+        print(f"⚠️ 书架预览出错: {e}")
+        bookshelf_valid, bookshelf_data = False, {}
+
+    if bookshelf_valid and bookshelf_data.get('books'):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, _save_shelf_preview, user_id, bookshelf_data)
+            return
+        except Exception as e:
+            print(f"⚠️ 缓存书架数据失败: {e}")
+    if refresh_on_failure:
+        job = refresh_jobs.submit(user_id, cookie_string)
+        print(f"📚 书架预览没有书籍，改为后台获取: job={job.id}")
+
+
 @router.post("/login", response_model=APIResponse)
 async def login(login_data: WeReadLogin, db: Session = Depends(get_db)):
     """
@@ -61,56 +184,29 @@ async def login(login_data: WeReadLogin, db: Session = Depends(get_db)):
             print(f"⚠️ Cookie编码问题检测: {debug_info}")
             # 可以选择在这里进行额外的处理或警告
         
-        # 3. 测试Cookie有效性 (参考mcp-server-weread的验证方式)
-        is_valid, validation_message, user_info = cookie_manager.test_cookie_validity(cookie_string)
-
-        # 4. 使用WeReadAPI进行更全面的验证
-        api_valid = False
-        api_message = ""
-        try:
-            weread_api = WeReadAPI(cookie_string)
-            api_valid = weread_api.login_success()
-            api_message = "API验证成功" if api_valid else "API验证失败"
-            print(f"🔍 WeReadAPI验证结果: {api_message}")
-        except UnicodeEncodeError as encoding_error:
-            print(f"❌ 编码错误: {encoding_error}")
-            # 当遇到编码错误时，提供具体的解决建议
-            api_message = "Cookie包含特殊字符导致编码错误，请尝试重新获取Cookie"
-            print(f"💡 建议: 请确保从浏览器Network面板获取完整的Cookie字符串")
-        except Exception as api_error:
-            print(f"⚠️ WeReadAPI验证出错: {api_error}")
-            api_message = f"API验证出错: {str(api_error)}"
-
-        # 5. 获取书架预览 (进一步验证)
-        bookshelf_valid = False
-        bookshelf_data = {}
-        if is_valid or api_valid:
-            bookshelf_valid, bookshelf_message, bookshelf_data = cookie_manager.get_bookshelf_preview(
-                cookie_string, login_data.wr_vid
-            )
-            print(f"📚 书架验证结果: {bookshelf_message}")
-
-        # 6. 决定登录策略
-        login_mode = "unknown"
-        if api_valid and bookshelf_valid:
-            login_mode = "verified"  # 完全验证通过
-            print(f"✅ 用户 {login_data.wr_vid} 登录验证完全通过")
-        elif api_valid or (is_valid and bookshelf_valid):
-            login_mode = "partial"   # 部分验证通过
-            print(f"⚠️ 用户 {login_data.wr_vid} 部分验证通过")
-        elif is_valid:
-            login_mode = "basic"     # 基本验证通过
-            print(f"🔶 用户 {login_data.wr_vid} 基本验证通过")
-        else:
-            login_mode = "dev"       # 开发模式，允许继续
-            print(f"🔧 用户 {login_data.wr_vid} 进入开发模式: {validation_message}")
+        # 3. 并发执行Cookie验证、WeReadAPI验证和书架预览，第一个正向结果到达即可签发令牌
+        login_checks, pending_checks = await run_login_checks(cookie_string, login_data.wr_vid)
+        is_valid, validation_message, user_info = login_checks.get('cookie', (False, "Cookie验证未完成", {}))
+        bookshelf_valid, _, bookshelf_data = login_checks.get('shelf', (False, "", {}))
+
+        # 4. 决定登录策略
+        login_mode = decide_login_mode(login_checks)
+        login_mode_messages = {
+            "verified": f"✅ 用户 {login_data.wr_vid} 登录验证完全通过",
+            "partial": f"⚠️ 用户 {login_data.wr_vid} 部分验证通过",
+            "basic": f"🔶 用户 {login_data.wr_vid} 基本验证通过",
+            "dev": f"🔧 用户 {login_data.wr_vid} 进入开发模式: {validation_message}",
+        }
+        print(login_mode_messages[login_mode])
+        if pending_checks:
+            print(f"⏩ 提前签发令牌，仍在后台完成的验证: {', '.join(pending_checks)}")
 
-        # 7. 提取或设置用户信息
+        # 5. 提取或设置用户信息
         if user_info:
             extracted_user_info = cookie_manager.extract_user_info(user_info)
             cookies.update(extracted_user_info)
         
-        # 7. 数据库操作
+        # 6. 数据库操作
         user = db.query(User).filter(User.wr_vid == login_data.wr_vid).first()
         
         if not user:
@@ -146,94 +242,35 @@ async def login(login_data: WeReadLogin, db: Session = Depends(get_db)):
                 user.wr_gender = login_data.wr_gender or cookies.get('wr_gender', '')
                 
             db.commit()
+            # 凭证已更新，丢弃按旧Cookie构建的客户端
+            weread_clients.invalidate(user.id)
             print(f"🔄 更新用户信息: {login_data.wr_vid} - {user.wr_name}")
 
 
-        # 8. 缓存用户数据 (参考mcp-server-weread的数据获取方式)
+        # 7. 缓存用户数据：书架预览已带书籍时直接保存；预览仍在获取时等它落地后保存；
+        #    否则提交后台刷新任务（不等待syncBook批量同步）
         cached_books_count = 0
         cache_success = False
-        if bookshelf_valid and bookshelf_data:
+        refresh_job_id = None
+        shelf_preview_pending = 'shelf' in pending_checks
+        if bookshelf_valid and bookshelf_data.get('books'):
             try:
-                # 直接使用已获取的书架数据
-                user_books = db.query(UserBooks).filter(UserBooks.user_id == user.id).first()
-                if not user_books:
-                    user_books = UserBooks(user_id=user.id, books_data=bookshelf_data)
-                    db.add(user_books)
-                else:
-                    user_books.books_data = bookshelf_data
-                
-                db.commit()
-                cached_books_count = len(bookshelf_data.get('books', []))
+                save_user_books(db, user.id, bookshelf_data)
+                cached_books_count = len(bookshelf_data['books'])
                 cache_success = True
-                if cached_books_count == 0:
-                    print(f"📚 缓存书架数据成功: {cached_books_count}本书 (用户书架为空或权限不足)")
-                else:
-                    print(f"📚 缓存书架数据成功: {cached_books_count}本书")
-                
+                print(f"📚 缓存书架数据成功: {cached_books_count}本书")
             except Exception as e:
                 print(f"⚠️ 缓存书架数据失败: {e}")
+        elif shelf_preview_pending:
+            task = asyncio.create_task(finish_shelf_preview(
+                user.id, cookie_string, pending_checks['shelf'], login_mode in ("verified", "partial")
+            ))
+            _preview_tasks.add(task)
+            task.add_done_callback(_preview_tasks.discard)
+            print("📚 书架预览仍在获取，到达后直接缓存")
         elif login_mode == "verified" or login_mode == "partial":
-            # 使用增强版API获取完整书架数据
-            try:
-                weread_api = WeReadAPI(cookie_string)
-                print("📚 开始获取完整书架数据（包括rawBooks和rawIndexes）")
-
-                # 使用增强版方法获取完整数据
-                user_data = weread_api.get_user_data_enhanced(login_data.wr_vid)
-
-                user_books = db.query(UserBooks).filter(UserBooks.user_id == user.id).first()
-                if not user_books:
-                    user_books = UserBooks(user_id=user.id, books_data=user_data)
-                    db.add(user_books)
-                else:
-                    user_books.books_data = user_data
-
-                db.commit()
-                cached_books_count = len(user_data.get('books', []))
-                cache_success = True
-
-                # 显示详细的数据获取信息
-                source = user_data.get('source', 'unknown')
-                html_count = user_data.get('html_book_count', 0)
-                synced_count = user_data.get('synced_book_count', 0)
-
-                print(f"✅ 增强版数据获取成功:")
-                print(f"   📋 数据源: {source}")
-                print(f"   📖 HTML解析: {html_count} 本")
-                print(f"   🔄 syncBook同步: {synced_count} 本")
-                print(f"   📚 总计缓存: {cached_books_count} 本书")
-
-                # 调试：检查缓存的数据结构
-                if cached_books_count == 0:
-                    print("⚠️ 警告：登录时获取的书籍数量为0")
-                    print(f"   user_data类型: {type(user_data)}")
-                    print(f"   user_data键: {list(user_data.keys()) if isinstance(user_data, dict) else 'N/A'}")
-                    books_in_data = user_data.get('books', [])
-                    print(f"   books数据类型: {type(books_in_data)}")
-                    print(f"   books长度: {len(books_in_data) if isinstance(books_in_data, list) else 'N/A'}")
-                else:
-                    print(f"✅ 登录时成功缓存了 {cached_books_count} 本书")
-
-            except Exception as e:
-                print(f"❌ 增强版API获取失败，回退到基础方法: {e}")
-                try:
-                    # 回退到基础方法
-                    weread_api = WeReadAPI(cookie_string)
-                    user_data = weread_api.get_user_data(login_data.wr_vid)
-
-                    user_books = db.query(UserBooks).filter(UserBooks.user_id == user.id).first()
-                    if not user_books:
-                        user_books = UserBooks(user_id=user.id, books_data=user_data)
-                        db.add(user_books)
-                    else:
-                        user_books.books_data = user_data
-
-                    db.commit()
-                    cached_books_count = len(user_data.get('books', []))
-                    cache_success = True
-                    print(f"📚 基础方法缓存成功: {cached_books_count}本书")
-                except Exception as fallback_error:
-                    print(f"⚠️ 基础方法也失败: {fallback_error}")
+            refresh_job_id = refresh_jobs.submit(user.id, cookie_string).id
+            print(f"📚 书架数据在后台获取: job={refresh_job_id}")
         else:
             print(f"⏭️ 跳过数据缓存 - 登录模式: {login_mode}")
 
@@ -244,7 +281,7 @@ async def login(login_data: WeReadLogin, db: Session = Depends(get_db)):
             expires_delta=access_token_expires
         )
 
-        # 9. 生成登录响应 (参考mcp-server-weread的响应格式)
+        # 8. 生成登录响应 (参考mcp-server-weread的响应格式)
         login_messages = {
             "verified": "登录成功，微信读书验证通过",
             "partial": "登录成功，部分功能可用", 
@@ -264,6 +301,9 @@ async def login(login_data: WeReadLogin, db: Session = Depends(get_db)):
             "weread_verified": login_mode in ["verified", "partial"],
             "cached_books_count": cached_books_count,
             "cache_success": cache_success,
+            "refresh_job_id": refresh_job_id,
+            "shelf_preview_pending": shelf_preview_pending,
+            "pending_checks": list(pending_checks),
             "validation_message": validation_message if login_mode == "dev" else "验证通过"
         }
         
@@ -512,71 +552,12 @@ async def weread_cookie_login(cookie_data: dict, db: Session = Depends(get_db)):
             user.wr_localvid = cookies.get('wr_localvid', '')
             user.wr_gender = cookies.get('wr_gender', '')
             db.commit()
+            weread_clients.invalidate(user.id)
         
-        # 尝试获取并缓存用户数据（使用增强版方法）
-        cache_success = False
-        cached_books_count = 0
-        try:
-            print("📚 开始获取完整书架数据（包括rawBooks和rawIndexes）")
-
-            # 使用增强版方法获取完整数据
-            user_data = weread_api.get_user_data_enhanced(wr_vid)
-
-            # 保存或更新用户书籍数据
-            user_books = db.query(UserBooks).filter(UserBooks.user_id == user.id).first()
-            if not user_books:
-                user_books = UserBooks(user_id=user.id, books_data=user_data)
-                db.add(user_books)
-            else:
-                user_books.books_data = user_data
-
-            db.commit()
-            cache_success = True
-            cached_books_count = len(user_data.get('books', []))
-
-            # 显示详细的数据获取信息
-            source = user_data.get('source', 'unknown')
-            html_count = user_data.get('html_book_count', 0)
-            synced_count = user_data.get('synced_book_count', 0)
-
-            print(f"✅ 增强版数据获取成功:")
-            print(f"   📋 数据源: {source}")
-            print(f"   📖 HTML解析: {html_count} 本")
-            print(f"   🔄 syncBook同步: {synced_count} 本")
-            print(f"   📚 总计缓存: {cached_books_count} 本书")
-
-            # 调试：检查缓存的数据结构
-            if cached_books_count == 0:
-                print("⚠️ 警告：登录时获取的书籍数量为0")
-                print(f"   user_data类型: {type(user_data)}")
-                print(f"   user_data键: {list(user_data.keys()) if isinstance(user_data, dict) else 'N/A'}")
-                books_in_data = user_data.get('books', [])
-                print(f"   books数据类型: {type(books_in_data)}")
-                print(f"   books长度: {len(books_in_data) if isinstance(books_in_data, list) else 'N/A'}")
-            else:
-                print(f"✅ 登录时成功缓存了 {cached_books_count} 本书")
-
-        except Exception as e:
-            print(f"❌ 增强版API获取失败，回退到基础方法: {e}")
-            try:
-                # 回退到基础方法
-                user_data = weread_api.get_user_data(wr_vid)
+        # 书架数据在后台刷新任务中获取，登录不等待syncBook批量同步
+        refresh_job_id = refresh_jobs.submit(user.id, cookie_string).id
+        print(f"📚 书架数据在后台获取: job={refresh_job_id}")
 
-                user_books = db.query(UserBooks).filter(UserBooks.user_id == user.id).first()
-                if not user_books:
-                    user_books = UserBooks(user_id=user.id, books_data=user_data)
-                    db.add(user_books)
-                else:
-                    user_books.books_data = user_data
-
-                db.commit()
-                cache_success = True
-                cached_books_count = len(user_data.get('books', []))
-                print(f"📚 基础方法缓存成功: {cached_books_count}本书")
-            except Exception as fallback_error:
-                print(f"⚠️ 缓存用户数据失败: {fallback_error}")
-                # 开发模式下允许缓存失败
-        
         # 创建访问令牌
         access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
         access_token = create_access_token(
@@ -596,8 +577,9 @@ async def weread_cookie_login(cookie_data: dict, db: Session = Depends(get_db)):
                     "wr_name": user.wr_name,
                     "wr_avatar": user.wr_avatar
                 },
-                "cached_books_count": cached_books_count,
-                "cache_success": cache_success,
+                "cached_books_count": 0,
+                "cache_success": False,
+                "refresh_job_id": refresh_job_id,
                 "weread_verified": True
             }
         )
@@ -1,6 +1,10 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import asyncio
+import json
 import math
 
 import sys
@@ -11,24 +15,23 @@ from database import get_db
 from models import User, UserBooks, BookCache
 from schemas import BooksResponse, BookInfo, BookDetail, APIResponse
 from auth import get_current_user
-from weread_api import WeReadAPI
+from weread_api import WeReadAPI, CookieExpiredException
+from weread_clients import get_user_cookies, weread_clients
+from shelf_store import save_user_books, get_shelf_version
+from shelf_refresh import fetch_shelf_data, schedule_enrichment, enrich_requested_page, sort_for_pagination
+from refresh_jobs import refresh_jobs
+from refresh_lock import acquire_refresh_lease, release_refresh_lease, wait_for_refresh_async
+from shelf_stats import get_shelf_stats
+from reading_progress import get_currently_reading, get_progress_timeline
+from metrics import record_cache
 
 router = APIRouter()
 
-def get_user_cookies(user: User) -> str:
-    """Get formatted cookie string for user"""
-    cookies = {
-        'wr_gid': user.wr_gid,
-        'wr_vid': user.wr_vid,
-        'wr_skey': user.wr_skey,
-        'wr_pf': '0',
-        'wr_rt': user.wr_rt,
-        'wr_localvid': user.wr_localvid or '',
-        'wr_name': user.wr_name or '',
-        'wr_avatar': user.wr_avatar or '',
-        'wr_gender': user.wr_gender or ''
-    }
-    return '; '.join([f'{key}={value}' for key, value in cookies.items()])
+# SSE进度推送的轮询间隔和心跳间隔（秒）
+SSE_POLL_INTERVAL = 0.25
+SSE_KEEPALIVE_SECONDS = 15
+# 冷启动刷新时争抢租约的最多轮数；每轮抢不到就等待当前持有者完成
+COLD_REFRESH_ATTEMPTS = 3
 
 @router.get("", response_model=APIResponse)
 async def get_books(
@@ -73,12 +76,37 @@ async def get_books(
                     print("   🔄 需要刷新：缓存的书籍列表为空")
                 else:
                     print(f"   ✅ 使用缓存数据: {len(cached_books)} 本书")
+        record_cache("shelf_snapshot", not need_refresh)
+
+        lease_owner = None
+        if need_refresh:
+            # 同一用户同时只允许一个冷启动刷新；其他请求（含其他worker）等待并直接使用其结果，
+            # 只有持有租约的请求才会调用微信读书
+            for _ in range(COLD_REFRESH_ATTEMPTS):
+                lease_owner = acquire_refresh_lease(current_user.id)
+                if lease_owner is not None:
+                    break
+                print("   ⏳ 其他请求正在刷新书架，等待其结果")
+                finished = await wait_for_refresh_async(current_user.id)
+                db.expire_all()
+                user_books = db.query(UserBooks).filter(UserBooks.user_id == current_user.id).first()
+                shared_data = user_books.books_data if user_books else None
+                if isinstance(shared_data, dict) and shared_data.get('books'):
+                    need_refresh = False
+                    print(f"   ✅ 使用刚刷新的书架数据: {len(shared_data['books'])} 本书")
+                    break
+                if not finished:
+                    break
+
+            if need_refresh and lease_owner is None:
+                print("   ⏳ 书架仍在刷新中，稍后重试")
+                raise HTTPException(status_code=503, detail="书架正在刷新，请稍后重试")
 
         if need_refresh:
             # If no cached data, fetch from WeRead API
             try:
                 cookies = get_user_cookies(current_user)
-                weread_api = WeReadAPI(cookies)
+                weread_api = weread_clients.for_cookies(cookies, current_user.id)
 
                 # 先验证登录状态
                 if not weread_api.login_success():
@@ -97,9 +125,10 @@ async def get_books(
                         }
                     )
 
-                # 使用增强版方法获取完整书架数据
-                print("📚 使用增强版方法获取书架数据（包括rawBooks和rawIndexes）")
-                user_data = weread_api.get_user_data_enhanced(current_user.wr_vid)
+                # 获取书架数据（渐进模式下仅ID的书籍在保存后由后台补全）
+                print("📚 获取书架数据（包括rawBooks和rawIndexes）")
+                user_data = fetch_shelf_data(weread_api, current_user.wr_vid,
+                                             user_books.books_data if user_books else None)
 
                 # 检查返回的数据是否有效
                 if not user_data or not isinstance(user_data, dict):
@@ -137,12 +166,8 @@ async def get_books(
                     user_data = {"books": [], "user_vid": current_user.wr_vid, "empty": True}
 
                 # Save to cache
-                if user_books:
-                    user_books.books_data = user_data
-                else:
-                    user_books = UserBooks(user_id=current_user.id, books_data=user_data)
-                    db.add(user_books)
-                db.commit()
+                user_books = save_user_books(db, current_user.id, user_data, user_books)
+                schedule_enrichment(current_user.id, cookies, user_data)
 
             except Exception as api_error:
                 error_str = str(api_error)
@@ -177,11 +202,18 @@ async def get_books(
                             "error": "API调用失败，请检查网络连接"
                         }
                     )
+            finally:
+                if lease_owner:
+                    release_refresh_lease(current_user.id, lease_owner)
         else:
             # 使用缓存的数据
             user_data = user_books.books_data
             print(f"📚 使用缓存书架数据: {len(user_data.get('books', []))} 本书")
 
+            # 上次的后台补全未完成（例如服务重启）时继续补全
+            if (user_data.get('enrichment') or {}).get('status') in ('pending', 'running'):
+                schedule_enrichment(current_user.id, get_user_cookies(current_user), user_data)
+
         # Get books list
         all_books_data = user_data.get('books', [])
 
@@ -205,8 +237,8 @@ async def get_books(
         else:
             print(f"📋 显示全部书籍: {len(books_data)} 本")
 
-        # Sort by reading time (most recent first)
-        books_data.sort(key=lambda x: x.get('readUpdateTime', 0), reverse=True)
+        # 按最近阅读时间排序；渐进/按需模式保持书架顺序，补全前后分页稳定
+        books_data = sort_for_pagination(user_data, books_data)
 
         # Calculate pagination
         total = len(books_data)
@@ -214,12 +246,14 @@ async def get_books(
         start_idx = (page - 1) * page_size
         end_idx = start_idx + page_size
 
-        # Get page data
-        page_books = books_data[start_idx:end_idx]
+        # Get page data（按需模式下先补全本页的待补全书籍）
+        cookies = get_user_cookies(current_user)
+        page_books = await run_in_threadpool(
+            enrich_requested_page, db, current_user.id, cookies, books_data, start_idx, end_idx
+        )
 
         # Fetch detailed info for books on current page
-        cookies = get_user_cookies(current_user)
-        weread_api = WeReadAPI(cookies)
+        weread_api = weread_clients.for_cookies(cookies, current_user.id)
         detailed_books = []
 
         for book in page_books:
@@ -248,6 +282,7 @@ async def get_books(
                 else:
                     # 检查数据库缓存
                     cached_book = db.query(BookCache).filter(BookCache.book_id == book['bookId']).first()
+                    record_cache("book_cache", cached_book is not None)
 
                     if cached_book:
                         print(f"💾 使用数据库缓存: {book['bookId']}")
@@ -300,6 +335,8 @@ async def get_books(
                     'source': book_info.get('source', 'unknown')  # 添加数据来源标识
                 })
 
+            except CookieExpiredException:
+                raise
             except Exception as e:
                 print(f"⚠️ 处理书籍信息出错 {book['bookId']}: {e}")
                 # 使用原始数据作为备选
@@ -316,8 +353,13 @@ async def get_books(
                 })
 
         # 计算加载状态信息
+        enrichment = user_data.get('enrichment') or {}
         total_all_books = len(all_books_data)
-        rawbooks_count = len([book for book in all_books_data if not book.get('needsDetailFetch', False)])
+        shelf_stats = get_shelf_stats(db, current_user.id)
+        if shelf_stats:
+            rawbooks_count = total_all_books - shelf_stats['pending_details']
+        else:
+            rawbooks_count = len([book for book in all_books_data if not book.get('needsDetailFetch', False)])
         synced_books_count = total_all_books - rawbooks_count
 
         return APIResponse(
@@ -334,14 +376,117 @@ async def get_books(
                     "total_all_books": total_all_books,
                     "rawbooks_count": rawbooks_count,
                     "synced_books_count": synced_books_count,
-                    "has_more_to_sync": False  # 现在已经包含所有书籍，无需再同步
+                    "has_more_to_sync": enrichment.get('status') in ('pending', 'running'),
+                    "enrichment": enrichment,
+                    "shelf_version": get_shelf_version(db, current_user.id)
                 }
             }
         )
 
+    except (CookieExpiredException, HTTPException):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get books: {str(e)}")
 
+@router.get("/stats", response_model=APIResponse)
+async def get_books_stats(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get materialized shelf statistics"""
+    try:
+        stats = get_shelf_stats(db, current_user.id)
+        if stats is None:
+            return APIResponse(
+                success=False,
+                message="暂无书架数据，请先刷新书架",
+                data=None
+            )
+
+        return APIResponse(
+            success=True,
+            message="Shelf stats retrieved successfully",
+            data=stats
+        )
+
+    except CookieExpiredException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get shelf stats: {str(e)}")
+
+@router.get("/version", response_model=APIResponse)
+async def get_books_version(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get the shelf version, bumped on every shelf write; clients poll it to know when to refetch"""
+    try:
+        # 只读 shelf_state 一行，不加载书架数据
+        return APIResponse(
+            success=True,
+            message="Shelf version retrieved successfully",
+            data={"shelf_version": get_shelf_version(db, current_user.id)}
+        )
+
+    except CookieExpiredException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get shelf version: {str(e)}")
+
+@router.get("/reading", response_model=APIResponse)
+async def get_reading_books(
+    limit: int = Query(10, ge=1, le=50),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get books currently being read, most recent first"""
+    try:
+        books = get_currently_reading(db, current_user.id, limit)
+
+        return APIResponse(
+            success=True,
+            message="Currently reading books retrieved successfully",
+            data={"books": books, "total": len(books)}
+        )
+
+    except CookieExpiredException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get reading books: {str(e)}")
+
+@router.get("/progress-timeline", response_model=APIResponse)
+async def get_books_progress_timeline(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    since: Optional[int] = Query(None, ge=0, description="起始时间（Unix秒）"),
+    until: Optional[int] = Query(None, ge=0, description="结束时间（Unix秒）"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get reading progress updates ordered by time"""
+    try:
+        items, total = get_progress_timeline(
+            db, current_user.id, since=since, until=until,
+            offset=(page - 1) * page_size, limit=page_size
+        )
+
+        return APIResponse(
+            success=True,
+            message="Progress timeline retrieved successfully",
+            data={
+                "items": items,
+                "total": total,
+                "page": page,
+                "page_size": page_size,
+                "total_pages": math.ceil(total / page_size) if total > 0 else 1
+            }
+        )
+
+    except CookieExpiredException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get progress timeline: {str(e)}")
+
 @router.get("/{book_id}", response_model=APIResponse)
 async def get_book_detail(
     book_id: str,
@@ -382,13 +527,11 @@ async def get_book_detail(
             db.commit()
 
         # 直接从API获取最新数据
-        cookies = get_user_cookies(current_user)
-        weread_api = WeReadAPI(cookies)
-        book_info = weread_api.get_book_info(book_id)
-
-        # 检查是否是认证错误
-        if book_info.get('error') == '认证失败' or book_info.get('title') == '需要重新登录获取':
-            print(f"🔐 书籍详情获取失败，认证错误: {book_id}")
+        weread_api = weread_clients.get(current_user)
+        try:
+            book_info = weread_api.get_book_info(book_id)
+        except CookieExpiredException:
+            print(f"🔐 书籍详情获取失败，登录已过期: {book_id}")
             return APIResponse(
                 success=False,
                 message="获取书籍详情失败，登录已过期",
@@ -448,72 +591,93 @@ async def get_book_detail(
             }
         )
 
+    except CookieExpiredException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get book detail: {str(e)}")
 
 @router.post("/refresh", response_model=APIResponse)
 async def refresh_books(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user)
 ):
-    """Refresh user's books from WeRead API"""
+    """Start a background shelf refresh job and return its id"""
     try:
         cookies = get_user_cookies(current_user)
-        weread_api = WeReadAPI(cookies)
-
-        # 使用增强版方法获取完整书架数据
-        print("🔄 刷新书架：使用增强版方法获取数据（包括rawBooks和rawIndexes）")
-        user_data = weread_api.get_user_data_enhanced(current_user.wr_vid)
-
-        # 检查是否是cookie过期
-        if user_data.get('error') == 'cookie_expired':
-            print("🔐 刷新时检测到Cookie过期，需要重新登录")
-            return APIResponse(
-                success=False,
-                message="登录已过期，请重新登录",
-                data={
-                    "error": "cookie_expired",
-                    "need_login": True,
-                    "redirect_to": "/login"
-                }
-            )
-
-        # Update cached data
-        user_books = db.query(UserBooks).filter(UserBooks.user_id == current_user.id).first()
-        if user_books:
-            user_books.books_data = user_data
-        else:
-            user_books = UserBooks(user_id=current_user.id, books_data=user_data)
-            db.add(user_books)
-
-        db.commit()
-
-        # 显示详细的刷新信息
-        source = user_data.get('source', 'unknown')
-        html_count = user_data.get('html_book_count', 0)
-        synced_count = user_data.get('synced_book_count', 0)
-        total_count = len(user_data.get('books', []))
-
-        print(f"✅ 书架刷新完成:")
-        print(f"   📋 数据源: {source}")
-        print(f"   📖 HTML解析: {html_count} 本")
-        print(f"   🔄 syncBook同步: {synced_count} 本")
-        print(f"   📚 总计: {total_count} 本书")
+        job = refresh_jobs.submit(current_user.id, cookies)
+        print(f"🔄 书架刷新任务: job={job.id}, status={job.status}")
 
         return APIResponse(
             success=True,
-            message=f"书架刷新成功，共获取 {total_count} 本书籍",
-            data={
-                "total_books": total_count,
-                "source": source,
-                "html_book_count": html_count,
-                "synced_book_count": synced_count
-            }
+            message="书架刷新任务已提交",
+            data=job.to_dict(include_events=False)
         )
 
+    except CookieExpiredException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to refresh books: {str(e)}")
 
+@router.get("/refresh/{job_id}", response_model=APIResponse)
+async def get_refresh_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Poll the status and progress of a shelf refresh job"""
+    job = refresh_jobs.get(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="刷新任务不存在或已过期")
+
+    return APIResponse(
+        success=True,
+        message=f"Refresh job {job.status}",
+        data=job.to_dict()
+    )
+
+@router.get("/refresh/{job_id}/events")
+async def stream_refresh_job(
+    job_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Stream refresh job progress as Server-Sent Events"""
+    job = refresh_jobs.get(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="刷新任务不存在或已过期")
+
+    # 断线重连时从 Last-Event-ID 之后继续推送
+    try:
+        last_seq = int(request.headers.get('last-event-id', 0))
+    except ValueError:
+        last_seq = 0
+
+    async def event_stream():
+        seq = last_seq
+        idle = 0.0
+        while True:
+            events = job.events_since(seq)
+            for event in events:
+                seq = event['seq']
+                yield f"id: {seq}\nevent: progress\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+            if job.finished and not job.events_since(seq):
+                yield f"event: done\ndata: {json.dumps(job.to_dict(include_events=False), ensure_ascii=False)}\n\n"
+                break
+            if await request.is_disconnected():
+                break
+
+            idle = 0.0 if events else idle + SSE_POLL_INTERVAL
+            if idle >= SSE_KEEPALIVE_SECONDS:
+                # 注释行作为心跳，防止代理关闭空闲连接
+                yield ": keep-alive\n\n"
+                idle = 0.0
+            await asyncio.sleep(SSE_POLL_INTERVAL)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/test-html-parsing", response_model=APIResponse)
 async def test_html_parsing(
     html_file_path: str = Query("response.html"),
@@ -524,7 +688,7 @@ async def test_html_parsing(
     """
     try:
         import os
-        from weread_api import WeReadAPI
+        from weread_api import WeReadAPI, CookieExpiredException
         
         # 构建完整的文件路径
         if not os.path.isabs(html_file_path):
@@ -1,6 +1,9 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-import markdown2
+from typing import Dict, Optional, Tuple
+import itertools
+import time
 
 import sys
 import os
@@ -10,54 +13,130 @@ from database import get_db
 from models import User
 from schemas import NoteResponse, APIResponse
 from auth import get_current_user
-from weread_api import WeReadAPI
+from weread_api import WeReadAPI, CookieExpiredException
+from weread_clients import get_user_cookies, weread_clients
+from notes_index import notes_index
+from note_document import (
+    sync_note_document, load_note_document, iter_document_chapters, document_toc, chapter_range
+)
+from notes_export import (
+    content_disposition, render_notes_file, create_export_job, get_export_job,
+    export_job_summary, stream_export_zip
+)
 
 router = APIRouter()
 
-def get_user_cookies(user: User) -> str:
-    """Get formatted cookie string for user"""
-    cookies = {
-        'wr_gid': user.wr_gid,
-        'wr_vid': user.wr_vid,
-        'wr_skey': user.wr_skey,
-        'wr_pf': '0',
-        'wr_rt': user.wr_rt,
-        'wr_localvid': user.wr_localvid or '',
-        'wr_name': user.wr_name or '',
-        'wr_avatar': user.wr_avatar or '',
-        'wr_gender': user.wr_gender or ''
-    }
-    return '; '.join([f'{key}={value}' for key, value in cookies.items()])
+def sync_book_notes(db: Session, user: User, book_id: str, weread_api: WeReadAPI) -> Tuple[Optional[Dict], str]:
+    """
+    同步书籍的笔记文档并更新笔记全文索引
 
-@router.get("/{book_id}", response_model=APIResponse)
-async def get_book_notes(
-    book_id: str,
-    option: int = Query(1, description="1: all chapters, 2: only chapters with notes"),
-    current_user: User = Depends(get_current_user)
-):
-    """Get book notes/highlights in markdown format"""
+    Returns:
+        (笔记文档, 书名)；没有笔记或获取失败时文档为 None
+    """
+    # 笔记文档按章节缓存：有上次的 synckey 时只做增量同步，并只重新渲染变化的章节
     try:
-        cookies = get_user_cookies(current_user)
-        weread_api = WeReadAPI(cookies)
-
-        print(f"📚 开始获取笔记 - book_id: {book_id}, option: {option}")
+        doc, bookmarks_data = sync_note_document(db, user.id, book_id, weread_api)
+    except CookieExpiredException:
+        raise
+    except Exception as e:
+        print(f"❌ 笔记内容获取失败: {str(e)}")
+        doc, bookmarks_data = None, None
 
-        # Get book title
+    # Get book title
+    book_title = (doc or {}).get('book_title')
+    if not book_title:
         try:
             book_info = weread_api.get_book_info(book_id)
             book_title = book_info.get('title', 'Unknown Book')
             print(f"✅ 书籍信息获取成功: {book_title}")
+        except CookieExpiredException:
+            raise
         except Exception as e:
             print(f"⚠️ 书籍信息获取失败: {str(e)}")
             book_title = 'Unknown Book'
 
-        # Get markdown content (这里简化为直接调用，不使用复杂的synckey逻辑)
+    # 同步到笔记全文索引（全量同步时替换该书旧的索引，增量同步只更新变化的条目）
+    try:
+        notes_index.index_bookmarks(db, user.id, book_id, book_title,
+                                    bookmarks_data, (doc or {}).get('chapters'),
+                                    replace=bool((bookmarks_data or {}).get('full_sync')))
+    except Exception as e:
+        print(f"⚠️ 笔记索引更新失败: {str(e)}")
+
+    return doc, book_title
+
+@router.get("/export-all")
+async def export_all_notes(
+    format: str = Query("markdown", description="Export format: markdown or html"),
+    option: int = Query(1, description="1: all chapters, 2: only chapters with notes"),
+    job_id: Optional[str] = Query(None, description="Resume a previous export job"),
+    concurrency: Optional[int] = Query(None, ge=1, le=16, description="Books fetched in parallel"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Export notes of every book with notes as a streamed ZIP archive"""
+    cookies = get_user_cookies(current_user)
+
+    if job_id:
+        # 续传：已完成的书籍直接从任务记录输出，格式和选项沿用原任务
+        job = get_export_job(db, current_user.id, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Export job not found")
+    else:
         try:
-            markdown_content = weread_api.get_markdown_content_simple(book_id, option)
-            print(f"✅ 笔记内容获取完成 - 长度: {len(markdown_content) if markdown_content else 0}")
+            notebooks = weread_clients.for_cookies(cookies, current_user.id).get_notebooks()
+        except CookieExpiredException as e:
+            raise HTTPException(status_code=401, detail=str(e))
         except Exception as e:
-            print(f"❌ 笔记内容获取失败: {str(e)}")
-            markdown_content = ""
+            raise HTTPException(status_code=502, detail=f"Failed to list notebooks: {str(e)}")
+        if not notebooks:
+            raise HTTPException(status_code=404, detail="No notes found")
+        job = create_export_job(db, current_user.id, notebooks,
+                                "html" if format.lower() == "html" else "markdown", option)
+
+    filename = f"weread_notes_{time.strftime('%Y%m%d')}.zip"
+    return StreamingResponse(
+        stream_export_zip(job.job_id, cookies, concurrency),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": content_disposition(filename),
+            "X-Export-Job-Id": job.job_id
+        }
+    )
+
+@router.get("/export-all/{job_id}", response_model=APIResponse)
+async def get_export_all_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get progress of a bulk notes export job"""
+    job = get_export_job(db, current_user.id, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return APIResponse(
+        success=True,
+        message="Export job retrieved successfully",
+        data=export_job_summary(db, job)
+    )
+
+@router.get("/{book_id}", response_model=APIResponse)
+async def get_book_notes(
+    book_id: str,
+    option: int = Query(1, description="1: all chapters, 2: only chapters with notes"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get book notes/highlights in markdown format"""
+    try:
+        weread_api = weread_clients.get(current_user)
+
+        print(f"📚 开始获取笔记 - book_id: {book_id}, option: {option}")
+
+        doc, book_title = sync_book_notes(db, current_user, book_id, weread_api)
+
+        markdown_content = '\n'.join(iter_document_chapters(doc, option)) if doc else ""
+        print(f"✅ 笔记内容获取完成 - 长度: {len(markdown_content)}")
 
         if not markdown_content or markdown_content.strip() == '\n':
             return APIResponse(
@@ -71,8 +150,7 @@ async def get_book_notes(
                 }
             )
 
-        # Convert to HTML
-        html_content = markdown2.markdown(markdown_content)
+        html_content = '\n'.join(iter_document_chapters(doc, option, "html"))
 
         print(f"✅ 笔记获取完成 - book_id: {book_id}")
 
@@ -87,6 +165,8 @@ async def get_book_notes(
             }
         )
 
+    except CookieExpiredException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get notes: {str(e)}")
 
@@ -97,8 +177,7 @@ async def get_book_chapters(
 ):
     """Get book chapters information"""
     try:
-        cookies = get_user_cookies(current_user)
-        weread_api = WeReadAPI(cookies)
+        weread_api = weread_clients.get(current_user)
 
         chapters = weread_api.get_sorted_chapters(book_id)
 
@@ -116,86 +195,121 @@ async def get_book_chapters(
             data={"chapters": chapter_list}
         )
 
+    except CookieExpiredException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get chapters: {str(e)}")
 
-@router.get("/{book_id}/export", response_model=APIResponse)
+@router.get("/{book_id}/toc", response_model=APIResponse)
+async def get_notes_toc(
+    book_id: str,
+    option: int = Query(1, description="1: all chapters, 2: only chapters with notes"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get the notes table of contents with per-chapter highlight counts"""
+    try:
+        weread_api = weread_clients.get(current_user)
+        doc, book_title = sync_book_notes(db, current_user, book_id, weread_api)
+        toc = document_toc(doc, option) if doc else []
+
+        return APIResponse(
+            success=bool(doc),
+            message="Notes TOC retrieved successfully" if doc else "该书籍暂无笔记或笔记功能不可用",
+            data={
+                "book_id": book_id,
+                "book_title": book_title,
+                "chapters": toc,
+                "total_chapters": len(toc),
+                "total_highlights": sum(chapter["highlight_count"] for chapter in toc),
+                "total_notes": sum(chapter["note_count"] for chapter in toc)
+            }
+        )
+
+    except CookieExpiredException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get notes TOC: {str(e)}")
+
+@router.get("/{book_id}/chapter-range", response_model=APIResponse)
+async def get_notes_chapter_range(
+    book_id: str,
+    option: int = Query(1, description="1: all chapters, 2: only chapters with notes"),
+    start: int = Query(0, ge=0, description="TOC index of the first chapter"),
+    limit: int = Query(20, ge=1, le=200, description="Number of chapters"),
+    format: str = Query("markdown", description="Content format: markdown or html"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get rendered notes for a range of chapters from the TOC"""
+    try:
+        # 目录接口已经同步过笔记文档，这里直接读取已存储的文档；还没有时再同步
+        doc = load_note_document(db, current_user.id, book_id)
+        if doc is None:
+            doc, _ = sync_book_notes(db, current_user, book_id, weread_clients.get(current_user))
+        if doc is None:
+            raise HTTPException(status_code=404, detail="No notes found for this book")
+
+        fmt = "html" if format.lower() == "html" else "markdown"
+        sections, total = chapter_range(doc, option, start, limit, fmt)
+
+        return APIResponse(
+            success=True,
+            message="Notes chapters retrieved successfully",
+            data={
+                "book_id": book_id,
+                "format": fmt,
+                "start": start,
+                "chapters": sections,
+                "total_chapters": total,
+                "has_more": start + len(sections) < total
+            }
+        )
+
+    except HTTPException:
+        raise
+    except CookieExpiredException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get notes chapters: {str(e)}")
+
+@router.get("/{book_id}/export")
 async def export_notes(
     book_id: str,
     format: str = Query("markdown", description="Export format: markdown or html"),
     option: int = Query(1, description="1: all chapters, 2: only chapters with notes"),
     current_user: User = Depends(get_current_user)
 ):
-    """Export book notes in specified format"""
+    """Export book notes as a downloadable file, streamed chapter by chapter"""
     try:
-        cookies = get_user_cookies(current_user)
-        weread_api = WeReadAPI(cookies)
+        weread_api = weread_clients.get(current_user)
 
-        # Get book info
-        book_info = weread_api.get_book_info(book_id)
-        book_title = book_info.get('title', 'Unknown Book')
+        bookmarks_data = weread_api.get_bookmarks(book_id, "0")
+        chapters = weread_api.get_sorted_chapters(book_id)
 
-        # Get markdown content
-        markdown_content = weread_api.get_markdown_content(book_id, option)
+        # 书签接口通常带有书籍信息，没有时再单独请求书籍详情
+        book_title = ((bookmarks_data or {}).get('book') or {}).get('title')
+        if not book_title:
+            book_title = weread_api.get_book_info(book_id).get('title', 'Unknown Book')
 
-        if not markdown_content or markdown_content.strip() == '\n':
-            return APIResponse(
-                success=False,
-                message="No notes found for this book",
-                data=None
-            )
-
-        if format.lower() == "html":
-            # Convert to HTML with title
-            full_html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <title>《{book_title}》笔记</title>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/github-markdown-css/5.1.0/github-markdown.min.css"/>
-    <style>
-        .markdown-body {{
-            box-sizing: border-box;
-            min-width: 200px;
-            max-width: 980px;
-            margin: 0 auto;
-            padding: 45px;
-        }}
-        @media(max-width:767px) {{
-            .markdown-body {{
-                padding: 15px;
-            }}
-        }}
-    </style>
-</head>
-<body class="markdown-body">
-    <h1>《{book_title}》笔记</h1>
-    {markdown2.markdown(markdown_content)}
-</body>
-</html>"""
-            return APIResponse(
-                success=True,
-                message="Notes exported as HTML",
-                data={
-                    "content": full_html,
-                    "filename": f"{book_title}_notes.html",
-                    "format": "html"
-                }
-            )
-        else:
-            # Return markdown with title
-            full_markdown = f"# 《{book_title}》笔记\n\n{markdown_content}"
-            return APIResponse(
-                success=True,
-                message="Notes exported as Markdown",
-                data={
-                    "content": full_markdown,
-                    "filename": f"{book_title}_notes.md",
-                    "format": "markdown"
-                }
-            )
+        is_html = format.lower() == "html"
+        iter_chapters = weread_api.iter_html_chapters if is_html else weread_api.iter_markdown_chapters
+        chunks = iter_chapters(book_id, option, bookmarks_data, chapters)
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            raise HTTPException(status_code=404, detail="No notes found for this book")
 
+    except HTTPException:
+        raise
+    except CookieExpiredException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to export notes: {str(e)}")
 
+    extension = "html" if is_html else "md"
+    return StreamingResponse(
+        # 逐章节输出，首字节时间和内存占用与笔记数量无关
+        render_notes_file(book_title, itertools.chain([first_chunk], chunks), is_html),
+        media_type="text/html" if is_html else "text/markdown",
+        headers={"Content-Disposition": content_disposition(f"{book_title}_notes.{extension}")}
+    )
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
 from sqlalchemy.orm import Session
+from typing import Optional
 import math
 
 import sys
@@ -10,65 +11,90 @@ from database import get_db
 from models import User, UserBooks
 from schemas import SearchResponse, APIResponse
 from auth import get_current_user
-from weread_api import WeReadAPI
+from weread_api import CookieExpiredException
+from weread_clients import weread_clients, get_user_cookies
+from notes_index import notes_index, notes_backfill
+from shelf_store import save_user_books, get_shelf_version
+from typeahead import typeahead_registry
+from search_cache import search_cache, normalize_query
+from facet_index import facet_registry, RATING_TIERS, UNRATED
 
 router = APIRouter()
 
-def get_user_cookies(user: User) -> str:
-    """Get formatted cookie string for user"""
-    cookies = {
-        'wr_gid': user.wr_gid,
-        'wr_vid': user.wr_vid,
-        'wr_skey': user.wr_skey,
-        'wr_pf': '0',
-        'wr_rt': user.wr_rt,
-        'wr_localvid': user.wr_localvid or '',
-        'wr_name': user.wr_name or '',
-        'wr_avatar': user.wr_avatar or '',
-        'wr_gender': user.wr_gender or ''
-    }
-    return '; '.join([f'{key}={value}' for key, value in cookies.items()])
+def load_user_data(db: Session, current_user: User) -> dict:
+    """Read the cached shelf, fetching it from WeRead on a cold cache"""
+    user_books = db.query(UserBooks).filter(UserBooks.user_id == current_user.id).first()
+
+    if not user_books or not user_books.books_data:
+        # If no cached data, fetch from WeRead API
+        weread_api = weread_clients.get(current_user)
+        user_data = weread_api.get_user_data(current_user.wr_vid)
+
+        # Save to cache
+        save_user_books(db, current_user.id, user_data, user_books)
+        return user_data
+
+    return user_books.books_data
+
+def get_facet_index(db: Session, current_user: User, version: int, user_data: Optional[dict] = None):
+    """Per-user facet bitmaps for the current shelf version"""
+    index = facet_registry.get(current_user.id, version)
+    if index is None:
+        if user_data is None:
+            user_data = load_user_data(db, current_user)
+        index = facet_registry.get(current_user.id, version, user_data.get('books', []))
+    return index
 
 @router.get("", response_model=APIResponse)
 async def search_books(
     q: str = Query(..., description="Search query"),
     page: int = Query(1, ge=1),
     page_size: int = Query(10, ge=1, le=50),
+    category: Optional[str] = Query(None, description="分类筛选"),
+    finished: Optional[int] = Query(None, ge=0, le=1, description="阅读状态筛选: 1 已读完, 0 未读完"),
+    rating: Optional[str] = Query(None, description="评分档位筛选，如 神作、好评如潮、暂无评级"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Search books in user's library"""
+    """Search books in user's library, weighted across title, author and category"""
+    # 缓存键和打分使用同一个规范化后的查询，同一缓存条目不会对应不同的排序结果
+    q = normalize_query(q)
     try:
-        # Get user books data
-        user_books = db.query(UserBooks).filter(UserBooks.user_id == current_user.id).first()
-
-        if not user_books or not user_books.books_data:
-            # If no cached data, fetch from WeRead API
-            cookies = get_user_cookies(current_user)
-            weread_api = WeReadAPI(cookies)
-            user_data = weread_api.get_user_data(current_user.wr_vid)
-
-            # Save to cache
-            if user_books:
-                user_books.books_data = user_data
-            else:
-                user_books = UserBooks(user_id=current_user.id, books_data=user_data)
-                db.add(user_books)
-            db.commit()
-        else:
-            user_data = user_books.books_data
-
-        # Perform search
-        cookies = get_user_cookies(current_user)
-        weread_api = WeReadAPI(cookies)
-        search_results = weread_api.search_books(user_data, q)
+        # 完整排序结果按书架版本缓存，翻页和重复查询不再重新打分
+        version = get_shelf_version(db, current_user.id)
+        search_results = search_cache.get(current_user.id, q, version)
+        user_data = None
+
+        if search_results is None:
+            user_data = load_user_data(db, current_user)
+            version = get_shelf_version(db, current_user.id)
+
+            # Perform search: one batch scoring pass per weighted field over the whole shelf
+            weread_api = weread_clients.get(current_user)
+            search_results, _ = weread_api.search_books_ranked(user_data, q)
+            search_cache.put(current_user.id, q, version, search_results)
+
+        # 分面筛选与计数都基于位图，不重新扫描书架
+        facet_index = get_facet_index(db, current_user, version, user_data)
+        result_bitmap = facet_index.bitmap_of(result['bookId'] for result in search_results)
+        filter_bitmap = facet_index.filter_bitmap({
+            'category': category,
+            'finishReading': finished,
+            'rating': rating
+        })
+        if filter_bitmap != facet_index.all_bits:
+            search_results = [
+                result for result in search_results
+                if facet_index.contains(filter_bitmap, result['bookId'])
+            ]
 
-        # Calculate pagination
         total = len(search_results)
-        total_pages = math.ceil(total / page_size) if total > 0 else 1
         start_idx = (page - 1) * page_size
         end_idx = start_idx + page_size
 
+        # Calculate pagination
+        total_pages = math.ceil(total / page_size) if total > 0 else 1
+
         # Get page data
         page_results = search_results[start_idx:end_idx]
 
@@ -81,14 +107,50 @@ async def search_books(
                 "page": page,
                 "page_size": page_size,
                 "total_pages": total_pages,
-                "query": q
+                "query": q,
+                "facets": facet_index.counts(result_bitmap & filter_bitmap)
             }
         )
 
+    except CookieExpiredException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
-@router.get("suggestions", response_model=APIResponse)
+@router.get("/facets", response_model=APIResponse)
+async def get_search_facets(
+    category: Optional[str] = Query(None, description="分类筛选"),
+    finished: Optional[int] = Query(None, ge=0, le=1, description="阅读状态筛选: 1 已读完, 0 未读完"),
+    rating: Optional[str] = Query(None, description="评分档位筛选"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Facet counts (category, finishReading, rating tier) for the whole shelf"""
+    try:
+        version = get_shelf_version(db, current_user.id)
+        facet_index = get_facet_index(db, current_user, version)
+        bitmap = facet_index.filter_bitmap({
+            'category': category,
+            'finishReading': finished,
+            'rating': rating
+        })
+
+        return APIResponse(
+            success=True,
+            message="Facets retrieved",
+            data={
+                "total": bitmap.bit_count(),
+                "facets": facet_index.counts(bitmap),
+                "rating_tiers": RATING_TIERS + [UNRATED]
+            }
+        )
+
+    except CookieExpiredException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get facets: {str(e)}")
+
+@router.get("/suggestions", response_model=APIResponse)
 async def get_search_suggestions(
     q: str = Query(..., min_length=1, description="Search query"),
     limit: int = Query(5, ge=1, le=10),
@@ -97,42 +159,72 @@ async def get_search_suggestions(
 ):
     """Get search suggestions based on user's library"""
     try:
-        # Get user books data
-        user_books = db.query(UserBooks).filter(UserBooks.user_id == current_user.id).first()
-
-        if not user_books or not user_books.books_data:
-            return APIResponse(
-                success=True,
-                message="No suggestions available",
-                data={"suggestions": []}
-            )
+        # 书架版本未变化时直接使用内存中的前缀树，不读取书架数据
+        version = get_shelf_version(db, current_user.id)
+        index = typeahead_registry.get(current_user.id, version)
+
+        if index is None:
+            user_books = db.query(UserBooks).filter(UserBooks.user_id == current_user.id).first()
+            if not user_books or not user_books.books_data:
+                return APIResponse(
+                    success=True,
+                    message="No suggestions available",
+                    data={"suggestions": []}
+                )
+            index = typeahead_registry.get(current_user.id, version, user_books.books_data.get('books', []))
+
+        # 前缀匹配书名、作者、书名拼音全拼和首字母，按最近阅读时间排序
+        suggestions = index.lookup(q, limit)
 
-        user_data = user_books.books_data
-        books = user_data.get('books', [])
-
-        # Simple suggestion logic - find books with titles containing the query
-        suggestions = []
-        query_lower = q.lower()
+        return APIResponse(
+            success=True,
+            message="Suggestions retrieved",
+            data={"suggestions": suggestions}
+        )
 
-        for book in books:
-            title = book.get('title', '').lower()
-            author = book.get('author', '').lower()
+    except CookieExpiredException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get suggestions: {str(e)}")
 
-            if query_lower in title or query_lower in author:
-                suggestions.append({
-                    "bookId": book.get('bookId'),
-                    "title": book.get('title'),
-                    "author": book.get('author')
-                })
+@router.get("/notes", response_model=APIResponse)
+async def search_notes(
+    q: str = Query(..., min_length=1, description="Search query"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=50),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Full-text search across the user's synced highlights and notes
 
-                if len(suggestions) >= limit:
-                    break
+    Books are indexed when their notes are opened; the first search also starts a background
+    backfill of the remaining notebooks, reported in data.backfill until it completes.
+    """
+    try:
+        notes_backfill.schedule(current_user.id, get_user_cookies(current_user))
+        results, total = notes_index.search(
+            db, current_user.id, q,
+            offset=(page - 1) * page_size,
+            limit=page_size
+        )
+        total_pages = math.ceil(total / page_size) if total > 0 else 1
 
         return APIResponse(
             success=True,
-            message="Suggestions retrieved",
-            data={"suggestions": suggestions}
+            message=f"Found {total} notes matching '{q}'",
+            data={
+                "results": results,
+                "total": total,
+                "page": page,
+                "page_size": page_size,
+                "total_pages": total_pages,
+                "query": q,
+                "backfill": notes_backfill.status(current_user.id)
+            }
         )
 
+    except CookieExpiredException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get suggestions: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Notes search failed: {str(e)}")
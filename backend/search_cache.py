@@ -0,0 +1,71 @@
+# 搜索结果缓存：按 (用户, 规范化查询, 书架版本) 缓存完整排序结果，翻页和重复查询直接命中
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from metrics import record_cache
+from shelf_store import on_shelf_change
+
+
+def normalize_query(query: str) -> str:
+    """去掉首尾空白并合并连续空白；模糊打分区分大小写，因此保留大小写"""
+    return ' '.join(query.split())
+
+
+class SearchResultCache:
+    """
+    带TTL的LRU缓存
+    同时限制条目数和所有条目的结果总数，避免大书架的宽泛查询占满内存
+    """
+
+    def __init__(self, ttl_seconds: int = 120, max_entries: int = 512, max_results: int = 100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_results = max_results
+        self._entries: "OrderedDict[Tuple[int, str, int], Tuple[float, List[Dict]]]" = OrderedDict()
+        self._result_count = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, query: str, version: int) -> Optional[List[Dict]]:
+        key = (user_id, normalize_query(query), version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        record_cache("search_results", entry is not None)
+        return entry[1] if entry is not None else None
+
+    def put(self, user_id: int, query: str, version: int, results: List[Dict]) -> None:
+        if len(results) > self.max_results:
+            return
+        key = (user_id, normalize_query(query), version)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, results)
+            self._result_count += len(results)
+            while self._entries and (len(self._entries) > self.max_entries or self._result_count > self.max_results):
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                self._remove(key)
+
+    def _remove(self, key: Tuple[int, str, int]) -> None:
+        _, results = self._entries.pop(key)
+        self._result_count -= len(results)
+
+
+# 全局搜索结果缓存实例
+search_cache = SearchResultCache()
+
+
+@on_shelf_change
+def _drop_search_cache_on_shelf_change(db, user_id: int, old_data, new_data, version: int) -> None:
+    # 版本号已经保证不会命中旧结果，这里只是提前释放内存
+    search_cache.invalidate_user(user_id)
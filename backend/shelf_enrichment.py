@@ -0,0 +1,291 @@
+# 书架渐进/按需加载：先保存HTML解析出的 rawBooks（仅ID的书籍作为待补全条目），再用 syncBook 分批补全
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import UserBooks, BookCache
+from weread_api import WeReadAPI
+from weread_clients import weread_clients
+from shelf_store import save_user_books, get_shelf_version, ShelfVersionConflict
+
+try:
+    from config import settings
+except ImportError:
+    from config_simple import settings
+
+ENRICH_BATCH_SIZE = 250
+# 保存时书架版本冲突（期间有刷新写入）的重试次数，每次基于最新的书架重新合并
+SAVE_CONFLICT_RETRIES = 3
+
+# syncBook 返回的书籍中属于用户个人的字段，不写入共享的书籍目录
+USER_BOOK_FIELDS = ('finishReading', 'readUpdateTime', 'updateTime', 'secret', 'paid', 'isTop', 'progress')
+
+
+def is_pending(book: Dict) -> bool:
+    return bool(book.get('needsDetailFetch'))
+
+
+def pending_book_ids(user_data: Optional[Dict]) -> List[str]:
+    if not isinstance(user_data, dict):
+        return []
+    return [book['bookId'] for book in user_data.get('books') or [] if is_pending(book) and book.get('bookId')]
+
+
+def enrichment_state(user_data: Dict, status: Optional[str] = None) -> Dict:
+    pending = len(pending_book_ids(user_data))
+    return {"status": status or ('pending' if pending else 'complete'), "pending": pending}
+
+
+def carry_over_details(new_data: Dict, old_data: Optional[Dict]) -> Dict:
+    """
+    新解析的书架中仍为待补全的书籍，如果旧缓存里已有补全过的详情，直接沿用，
+    避免每次刷新都把已补全的书籍退回到仅ID状态
+
+    书架HTML里仅ID的书籍没有阅读状态/进度，沿用的详情会过时：补全时间（detailSyncedAt）
+    超过 shelf_detail_resync_seconds 的书籍保留旧详情但重新标记为待补全，由补全流程再次同步
+    """
+    if not isinstance(old_data, dict):
+        new_data.setdefault('bookProgress', [])
+        return new_data
+
+    # 重新标记为待补全、还没同步完的书籍同样有详情可以沿用
+    enriched = {
+        book['bookId']: book for book in old_data.get('books') or []
+        if book.get('bookId') and (not is_pending(book) or book.get('detailSyncedAt'))
+    }
+    resync_before = time.time() - settings.shelf_detail_resync_seconds
+    books = []
+    carried = set()
+    for book in new_data.get('books') or []:
+        book_id = book.get('bookId')
+        if is_pending(book) and book_id in enriched:
+            old_book = enriched[book_id]
+            if (old_book.get('detailSyncedAt') or 0) < resync_before and not is_pending(old_book):
+                old_book = dict(old_book, needsDetailFetch=True)
+            books.append(old_book)
+            carried.add(book_id)
+        else:
+            books.append(book)
+
+    new_data['books'] = books
+    new_data['bookProgress'] = [
+        progress for progress in old_data.get('bookProgress') or []
+        if str(progress.get('bookId')) in carried
+    ]
+    return new_data
+
+
+def merge_synced_books(user_data: Dict, synced: Dict) -> Dict:
+    """把一批 syncBook 结果按 bookId 合并进书架，返回新的书架数据（不修改传入的字典）"""
+    synced_at = int(time.time())
+    synced_books = {
+        book['bookId']: dict(book, detailSyncedAt=synced_at)
+        for book in synced.get('books') or [] if book.get('bookId')
+    }
+    merged = dict(user_data)
+    merged['books'] = [
+        synced_books.get(book.get('bookId'), book) if is_pending(book) else book
+        for book in user_data.get('books') or []
+    ]
+
+    synced_ids = {str(book_id) for book_id in synced_books}
+    merged['bookProgress'] = [
+        progress for progress in user_data.get('bookProgress') or []
+        if str(progress.get('bookId')) not in synced_ids
+    ] + list(synced.get('bookProgress') or [])
+    merged['synced_book_count'] = user_data.get('synced_book_count', 0) + len(synced_books)
+    return merged
+
+
+def save_synced_books(db: Session, user_id: int, synced: Dict, status: Optional[str] = None) -> Optional[Dict]:
+    """
+    把一批 syncBook 结果合并进最新的书架数据并保存
+
+    syncBook 请求期间书架可能已被刷新：每次都重新读取书架和版本号再合并，
+    保存时校验版本，版本已变化则基于新的书架重新合并，不覆盖刷新保存的结果
+
+    Returns:
+        保存后的书架数据；用户没有书架缓存或多次冲突时返回 None
+    """
+    for _ in range(SAVE_CONFLICT_RETRIES):
+        db.expire_all()
+        version = get_shelf_version(db, user_id)
+        user_books = db.query(UserBooks).filter(UserBooks.user_id == user_id).first()
+        if not user_books or not isinstance(user_books.books_data, dict):
+            return None
+
+        merged = merge_synced_books(user_books.books_data, synced)
+        merged['enrichment'] = enrichment_state(merged, status)
+        try:
+            save_user_books(db, user_id, merged, user_books, expected_version=version)
+            return merged
+        except ShelfVersionConflict:
+            print(f"🔁 书架在补全期间被更新，基于最新数据重新合并: user_id={user_id}")
+    print(f"⚠️ 书籍详情补全结果多次与书架更新冲突，放弃本批: user_id={user_id}")
+    return None
+
+
+def catalog_entry(book: Dict) -> Dict:
+    return {key: value for key, value in book.items() if key not in USER_BOOK_FIELDS}
+
+
+def save_to_catalog(db: Session, books: Iterable[Dict]) -> None:
+    """把书籍元数据写入共享的书籍目录（BookCache），已存在的条目不覆盖"""
+    books = {book['bookId']: book for book in books if book.get('bookId')}
+    if not books:
+        return
+    existing = {
+        row[0] for row in db.query(BookCache.book_id).filter(BookCache.book_id.in_(list(books)))
+    }
+    for book_id, book in books.items():
+        if book_id in existing:
+            continue
+        try:
+            with db.begin_nested():
+                db.add(BookCache(book_id=book_id, book_info=catalog_entry(book)))
+        except IntegrityError:
+            # 其他请求同时写入了同一本书
+            pass
+    db.commit()
+
+
+def enrich_book_ids(db: Session, user_id: int, weread_api: WeReadAPI, book_ids: List[str],
+                    status: str = 'lazy') -> Dict[str, Dict]:
+    """
+    同步补全指定的待补全书籍：一次批量 syncBook 调用，结果写入书籍目录并合并进用户书架
+    syncBook 没有返回的书籍退回使用书籍目录中的元数据
+
+    Returns:
+        bookId -> 补全后的书籍
+    """
+    book_ids = list(dict.fromkeys(book_ids))[:ENRICH_BATCH_SIZE]
+    if not book_ids:
+        return {}
+
+    synced = weread_api.sync_books(book_ids)
+    enriched = {book['bookId']: book for book in synced.get('books') or [] if book.get('bookId')}
+    save_to_catalog(db, enriched.values())
+
+    missing = [book_id for book_id in book_ids if book_id not in enriched]
+    if missing:
+        for row in db.query(BookCache).filter(BookCache.book_id.in_(missing)):
+            if isinstance(row.book_info, dict) and row.book_info.get('title'):
+                book = dict(row.book_info)
+                book['bookId'] = row.book_id
+                book.setdefault('finishReading', 0)
+                enriched[row.book_id] = book
+
+    if not enriched:
+        return {}
+
+    save_synced_books(db, user_id, {
+        'books': list(enriched.values()),
+        'bookProgress': synced.get('bookProgress') or []
+    }, status)
+    return enriched
+
+
+class ShelfEnricher:
+    """后台补全待补全书籍，每批合并后写入书架（递增书架版本，客户端据此得知有新数据）"""
+
+    def __init__(self, max_workers: int = 2, batch_size: int = ENRICH_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._running: set = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shelf-enrich")
+
+    def schedule(self, user_id: int, cookies: str) -> bool:
+        with self._lock:
+            if user_id in self._running:
+                return False
+            self._running.add(user_id)
+        self._executor.submit(self._run, user_id, cookies)
+        return True
+
+    def is_running(self, user_id: int) -> bool:
+        return user_id in self._running
+
+    def prefetch(self, user_id: int, cookies: str, book_ids: List[str]) -> bool:
+        """在后台补全预取窗口内的书籍（按需模式），同一用户同时只有一个预取"""
+        if not book_ids:
+            return False
+        with self._lock:
+            if user_id in self._running:
+                return False
+            self._running.add(user_id)
+        self._executor.submit(self._prefetch, user_id, cookies, book_ids)
+        return True
+
+    def _prefetch(self, user_id: int, cookies: str, book_ids: List[str]) -> None:
+        db = SessionLocal()
+        try:
+            enriched = enrich_book_ids(db, user_id, weread_clients.for_cookies(cookies, user_id), book_ids)
+            print(f"🧩 预取补全: user_id={user_id}, {len(enriched)}/{len(book_ids)} 本")
+        except Exception as e:
+            print(f"❌ 预取补全出错 user_id={user_id}: {e}")
+        finally:
+            db.close()
+            with self._lock:
+                self._running.discard(user_id)
+
+    def _run(self, user_id: int, cookies: str) -> None:
+        db = SessionLocal()
+        weread_api = weread_clients.for_cookies(cookies, user_id)
+        attempted: set = set()
+        failed = False
+        try:
+            while True:
+                # 每批从最新的书架数据中挑选待补全书籍；保存由 save_synced_books 校验书架版本，
+                # 期间发生的刷新不会被覆盖
+                db.expire_all()
+                user_books = db.query(UserBooks).filter(UserBooks.user_id == user_id).first()
+                user_data = user_books.books_data if user_books else None
+                batch = [book_id for book_id in pending_book_ids(user_data) if book_id not in attempted]
+                batch = batch[:self.batch_size]
+                if not batch:
+                    break
+
+                attempted.update(batch)
+                synced = weread_api.sync_books(batch)
+                if not synced.get('books'):
+                    print(f"⚠️ 书籍详情补全失败 user_id={user_id}: {synced.get('error', '无返回数据')}")
+                    failed = True
+                    break
+
+                merged = save_synced_books(db, user_id, synced, 'running')
+                if merged is None:
+                    failed = True
+                    break
+                print(f"🧩 书籍详情补全: user_id={user_id}, 本批 {len(synced['books'])} 本, "
+                      f"剩余 {merged['enrichment']['pending']} 本")
+
+            db.expire_all()
+            version = get_shelf_version(db, user_id)
+            user_books = db.query(UserBooks).filter(UserBooks.user_id == user_id).first()
+            if user_books and isinstance(user_books.books_data, dict):
+                final_data = dict(user_books.books_data)
+                # 仍有待补全书籍时不能标记为完成：批次失败为 failed，syncBook 未返回部分书籍为 partial
+                status = None
+                if pending_book_ids(final_data):
+                    status = 'failed' if failed else 'partial'
+                final_data['enrichment'] = enrichment_state(final_data, status)
+                if final_data['enrichment'] != user_books.books_data.get('enrichment'):
+                    save_user_books(db, user_id, final_data, user_books, expected_version=version)
+        except ShelfVersionConflict:
+            # 书架刚被刷新，补全状态已由刷新重新计算
+            pass
+        except Exception as e:
+            print(f"❌ 书籍详情后台补全出错 user_id={user_id}: {e}")
+        finally:
+            db.close()
+            with self._lock:
+                self._running.discard(user_id)
+
+
+# 全局后台补全实例
+shelf_enricher = ShelfEnricher()
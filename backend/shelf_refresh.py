@@ -0,0 +1,198 @@
+# 书架刷新：手动刷新接口与后台调度共用的抓取+保存流程
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import User, UserBooks
+from weread_api import WeReadAPI, CookieExpiredException
+from weread_clients import weread_clients
+from shelf_store import save_user_books
+from shelf_enrichment import (
+    shelf_enricher, carry_over_details, enrichment_state, pending_book_ids, is_pending, enrich_book_ids
+)
+from refresh_lock import acquire_refresh_lease, renew_refresh_lease, release_refresh_lease, wait_for_refresh
+
+try:
+    from config import settings
+except ImportError:
+    from config_simple import settings
+
+
+def is_degraded(old_data: Optional[Dict], new_data: Dict) -> bool:
+    """
+    新数据是否比已有缓存更差
+    get_user_data_enhanced 失败时会回退到仅解析HTML的数据（没有 bookProgress），不应覆盖已同步的完整数据
+    """
+    if not isinstance(old_data, dict) or not old_data.get('books'):
+        return False
+    return bool(old_data.get('bookProgress')) and 'bookProgress' not in new_data
+
+
+def is_unchanged(old_data: Optional[Dict], new_data: Dict) -> bool:
+    """
+    新抓取的书架与已有缓存内容是否相同
+    只比较书籍和阅读进度，enrichment/source/synced_book_count 等记账字段不参与比较
+    """
+    if not isinstance(old_data, dict):
+        return False
+    return all(old_data.get(key) == new_data.get(key) for key in ('books', 'bookProgress'))
+
+
+def fetch_shelf_data(weread_api: WeReadAPI, user_vid: str, old_data: Optional[Dict] = None,
+                     progress_callback: Optional[Callable[[str, Dict], None]] = None) -> Dict:
+    """
+    按 settings.shelf_load_mode 获取书架数据
+
+    - enhanced: 等待所有仅ID的书籍通过 syncBook 补全后返回
+    - progressive: 只解析书架HTML，仅ID的书籍保留为待补全条目（旧缓存中已补全的直接沿用），由后台补全
+    - lazy: 同 progressive，但待补全条目只在被翻到（或落在预取窗口内）时才补全
+    """
+    if settings.shelf_load_mode not in ('progressive', 'lazy'):
+        return weread_api.get_user_data_enhanced(user_vid, progress_callback)
+
+    try:
+        user_data = weread_api.get_user_data(user_vid)
+    except CookieExpiredException as e:
+        print(f"🔐 {e}")
+        return {
+            'books': [],
+            'bookProgress': [],
+            'error': 'cookie_expired',
+            'message': 'Cookie已过期，请重新登录',
+            'need_login': True
+        }
+
+    if not isinstance(user_data, dict) or not user_data.get('books'):
+        return user_data
+
+    user_data = carry_over_details(user_data, old_data)
+    user_data['source'] = f"html_rawBooks_{settings.shelf_load_mode}"
+    user_data['enrichment'] = enrichment_state(
+        user_data, 'lazy' if settings.shelf_load_mode == 'lazy' else None
+    )
+    if progress_callback is not None:
+        progress_callback('html_fetched', {
+            'total': len(user_data['books']),
+            'need_details': user_data['enrichment']['pending']
+        })
+    return user_data
+
+
+def schedule_enrichment(user_id: int, cookies: str, user_data: Optional[Dict]) -> bool:
+    """书架中还有待补全的书籍时安排后台补全"""
+    if settings.shelf_load_mode != 'progressive' or not pending_book_ids(user_data):
+        return False
+    return shelf_enricher.schedule(user_id, cookies)
+
+
+def sort_for_pagination(user_data: Dict, books: List[Dict]) -> List[Dict]:
+    """
+    分页前的排序
+    渐进/按需模式保存的书架已按 rawIndexes 的书架顺序排列，占位书籍没有真实的 readUpdateTime，
+    直接保持书架顺序，补全前后同一本书的分页位置不变；其他来源按最近阅读时间排序
+    """
+    if str(user_data.get('source') or '').startswith('html_rawBooks_'):
+        return books
+    return sorted(books, key=lambda book: book.get('readUpdateTime', 0), reverse=True)
+
+
+def enrich_requested_page(db: Session, user_id: int, cookies: str, books: List[Dict],
+                          start_idx: int, end_idx: int) -> List[Dict]:
+    """
+    按需模式：补全当前页中的待补全书籍（同步，一次 syncBook 调用，请求处理中需放到线程池执行），
+    并在后台预取后面 lazy_enrich_prefetch_pages 页中的待补全书籍
+    其他模式直接返回当前页
+    """
+    page_books = books[start_idx:end_idx]
+    if settings.shelf_load_mode != 'lazy':
+        return page_books
+
+    page_ids = [book['bookId'] for book in page_books if is_pending(book) and book.get('bookId')]
+    prefetch_end = end_idx + (end_idx - start_idx) * settings.lazy_enrich_prefetch_pages
+    prefetch_ids = [book['bookId'] for book in books[end_idx:prefetch_end] if is_pending(book) and book.get('bookId')]
+
+    if page_ids:
+        print(f"🧩 按需补全当前页 {len(page_ids)} 本书籍")
+        enriched = enrich_book_ids(db, user_id, weread_clients.for_cookies(cookies, user_id), page_ids)
+        page_books = [enriched.get(book.get('bookId'), book) for book in page_books]
+    if prefetch_ids:
+        shelf_enricher.prefetch(user_id, cookies, prefetch_ids)
+    return page_books
+
+
+def refresh_user_shelf(db: Session, user: User, cookies: str, skip_unchanged: bool = False,
+                       progress_callback: Optional[Callable[[str, Dict], None]] = None) -> Tuple[Dict, bool]:
+    """
+    从微信读书获取书架数据并保存
+
+    Args:
+        cookies: 用户的Cookie字符串
+        skip_unchanged: 数据与缓存完全相同时不写入（不递增书架版本，各级缓存继续有效）
+        progress_callback: 进度回调，透传给书架抓取，写入缓存后再报告 persisted
+
+    Returns:
+        (user_data, 是否写入了缓存)；cookie过期时 user_data['error'] == 'cookie_expired'
+    """
+    user_books = db.query(UserBooks).filter(UserBooks.user_id == user.id).first()
+    old_data = user_books.books_data if user_books else None
+
+    weread_api = weread_clients.for_cookies(cookies, user.id)
+    user_data = fetch_shelf_data(weread_api, user.wr_vid, old_data, progress_callback)
+
+    if not isinstance(user_data, dict):
+        return {'books': [], 'error': 'invalid_data'}, False
+    if user_data.get('error') == 'cookie_expired':
+        return user_data, False
+
+    if skip_unchanged:
+        if is_unchanged(old_data, user_data):
+            schedule_enrichment(user.id, cookies, old_data)
+            return user_data, False
+        if is_degraded(old_data, user_data):
+            print(f"⚠️ 刷新结果缺少阅读进度，保留已有书架缓存: user_id={user.id}")
+            return user_data, False
+
+    save_user_books(db, user.id, user_data, user_books)
+    if progress_callback is not None:
+        progress_callback('persisted', {'total': len(user_data.get('books', []))})
+    schedule_enrichment(user.id, cookies, user_data)
+    return user_data, True
+
+
+def refresh_user_shelf_exclusive(db: Session, user: User, cookies: str, skip_unchanged: bool = False,
+                                 progress_callback: Optional[Callable[[str, Dict], None]] = None,
+                                 wait: bool = True) -> Tuple[Dict, bool]:
+    """
+    持有刷新租约执行 refresh_user_shelf，同一用户同时只有一个刷新在抓取
+
+    租约被占用时：wait=True 等待对方完成并直接返回其保存的书架数据；
+    wait=False 立即返回 error='refresh_in_progress'
+    """
+    owner = acquire_refresh_lease(user.id)
+    if owner is None:
+        if not wait:
+            return {'books': [], 'error': 'refresh_in_progress'}, False
+
+        print(f"⏳ 用户 {user.id} 的书架正在由其他请求刷新，等待其结果")
+        if not wait_for_refresh(user.id):
+            return {'books': [], 'error': 'refresh_in_progress'}, False
+
+        db.expire_all()
+        user_books = db.query(UserBooks).filter(UserBooks.user_id == user.id).first()
+        shared_data = user_books.books_data if user_books else None
+        if not isinstance(shared_data, dict) or not shared_data.get('books'):
+            return {'books': [], 'error': 'refresh_failed'}, False
+        if progress_callback is not None:
+            progress_callback('shared', {'total': len(shared_data.get('books', []))})
+        return shared_data, False
+
+    def report(stage: str, info: Dict) -> None:
+        # 每个进度节点续期，长时间的syncBook批量同步不会让租约过期
+        renew_refresh_lease(user.id, owner)
+        if progress_callback is not None:
+            progress_callback(stage, info)
+
+    try:
+        return refresh_user_shelf(db, user, cookies, skip_unchanged, report)
+    finally:
+        release_refresh_lease(user.id, owner)
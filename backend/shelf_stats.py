@@ -0,0 +1,177 @@
+# 书架统计：按用户物化保存计数，书架变更时按书籍差异增量更新
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import ShelfStats, UserBooks
+from facet_index import facet_values
+from shelf_store import on_shelf_change, get_shelf_version
+
+# 统计中的计数器分组
+STAT_GROUPS = ('status', 'category', 'rating', 'finished_by_month')
+
+
+def to_seconds(value) -> int:
+    """readUpdateTime/updateTime 可能是秒也可能是毫秒，统一为秒"""
+    try:
+        value = int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+    return value // 1000 if value > 10 ** 11 else value
+
+
+def _progress_map(user_data: Optional[Dict]) -> Dict[str, Dict]:
+    if not isinstance(user_data, dict):
+        return {}
+    return {
+        str(progress.get('bookId')): progress
+        for progress in user_data.get('bookProgress') or []
+        if isinstance(progress, dict) and progress.get('bookId')
+    }
+
+
+def book_contribution(book: Dict, progress: Optional[Dict] = None) -> Tuple[Tuple[str, str], ...]:
+    """一本书对各计数器的贡献，形如 (('status', 'read'), ('category', '计算机'), ...)"""
+    values = facet_values(book)
+    finished = values['finishReading'] == '1'
+    keys = [
+        ('status', 'read' if finished else 'unread'),
+        ('category', values['category']),
+        ('rating', values['rating']),
+    ]
+    if book.get('needsDetailFetch'):
+        keys.append(('status', 'pending_details'))
+
+    if finished:
+        # 完读月份优先取 bookProgress 的更新时间，没有进度记录时用书架上的阅读时间
+        timestamp = to_seconds((progress or {}).get('updateTime')) or to_seconds(book.get('readUpdateTime'))
+        if timestamp:
+            keys.append(('finished_by_month', datetime.fromtimestamp(timestamp).strftime('%Y-%m')))
+    return tuple(keys)
+
+
+def _books_by_id(user_data: Optional[Dict]) -> Dict[str, Dict]:
+    """书架上的书籍按 bookId 索引，重复的 bookId 只取第一本"""
+    if not isinstance(user_data, dict):
+        return {}
+    result = {}
+    for book in user_data.get('books') or []:
+        book_id = book.get('bookId')
+        if book_id and book_id not in result:
+            result[book_id] = book
+    return result
+
+
+def _apply(stats: Dict, keys: Tuple[Tuple[str, str], ...], delta: int) -> None:
+    for group, key in keys:
+        counters = stats.setdefault(group, {})
+        counters[key] = counters.get(key, 0) + delta
+        if counters[key] <= 0:
+            counters.pop(key)
+    stats['total'] = stats.get('total', 0) + delta
+
+
+def empty_stats() -> Dict:
+    stats = {group: {} for group in STAT_GROUPS}
+    stats['total'] = 0
+    return stats
+
+
+def compute_stats(user_data: Optional[Dict]) -> Dict:
+    """全量计算统计"""
+    stats = empty_stats()
+    progress = _progress_map(user_data)
+    for book_id, book in _books_by_id(user_data).items():
+        _apply(stats, book_contribution(book, progress.get(str(book_id))), 1)
+    return stats
+
+
+def diff_stats(stats: Dict, old_data: Optional[Dict], new_data: Optional[Dict]) -> Tuple[Dict, int]:
+    """
+    按书籍差异增量更新统计：以 bookId 对齐新旧书架，书籍和进度记录都没变的直接跳过，
+    只对新增、删除、贡献发生变化的书籍重新计算并调整计数
+
+    Returns:
+        (新的统计, 发生变化的书籍数)
+    """
+    total = stats.get('total', 0)
+    stats = {group: dict(stats.get(group, {})) for group in STAT_GROUPS}
+    stats['total'] = total if isinstance(total, int) else 0
+
+    old_books, new_books = _books_by_id(old_data), _books_by_id(new_data)
+    old_progress, new_progress = _progress_map(old_data), _progress_map(new_data)
+    changed = 0
+    for book_id in old_books.keys() | new_books.keys():
+        old_book, new_book = old_books.get(book_id), new_books.get(book_id)
+        old_entry, new_entry = old_progress.get(str(book_id)), new_progress.get(str(book_id))
+        if (old_book is new_book or old_book == new_book) and old_entry == new_entry:
+            continue
+
+        old_keys = book_contribution(old_book, old_entry) if old_book is not None else None
+        new_keys = book_contribution(new_book, new_entry) if new_book is not None else None
+        if old_keys == new_keys:
+            continue
+        if old_keys is not None:
+            _apply(stats, old_keys, -1)
+        if new_keys is not None:
+            _apply(stats, new_keys, 1)
+        changed += 1
+    return stats, changed
+
+
+def _format(stats: Dict, version: int) -> Dict:
+    status = stats.get('status', {})
+    return {
+        "total": stats.get('total', 0),
+        "read": status.get('read', 0),
+        "unread": status.get('unread', 0),
+        "pending_details": status.get('pending_details', 0),
+        "by_category": stats.get('category', {}),
+        "by_rating": stats.get('rating', {}),
+        "finished_by_month": dict(sorted(stats.get('finished_by_month', {}).items())),
+        "version": version
+    }
+
+
+def get_shelf_stats(db: Session, user_id: int) -> Optional[Dict]:
+    """
+    读取物化的书架统计（单行主键查询）
+    统计行缺失或落后于书架版本时，用当前书架全量重建一次
+    """
+    row = db.query(ShelfStats).filter(ShelfStats.user_id == user_id).first()
+    version = get_shelf_version(db, user_id)
+    if row is not None and row.stats and (row.version or 0) >= version:
+        return _format(row.stats, row.version)
+
+    user_books = db.query(UserBooks).filter(UserBooks.user_id == user_id).first()
+    if not user_books or not isinstance(user_books.books_data, dict):
+        return None
+
+    stats = compute_stats(user_books.books_data)
+    _save(db, user_id, stats, version, row)
+    return _format(stats, version)
+
+
+def _save(db: Session, user_id: int, stats: Dict, version: int, row: Optional[ShelfStats] = None) -> None:
+    if row is None:
+        row = db.query(ShelfStats).filter(ShelfStats.user_id == user_id).first()
+    if row is None:
+        db.add(ShelfStats(user_id=user_id, version=version, stats=stats))
+    else:
+        row.version = version
+        row.stats = stats
+    db.commit()
+
+
+@on_shelf_change
+def _update_stats_on_shelf_change(db: Session, user_id: int, old_data, new_data: Dict, version: int) -> None:
+    row = db.query(ShelfStats).filter(ShelfStats.user_id == user_id).first()
+    if row is not None and row.stats and (row.version or 0) == version - 1:
+        stats, changed = diff_stats(row.stats, old_data, new_data)
+        print(f"📊 书架统计增量更新: user_id={user_id}, 变化 {changed} 本")
+    else:
+        # 统计缺失或错过了中间版本，全量重建
+        stats = compute_stats(new_data)
+        print(f"📊 书架统计全量重建: user_id={user_id}, 共 {stats['total']} 本")
+    _save(db, user_id, stats, version, row)
@@ -0,0 +1,103 @@
+# 书架缓存读写：统一 UserBooks 的保存入口，维护书架版本号并通知变更监听者
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import UserBooks, ShelfState
+
+# listener(db, user_id, old_data, new_data, version)
+ShelfChangeListener = Callable[[Session, int, Optional[Dict], Dict, int], None]
+
+_listeners: List[ShelfChangeListener] = []
+
+
+class ShelfVersionConflict(Exception):
+    """保存时书架版本已不是调用方读取时的版本（期间有其他写入）"""
+
+
+def on_shelf_change(listener: ShelfChangeListener) -> ShelfChangeListener:
+    """注册书架变更监听者，可作为装饰器使用"""
+    _listeners.append(listener)
+    return listener
+
+
+def get_shelf_version(db: Session, user_id: int) -> int:
+    """读取用户当前的书架版本号，没有记录时为0"""
+    version = db.query(ShelfState.version).filter(ShelfState.user_id == user_id).scalar()
+    return version or 0
+
+
+def _bump_shelf_version(db: Session, user_id: int) -> ShelfState:
+    state = db.query(ShelfState).filter(ShelfState.user_id == user_id).first()
+    if state is None:
+        try:
+            with db.begin_nested():
+                state = ShelfState(user_id=user_id, version=1)
+                db.add(state)
+            return state
+        except IntegrityError:
+            # 其他worker已插入同一用户的记录，只回滚到保存点
+            state = db.query(ShelfState).filter(ShelfState.user_id == user_id).first()
+
+    # 使用SQL表达式自增，多个worker并发写入时不会丢失版本
+    state.version = ShelfState.version + 1
+    return state
+
+
+def _bump_shelf_version_from(db: Session, user_id: int, expected_version: int) -> None:
+    # 条件更新是原子的：版本已被其他写入者递增时不更新任何行
+    updated = (
+        db.query(ShelfState)
+        .filter(ShelfState.user_id == user_id, ShelfState.version == expected_version)
+        .update({ShelfState.version: ShelfState.version + 1}, synchronize_session=False)
+    )
+    if updated == 1:
+        return
+    if expected_version == 0 and db.query(ShelfState.id).filter(ShelfState.user_id == user_id).first() is None:
+        # 还没有版本记录（版本视为0）
+        _bump_shelf_version(db, user_id)
+        return
+    db.rollback()
+    raise ShelfVersionConflict(f"user_id={user_id} 的书架版本已不是 {expected_version}")
+
+
+def save_user_books(db: Session, user_id: int, user_data: Dict,
+                    user_books: Optional[UserBooks] = None,
+                    expected_version: Optional[int] = None) -> UserBooks:
+    """
+    保存用户书架缓存并递增书架版本号
+
+    Args:
+        user_books: 调用方已查询到的 UserBooks 记录，避免重复查询
+        expected_version: 调用方读取书架时的版本号；给出时只有版本未变才写入，
+            否则抛出 ShelfVersionConflict，不覆盖期间其他请求保存的书架
+    """
+    if expected_version is not None:
+        _bump_shelf_version_from(db, user_id, expected_version)
+
+    if user_books is None:
+        user_books = db.query(UserBooks).filter(UserBooks.user_id == user_id).first()
+
+    old_data = user_books.books_data if user_books else None
+    if user_books:
+        user_books.books_data = user_data
+    else:
+        user_books = UserBooks(user_id=user_id, books_data=user_data)
+        db.add(user_books)
+
+    if expected_version is None:
+        state = _bump_shelf_version(db, user_id)
+        db.commit()
+        version = state.version
+    else:
+        db.commit()
+        version = expected_version + 1
+
+    for listener in _listeners:
+        try:
+            listener(db, user_id, old_data, user_data, version)
+        except Exception as e:
+            print(f"⚠️ 书架变更监听处理失败 {getattr(listener, '__name__', listener)}: {e}")
+
+    return user_books
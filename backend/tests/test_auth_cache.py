@@ -0,0 +1,66 @@
+# 用户快照缓存：用户行的更新只在事务提交后失效缓存，回滚不失效
+import time
+
+import pytest
+
+import auth
+from auth import _TTLCache, get_current_user
+from models import User
+
+
+@pytest.fixture(autouse=True)
+def clear_user_cache():
+    auth._cached_users.clear()
+    yield
+    auth._cached_users.clear()
+
+
+def _cached(user_id):
+    return auth._cached_users.get(user_id)
+
+
+def test_get_current_user_caches_detached_snapshot(db, user):
+    snapshot = get_current_user(str(user.id), db)
+    assert _cached(user.id) is snapshot
+    assert get_current_user(str(user.id), db) is snapshot
+
+
+def test_invalidated_after_commit_not_at_flush(db, user):
+    get_current_user(str(user.id), db)
+    row = db.query(User).filter(User.id == user.id).one()
+    row.wr_skey = "new-skey"
+    db.flush()
+    # flush后事务尚未提交，其他请求仍应读到（并可能重新缓存）旧行
+    assert _cached(user.id) is not None
+
+    db.commit()
+    assert _cached(user.id) is None
+    assert get_current_user(str(user.id), db).wr_skey == "new-skey"
+
+
+def test_rollback_keeps_cache_and_forgets_pending_ids(db, user):
+    get_current_user(str(user.id), db)
+    row = db.query(User).filter(User.id == user.id).one()
+    row.wr_skey = "discarded"
+    db.flush()
+    db.rollback()
+    assert _cached(user.id) is not None
+
+    # 回滚后提交无关的修改不应失效该用户
+    db.add(User(wr_vid="2", wr_skey="s", wr_gid="g", wr_rt="r"))
+    db.commit()
+    assert _cached(user.id) is not None
+
+
+def test_ttl_cache_expiry_and_lru():
+    cache = _TTLCache("test", max_entries=2)
+    cache.put("a", 1, 60)
+    cache.put("b", 2, 60)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 60)  # 淘汰最久未使用的 b
+    assert cache.get("b") is None and cache.get("a") == 1
+
+    cache.put("expired", 4, 0.0001)
+    cache.put("ignored", 5, 0)
+    time.sleep(0.01)
+    assert cache.get("expired") is None and cache.get("ignored") is None
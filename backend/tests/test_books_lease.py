@@ -0,0 +1,55 @@
+# 书架冷启动刷新：只有持有刷新租约的请求才会调用微信读书
+from routers import books
+from shelf_store import save_user_books
+
+
+def _no_fetch(*args, **kwargs):
+    raise AssertionError("refreshed without holding the lease")
+
+
+def test_returns_503_when_lease_never_acquired(client, auth_headers, monkeypatch):
+    waits = []
+
+    async def fake_wait(user_id, timeout=0):
+        waits.append(user_id)
+        return True
+
+    monkeypatch.setattr(books, "acquire_refresh_lease", lambda user_id: None)
+    monkeypatch.setattr(books, "wait_for_refresh_async", fake_wait)
+    monkeypatch.setattr(books, "fetch_shelf_data", _no_fetch)
+
+    response = client.get("/api/books", headers=auth_headers)
+    assert response.status_code == 503
+    assert len(waits) == books.COLD_REFRESH_ATTEMPTS
+
+
+def test_wait_timeout_returns_503_immediately(client, auth_headers, monkeypatch):
+    waits = []
+
+    async def fake_wait(user_id, timeout=0):
+        waits.append(user_id)
+        return False
+
+    monkeypatch.setattr(books, "acquire_refresh_lease", lambda user_id: None)
+    monkeypatch.setattr(books, "wait_for_refresh_async", fake_wait)
+    monkeypatch.setattr(books, "fetch_shelf_data", _no_fetch)
+
+    assert client.get("/api/books", headers=auth_headers).status_code == 503
+    assert len(waits) == 1
+
+
+def test_uses_shelf_saved_by_lease_holder(client, auth_headers, user, db, monkeypatch):
+    async def fake_wait(user_id, timeout=0):
+        # 持有租约的另一个请求在等待期间保存了书架
+        save_user_books(db, user_id, {"books": [
+            {"bookId": "1", "title": "人类简史", "author": "赫拉利", "readUpdateTime": 1}
+        ]})
+        return True
+
+    monkeypatch.setattr(books, "acquire_refresh_lease", lambda user_id: None)
+    monkeypatch.setattr(books, "wait_for_refresh_async", fake_wait)
+    monkeypatch.setattr(books, "fetch_shelf_data", _no_fetch)
+
+    response = client.get("/api/books", headers=auth_headers)
+    assert response.status_code == 200
+    assert [book["bookId"] for book in response.json()["data"]["books"]] == ["1"]
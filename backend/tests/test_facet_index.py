@@ -0,0 +1,71 @@
+# 书架分面位图：取值归类、筛选交集、计数以及按版本缓存
+from facet_index import FacetIndex, FacetRegistry, UNRATED, facet_values, rating_tier
+
+
+def _books():
+    return [
+        {"bookId": "a", "category": "历史", "finishReading": 1, "newRatingDetail": {"title": "神作"}},
+        {"bookId": "b", "category": "历史", "finishReading": 0, "newRatingDetail": "好评如潮"},
+        {"bookId": "c", "category": "科技", "finishReading": 1, "newRatingDetail": "评分: 743/1000"},
+        {"bookId": "d", "finishReading": 0},
+        {"bookId": "a", "category": "重复"},
+        {"title": "没有bookId"},
+    ]
+
+
+def _ids(index, bitmap):
+    return [book_id for book_id in index.book_ids if index.contains(bitmap, book_id)]
+
+
+def test_facet_values():
+    assert rating_tier({"newRatingDetail": {"title": "神作"}}) == "神作"
+    assert rating_tier({"newRatingDetail": "评分: 743/1000"}) == UNRATED
+    assert rating_tier({}) == UNRATED
+    assert facet_values({"finishReading": 1}) == {"category": "未分类", "finishReading": "1", "rating": UNRATED}
+
+
+def test_index_skips_duplicates_and_missing_ids():
+    index = FacetIndex(_books(), version=3)
+    assert index.book_ids == ["a", "b", "c", "d"]
+    assert index.all_bits == 0b1111
+    assert index.version == 3
+
+
+def test_filter_bitmap_intersects_fields():
+    index = FacetIndex(_books())
+    assert _ids(index, index.filter_bitmap({"category": "历史"})) == ["a", "b"]
+    assert _ids(index, index.filter_bitmap({"category": "历史", "finishReading": 1})) == ["a"]
+    assert index.filter_bitmap({"category": "不存在"}) == 0
+    # 空值和未知分面不限制
+    assert index.filter_bitmap({"category": "", "rating": None, "unknown": "x"}) == index.all_bits
+
+
+def test_bitmap_of_and_counts():
+    index = FacetIndex(_books())
+    bitmap = index.bitmap_of(["c", "a", "missing"])
+    assert bitmap == 0b0101
+    assert _ids(index, bitmap) == ["a", "c"]
+
+    counts = index.counts()
+    assert counts["category"] == {"历史": 2, "科技": 1, "未分类": 1}
+    assert list(counts["category"])[0] == "历史"
+    assert counts["finishReading"] == {"1": 2, "0": 2}
+
+    scoped = index.counts(bitmap)
+    assert scoped["category"] == {"历史": 1, "科技": 1}
+    assert scoped["rating"] == {"神作": 1, UNRATED: 1}
+
+
+def test_registry_rebuilds_only_when_stale():
+    registry = FacetRegistry()
+    assert registry.get(1, 1) is None
+
+    first = registry.get(1, 1, _books())
+    assert registry.get(1, 1) is first
+    assert registry.get(1, 2) is None
+
+    second = registry.get(1, 2, _books()[:2])
+    assert second.book_ids == ["a", "b"]
+    # 旧版本的构建结果不会覆盖新索引
+    registry.build(1, _books(), 1)
+    assert registry.get(1, 2) is second
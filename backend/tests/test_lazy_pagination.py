@@ -0,0 +1,53 @@
+# 按需补全模式的书架分页：补全在线程池中执行，补全前后书籍的分页位置不变
+import asyncio
+
+import shelf_refresh
+from shelf_enrichment import save_synced_books
+from shelf_refresh import sort_for_pagination, settings
+from shelf_store import save_user_books
+
+
+def _stub(book_id):
+    return {"bookId": book_id, "title": f"书籍_{book_id}", "author": "需要获取详情",
+            "readUpdateTime": 9999999999999, "needsDetailFetch": True}
+
+
+def _full(book_id, read_time):
+    return {"bookId": book_id, "title": f"完整{book_id}", "author": "作者", "readUpdateTime": read_time}
+
+
+def test_sort_for_pagination():
+    books = [_full("a", 1), _stub("b"), _full("c", 3)]
+    assert sort_for_pagination({"source": "html_rawBooks_lazy"}, books) == books
+    assert [b["bookId"] for b in sort_for_pagination({"source": "syncBook_api"}, books)] == ["b", "c", "a"]
+
+
+def test_lazy_pages_are_stable_and_enriched_off_loop(client, auth_headers, user, db, monkeypatch):
+    shelf = [_full("1", 50), _stub("2"), _full("3", 10), _stub("4"), _stub("5"), _full("6", 90)]
+    save_user_books(db, user.id, {"books": shelf, "bookProgress": [], "source": "html_rawBooks_lazy"})
+
+    calls = []
+
+    def fake_enrich(db, user_id, weread_api, book_ids):
+        try:
+            asyncio.get_running_loop()
+            calls.append("event-loop")
+        except RuntimeError:
+            calls.append("threadpool")
+        enriched = {book_id: _full(book_id, 1) for book_id in book_ids}
+        save_synced_books(db, user_id, {"books": list(enriched.values())})
+        return enriched
+
+    monkeypatch.setattr(settings, "shelf_load_mode", "lazy")
+    monkeypatch.setattr(shelf_refresh, "enrich_book_ids", fake_enrich)
+    monkeypatch.setattr(shelf_refresh.shelf_enricher, "prefetch", lambda *args: False)
+
+    def page(n):
+        response = client.get("/api/books", params={"page": n, "page_size": 2}, headers=auth_headers)
+        assert response.status_code == 200
+        return [book["bookId"] for book in response.json()["data"]["books"]]
+
+    assert [page(1), page(2), page(3)] == [["1", "2"], ["3", "4"], ["5", "6"]]
+    assert calls == ["threadpool", "threadpool", "threadpool"]
+    # 占位书籍补全得到真实阅读时间后仍停留在原来的页
+    assert [page(1), page(2), page(3)] == [["1", "2"], ["3", "4"], ["5", "6"]]
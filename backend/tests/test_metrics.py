@@ -0,0 +1,42 @@
+# 指标输出：指标名称与 Prometheus 文本格式保持不变
+import metrics
+from metrics import observe_upstream, record_cache, record_short_circuit, render_metrics
+
+
+def _sample(text, prefix):
+    for line in text.splitlines():
+        if line.startswith(prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_upstream_metrics():
+    observe_upstream("metrics_test", "GET", "200", 0.3, 2048)
+    observe_upstream("metrics_test", "GET", "timeout", 31)
+    record_short_circuit("metrics_test")
+    text = render_metrics()
+
+    assert _sample(text, 'weread_upstream_requests_total{endpoint="metrics_test",status="200"}') == 1
+    assert _sample(text, 'weread_upstream_requests_total{endpoint="metrics_test",status="timeout"}') == 1
+    assert _sample(text, 'weread_upstream_request_duration_seconds_bucket{endpoint="metrics_test",le="0.5",method="GET"}') == 1
+    assert _sample(text, 'weread_upstream_request_duration_seconds_count{endpoint="metrics_test",method="GET"}') == 2
+    assert _sample(text, 'weread_upstream_response_bytes_count{endpoint="metrics_test"}') == 1
+    assert _sample(text, 'weread_upstream_short_circuit_total{endpoint="metrics_test"}') == 1
+    assert "_created" not in text
+
+
+def test_cache_hit_ratio():
+    for hit in (True, True, True, False):
+        record_cache("metrics_test_cache", hit)
+    assert metrics.cache_counts()["metrics_test_cache"] == [3, 1]
+    text = render_metrics()
+    assert _sample(text, 'weread_cache_requests_total{cache="metrics_test_cache",result="hit"}') == 3
+    assert _sample(text, 'weread_cache_hit_ratio{cache="metrics_test_cache"}') == 0.75
+    assert "# TYPE weread_cache_hit_ratio gauge" in text
+
+
+def test_metrics_endpoint(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "weread_event_loop_lag_last_seconds" in response.text
@@ -0,0 +1,33 @@
+# 笔记组装：划线位置解析与缓存、按章节分组排序
+import note_assembly
+from note_assembly import UNKNOWN_POSITION, assemble_notes, parse_range, range_position
+
+
+def test_parse_range():
+    assert parse_range("1024-1060") == (1024, 1060)
+    assert parse_range("7") == (7, 7)
+    assert parse_range("12-x") == (12, 12)
+    assert parse_range("") == (UNKNOWN_POSITION, UNKNOWN_POSITION)
+    assert parse_range(None) == (UNKNOWN_POSITION, UNKNOWN_POSITION)
+
+
+def test_range_position_cache_is_bounded():
+    info = note_assembly._parse_range_text.cache_info()
+    assert info.maxsize == note_assembly.POSITION_CACHE_SIZE
+    assert range_position("5-9") == (5, 9)
+    assert range_position("5-9") == (5, 9)
+    assert note_assembly._parse_range_text.cache_info().hits > info.hits
+    assert range_position(None) == (UNKNOWN_POSITION, UNKNOWN_POSITION)
+
+
+def test_assemble_notes_sorts_numerically_per_chapter():
+    bookmarks = [
+        {"chapterUid": 1, "range": "100-120", "markText": "c"},
+        {"chapterUid": 1, "range": "9-20", "markText": "a"},
+        {"chapterUid": 2, "range": "", "markText": "z"},
+        {"chapterUid": 1, "range": "9-20", "markText": "b"},
+        {"chapterUid": 2, "range": "5-6", "markText": "y"},
+    ]
+    grouped = assemble_notes(bookmarks)
+    assert [note[2]["markText"] for note in grouped[1]] == ["a", "b", "c"]
+    assert [note[2]["markText"] for note in grouped[2]] == ["y", "z"]
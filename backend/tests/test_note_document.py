@@ -0,0 +1,88 @@
+# 笔记文档增量同步：无变化时不重写文档，并发首次打开由唯一约束兜底
+import pytest
+
+import note_document
+from database import SessionLocal
+from models import BookNoteSync
+from note_document import sync_note_document
+
+
+class _StubApi:
+    def __init__(self):
+        self.synckey = 100
+        self.updated = [{"bookmarkId": "m1", "chapterUid": 1, "range": "1-5", "markText": "第一条", "createTime": 1}]
+        self.on_full_sync = None
+
+    def get_bookmarks(self, book_id, sync_key="0"):
+        if sync_key == "0":
+            if self.on_full_sync:
+                self.on_full_sync()
+            updated = self.updated
+        else:
+            updated = [b for b in self.updated if b["createTime"] > int(sync_key)]
+        return {"synckey": self.synckey, "updated": list(updated), "removed": [], "book": {"title": "书"}}
+
+    def get_sorted_chapters(self, book_id):
+        return [(1, 1, "第一章"), (2, 1, "第二章")]
+
+
+@pytest.fixture
+def saves(monkeypatch):
+    calls = []
+    original = note_document._save_document
+    monkeypatch.setattr(note_document, "_save_document",
+                        lambda *args: calls.append(args[3]) or original(*args))
+    return calls
+
+
+def _row(db):
+    db.expire_all()
+    return db.query(BookNoteSync).filter_by(user_id=1, book_id="b").one()
+
+
+def test_unchanged_sync_skips_write(db, saves):
+    api = _StubApi()
+    doc, data = sync_note_document(db, 1, "b", api)
+    assert data["full_sync"] and saves == ["b"]
+    assert _row(db).sync_key == "100"
+
+    doc, data = sync_note_document(db, 1, "b", api)
+    assert data["full_sync"] is False
+    assert saves == ["b"]
+    assert note_document.document_bookmark_count(doc) == 1
+
+
+def test_advanced_synckey_without_changes_only_updates_key(db, saves):
+    api = _StubApi()
+    sync_note_document(db, 1, "b", api)
+    api.synckey = 200
+    sync_note_document(db, 1, "b", api)
+    assert saves == ["b"]
+    assert _row(db).sync_key == "200"
+
+
+def test_changed_bookmarks_rewrite_document(db, saves):
+    api = _StubApi()
+    sync_note_document(db, 1, "b", api)
+    api.updated.append({"bookmarkId": "m2", "chapterUid": 2, "range": "3-4", "markText": "第二条", "createTime": 150})
+    api.synckey = 150
+    doc, _ = sync_note_document(db, 1, "b", api)
+    assert saves == ["b", "b"]
+    assert note_document.document_bookmark_count(_row(db).notes_data) == 2
+
+
+def test_concurrent_first_open_is_resolved_by_unique_index(db):
+    api = _StubApi()
+
+    def other_request_saves_first():
+        other = SessionLocal()
+        try:
+            other.add(BookNoteSync(user_id=1, book_id="b", sync_key="100", notes_data={"version": 0}))
+            other.commit()
+        finally:
+            other.close()
+
+    api.on_full_sync = other_request_saves_first
+    doc, data = sync_note_document(db, 1, "b", api)
+    assert doc is not None and data["full_sync"]
+    assert db.query(BookNoteSync).filter_by(user_id=1, book_id="b").count() == 1
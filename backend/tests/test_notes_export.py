@@ -0,0 +1,76 @@
+# 全库笔记导出：流式ZIP、失败续传、完成后释放已渲染内容
+import io
+import zipfile
+
+import notes_export
+from models import NotesExportItem, NotesExportJob
+from notes_export import FAILED_LIST_FILENAME, create_export_job, export_job_summary, stream_export_zip
+
+
+def _notebooks(*book_ids):
+    return [{"bookId": book_id, "book": {"title": f"书{book_id}"}} for book_id in book_ids]
+
+
+def _run(job_id):
+    data = b''.join(stream_export_zip(job_id, "cookies", concurrency=2))
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        return {name: archive.read(name).decode() for name in archive.namelist()}
+
+
+def _patch_render(monkeypatch, outcomes, calls):
+    def fake_render(weread_api, book_id, title, option, is_html):
+        calls.append(book_id)
+        outcome = outcomes[book_id]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(notes_export.weread_clients, "for_cookies", lambda cookies, user_id: object())
+    monkeypatch.setattr(notes_export, "render_book_notes", fake_render)
+
+
+def _summary(db, job_id):
+    db.expire_all()
+    return export_job_summary(db, db.query(NotesExportJob).filter_by(job_id=job_id).one())
+
+
+def _contents(db, job_id):
+    db.expire_all()
+    return {item.book_id: item.content for item in db.query(NotesExportItem).filter_by(job_id=job_id)}
+
+
+def test_resume_only_fetches_failed_books(db, monkeypatch):
+    job = create_export_job(db, 1, _notebooks("a", "b", "c", "a"), "markdown", 1)
+    calls = []
+    outcomes = {"a": "# A", "b": RuntimeError("网络错误"), "c": None}
+    _patch_render(monkeypatch, outcomes, calls)
+
+    files = _run(job.job_id)
+    assert sorted(calls) == ["a", "b", "c"]
+    assert files["书a.md"] == "# A"
+    assert "书b (b): 网络错误" in files[FAILED_LIST_FILENAME]
+    summary = _summary(db, job.job_id)
+    assert summary["status"] == "partial"
+    assert summary["counts"] == {"pending": 0, "done": 1, "empty": 1, "failed": 1}
+    # 部分失败时保留已完成的内容用于续传
+    assert _contents(db, job.job_id)["a"] == "# A"
+
+    calls.clear()
+    outcomes["b"] = "# B"
+    files = _run(job.job_id)
+    assert calls == ["b"]
+    assert files == {"书a.md": "# A", "书b.md": "# B"}
+
+    # 全部完成后不再保存渲染内容，进度仍可查询
+    assert set(_contents(db, job.job_id).values()) == {None}
+    summary = _summary(db, job.job_id)
+    assert summary["status"] == "complete" and summary["counts"]["done"] == 2
+
+    # 已释放内容的任务再次请求时重新抓取，而不是输出空文件
+    calls.clear()
+    assert _run(job.job_id) == {"书a.md": "# A", "书b.md": "# B"}
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_unknown_job_yields_nothing(db):
+    assert list(stream_export_zip("missing", "cookies")) == []
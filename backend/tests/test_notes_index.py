@@ -0,0 +1,124 @@
+# 笔记全文索引：SQLite FTS5、LIKE退化路径、PostgreSQL tsquery构造以及后台回填
+import pytest
+from sqlalchemy import text
+
+import notes_index as notes_index_module
+from database import engine
+from models import BookNoteSync, NoteSearchEntry
+from notes_index import NotesIndexBackfill, NotesSearchIndex
+
+
+@pytest.fixture
+def index(db):
+    # FTS5 表不在 metadata 中，随表结构一起重建
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS note_search_fts"))
+    return NotesSearchIndex()
+
+
+def _bookmarks(*items, chapters=None):
+    return {
+        "updated": [
+            {"bookmarkId": bookmark_id, "chapterUid": 1, "markText": mark, "noteText": note, "createTime": ts}
+            for bookmark_id, mark, note, ts in items
+        ],
+        "removed": [],
+        "chapters": chapters or [{"chapterUid": 1, "title": "第一章"}],
+    }
+
+
+def _seed(db, index):
+    index.index_bookmarks(db, 1, "b1", "人类简史", _bookmarks(
+        ("m1", "认知革命让智人讲述虚构的故事", "", 100),
+        ("m2", "农业革命是史上最大的骗局", "简史的观点", 200),
+        ("m3", "Python programming notes", "", 300),
+    ), replace=True)
+    index.index_bookmarks(db, 2, "b2", "别人的书", _bookmarks(("x1", "农业革命", "", 400)), replace=True)
+
+
+def test_fts_search_is_ranked_and_per_user(db, index):
+    _seed(db, index)
+    assert index.fts_enabled
+
+    results, total = index.search(db, 1, "革命")
+    assert total == 2
+    assert {r["bookmarkId"] for r in results} == {"m1", "m2"}
+    assert all(r["score"] > 0 for r in results)
+    assert results[0]["chapterTitle"] == "第一章"
+
+    results, total = index.search(db, 1, "农业 骗局")
+    assert total == 1 and results[0]["bookmarkId"] == "m2"
+
+    results, _ = index.search(db, 1, "progr")
+    assert [r["bookmarkId"] for r in results] == ["m3"]
+
+
+def test_like_fallback_orders_by_time(db, index, monkeypatch):
+    index.ensure_schema()
+    _seed(db, index)
+    # 模拟不支持全文索引的数据库
+    monkeypatch.setattr(index, "fts_enabled", False)
+
+    results, total = index.search(db, 1, "革命")
+    assert total == 2
+    assert [r["bookmarkId"] for r in results] == ["m2", "m1"]
+    assert all(r["score"] == 0 for r in results)
+    assert results[0]["markText"]["matches"]
+
+    results, total = index.search(db, 1, "革命", offset=1, limit=1)
+    assert total == 2 and [r["bookmarkId"] for r in results] == ["m1"]
+
+
+def test_fts_error_falls_back_to_like(db, index, monkeypatch):
+    _seed(db, index)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("fts unavailable")
+
+    monkeypatch.setattr(index, "_search_fts", broken)
+    results, total = index.search(db, 1, "骗局")
+    assert total == 1 and results[0]["bookmarkId"] == "m2"
+
+
+def test_build_tsquery():
+    build = NotesSearchIndex._build_tsquery
+    assert build(["简史"]) == "('简' <-> '史')"
+    assert build(["Python"]) == "('python':*)"
+    assert build(["农业", "it's"]) == "('农' <-> '业') & ('it''s':*)"
+    # 纯标点不产生查询
+    assert build(["&|!", "，"]) == ""
+
+
+class _StubApi:
+    def __init__(self, notebooks, bookmarks):
+        self.notebooks = notebooks
+        self.bookmarks = bookmarks
+        self.calls = []
+
+    def get_notebooks(self):
+        return self.notebooks
+
+    def get_bookmarks(self, book_id, sync_key="0"):
+        self.calls.append((book_id, sync_key))
+        return self.bookmarks[book_id]
+
+
+def test_backfill_indexes_missing_books(db, index, monkeypatch):
+    index.index_bookmarks(db, 1, "b1", "已索引", _bookmarks(("m1", "旧的划线", "", 1)), replace=True)
+    api = _StubApi(
+        notebooks=[{"bookId": "b1", "book": {"title": "已索引"}}, {"bookId": "b2", "book": {}}],
+        bookmarks={"b2": dict(_bookmarks(("n1", "新书的划线", "", 5), chapters=[{"chapterUid": 1, "title": "序"}]),
+                              book={"title": "新书"})},
+    )
+    monkeypatch.setattr(notes_index_module.weread_clients, "for_cookies", lambda cookies, user_id: api)
+
+    backfill = NotesIndexBackfill(index)
+    backfill._states[1] = {"status": "running", "indexed_books": 0, "total_books": 0}
+    backfill._run(1, "cookies")
+
+    assert backfill.status(1) == {"status": "complete", "indexed_books": 1, "total_books": 1}
+    assert api.calls == [("b2", "0")]
+    entry = db.query(NoteSearchEntry).filter_by(user_id=1, book_id="b2").one()
+    assert (entry.book_title, entry.chapter_title) == ("新书", "序")
+    # 回填只写索引，不依赖笔记文档
+    assert db.query(BookNoteSync).count() == 0
@@ -0,0 +1,43 @@
+# 阅读进度同步：只写变化的记录，只删除已离开书架的书籍
+from models import ReadingProgress
+from reading_progress import sync_reading_progress
+
+
+def _data(book_ids, progress):
+    return {
+        "books": [{"bookId": book_id, "title": f"书{book_id}"} for book_id in book_ids],
+        "bookProgress": [{"bookId": book_id, "progress": value, "updateTime": 1700000000}
+                         for book_id, value in progress.items()],
+    }
+
+
+def _rows(db):
+    return {row.book_id: row.progress for row in db.query(ReadingProgress).filter_by(user_id=1)}
+
+
+def test_writes_only_changes(db):
+    assert sync_reading_progress(db, 1, _data(["a", "b"], {"a": 10, "b": 20})) == (2, 0)
+    assert sync_reading_progress(db, 1, _data(["a", "b"], {"a": 10, "b": 20})) == (0, 0)
+    assert sync_reading_progress(db, 1, _data(["a", "b"], {"a": 15, "b": 20})) == (1, 0)
+    assert _rows(db) == {"a": 15, "b": 20}
+
+
+def test_keeps_rows_missing_from_batch_while_on_shelf(db):
+    sync_reading_progress(db, 1, _data(["a", "b"], {"a": 10, "b": 20}))
+    # 本批进度缺少 b，但 b 仍在书架上
+    assert sync_reading_progress(db, 1, _data(["a", "b"], {"a": 10})) == (0, 0)
+    assert _rows(db) == {"a": 10, "b": 20}
+
+
+def test_deletes_rows_for_books_that_left_the_shelf(db):
+    sync_reading_progress(db, 1, _data(["a", "b"], {"a": 10, "b": 20}))
+    assert sync_reading_progress(db, 1, _data(["a"], {"a": 10})) == (0, 1)
+    assert _rows(db) == {"a": 10}
+
+
+def test_no_book_list_means_no_deletes(db):
+    sync_reading_progress(db, 1, _data(["a", "b"], {"a": 10, "b": 20}))
+    data = _data([], {"a": 11})
+    del data["books"]
+    assert sync_reading_progress(db, 1, data) == (1, 0)
+    assert _rows(db) == {"a": 11, "b": 20}
@@ -0,0 +1,40 @@
+# 书架刷新任务：最终事件与结束状态一起发布
+import refresh_jobs as refresh_jobs_module
+from models import User
+from refresh_jobs import RefreshJob, RefreshJobManager
+
+
+def test_finish_appends_final_event_with_status():
+    job = RefreshJob(1)
+    job.finish('succeeded', {"total_books": 3})
+    assert job.finished and job.finished_at
+    assert job.events[-1]["stage"] == 'succeeded'
+    assert job.events[-1]["info"] == {"total_books": 3}
+    assert [event["seq"] for event in job.events] == [1, 2]
+
+
+def test_run_reports_result_and_failure(db, monkeypatch):
+    db.add(User(id=1, wr_vid="1", wr_skey="s", wr_gid="g", wr_rt="r"))
+    db.commit()
+    outcomes = [({"books": [{}, {}], "source": "html"}, None), ({"error": "expired", "need_login": True}, None)]
+
+    def fake_refresh(db, user, cookies, progress_callback=None):
+        progress_callback('html_fetched')
+        return outcomes.pop(0)
+
+    monkeypatch.setattr(refresh_jobs_module, "refresh_user_shelf_exclusive", fake_refresh)
+    manager = RefreshJobManager(max_workers=1)
+
+    job = RefreshJob(1)
+    manager._run(job, "cookies")
+    assert job.status == 'succeeded' and job.result["total_books"] == 2
+    assert [event["stage"] for event in job.events] == ['queued', 'started', 'html_fetched', 'succeeded']
+
+    job = RefreshJob(1)
+    manager._run(job, "cookies")
+    assert job.status == 'failed' and job.error == "expired"
+    assert job.events[-1]["stage"] == 'failed' and job.events[-1]["info"]["need_login"] is True
+
+    job = RefreshJob(2)  # 用户不存在
+    manager._run(job, "cookies")
+    assert job.status == 'failed' and job.events[-1]["info"] == {"error": "用户不存在"}
@@ -0,0 +1,126 @@
+# 书架加权模糊搜索：字段权重、60分阈值、top-k顺序以及打分库的逐级降级
+import builtins
+
+import pytest
+
+import weread_api
+from weread_api import SEARCH_FIELD_WEIGHTS, WeReadAPI
+
+
+@pytest.fixture
+def api():
+    return WeReadAPI("wr_vid=1; wr_skey=test")
+
+
+def _book(book_id, title='', author='', category=''):
+    return {'bookId': book_id, 'title': title, 'author': author, 'category': category}
+
+
+def _fixed_scores(monkeypatch, api, table):
+    """按 (字段值) 查表返回 partial_ratio，隔离打分库只验证加权逻辑"""
+    monkeypatch.setattr(api, '_batch_partial_ratio',
+                        lambda values, query: [table.get(value, 0) for value in values])
+
+
+def test_default_weights():
+    assert SEARCH_FIELD_WEIGHTS == {'title': 1.0, 'author': 0.9, 'category': 0.7}
+
+
+def test_field_weights_scale_exact_matches(api):
+    user_data = {'books': [
+        _book('t', title='三体'),
+        _book('a', title='其他', author='三体'),
+        _book('c', title='其他', category='三体'),
+    ]}
+    results, total = api.search_books_ranked(user_data, '三体')
+    assert total == 3
+    assert [(r['bookId'], r['ratio']) for r in results] == [('t', 100), ('a', 90), ('c', 70)]
+
+
+def test_book_score_is_best_weighted_field(api, monkeypatch):
+    _fixed_scores(monkeypatch, api, {'T': 50, 'A': 80, 'C': 100})
+    results, _ = api.search_books_ranked({'books': [_book('1', 'T', 'A', 'C')]}, 'q')
+    assert results[0]['ratio'] == 72  # max(50, round(80*0.9), round(100*0.7))
+
+
+def test_cutoff_is_strictly_above_60(api, monkeypatch):
+    _fixed_scores(monkeypatch, api, {'sixty': 60, 'sixty-one': 61})
+    user_data = {'books': [_book('60', 'sixty'), _book('61', 'sixty-one')]}
+    results, total = api.search_books_ranked(user_data, 'q')
+    assert total == 1
+    assert [r['bookId'] for r in results] == ['61']
+
+
+def test_category_partial_match_needs_87(api, monkeypatch):
+    # 分类权重0.7：86分折算为60被截断，87分折算为61命中
+    _fixed_scores(monkeypatch, api, {'c86': 86, 'c87': 87})
+    user_data = {'books': [_book('86', category='c86'), _book('87', category='c87')]}
+    results, total = api.search_books_ranked(user_data, 'q')
+    assert total == 1
+    assert results[0]['bookId'] == '87'
+    assert results[0]['ratio'] == 61
+
+
+def test_custom_weights(api, monkeypatch):
+    _fixed_scores(monkeypatch, api, {'C': 100})
+    user_data = {'books': [_book('1', category='C')]}
+    assert api.search_books_ranked(user_data, 'q', weights={'category': 0.6}) == ([], 0)
+
+
+def test_top_k_order_and_total(api, monkeypatch):
+    _fixed_scores(monkeypatch, api, {'a': 70, 'b': 95, 'c': 80, 'd': 95, 'e': 10})
+    user_data = {'books': [_book(x, x) for x in 'abcde']}
+
+    results, total = api.search_books_ranked(user_data, 'q', limit=3)
+    assert total == 4
+    # 同分保持书架原有顺序
+    assert [r['bookId'] for r in results] == ['b', 'd', 'c']
+
+    all_results, _ = api.search_books_ranked(user_data, 'q')
+    assert [r['bookId'] for r in all_results] == ['b', 'd', 'c', 'a']
+    assert api.search_books(user_data, 'q', limit=2) == all_results[:2]
+
+
+def test_books_without_id_are_skipped(api):
+    user_data = {'books': [{'title': '三体'}, _book('1', '三体')]}
+    results, total = api.search_books_ranked(user_data, '三体')
+    assert total == 1 and results[0]['bookId'] == '1'
+
+
+def test_rapidfuzz_scores_match_partial_ratio(api):
+    if weread_api.rf_process is None:
+        pytest.skip("rapidfuzz not installed")
+    titles = ['人类简史', 'Python编程', '']
+    expected = [round(weread_api.rf_fuzz.partial_ratio('简史', t)) for t in titles]
+    assert api._batch_partial_ratio(titles, '简史') == expected
+
+
+def test_fuzzywuzzy_fallback(api, monkeypatch):
+    fuzz = pytest.importorskip('fuzzywuzzy.fuzz')
+    monkeypatch.setattr(weread_api, 'rf_process', None)
+    titles = ['人类简史', 'Python编程']
+    assert api._batch_partial_ratio(titles, '简史') == [fuzz.partial_ratio(t, '简史') for t in titles]
+
+
+def test_substring_fallback(api, monkeypatch):
+    monkeypatch.setattr(weread_api, 'rf_process', None)
+    real_import = builtins.__import__
+
+    def no_fuzzywuzzy(name, *args, **kwargs):
+        if name.startswith('fuzzywuzzy'):
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, '__import__', no_fuzzywuzzy)
+    assert api._batch_partial_ratio(['人类简史', 'PYTHON', 'Go'], '简史') == [80, 0, 0]
+    assert api._batch_partial_ratio(['PYTHON'], 'python') == [80]
+
+    # 退化后子串命中得80分，分类字段折算为56分不再命中
+    user_data = {'books': [_book('1', title='人类简史'), _book('2', category='简史')]}
+    results, total = api.search_books_ranked(user_data, '简史')
+    assert total == 1 and results[0]['ratio'] == 80
+
+
+def test_empty_shelf(api):
+    assert api.search_books_ranked({'books': []}, 'q') == ([], 0)
+    assert api._batch_partial_ratio([], 'q') == []
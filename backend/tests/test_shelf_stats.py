@@ -0,0 +1,81 @@
+# 书架统计：全量计算与按 bookId 增量更新结果一致，且只重算变化的书籍
+import copy
+import random
+
+import shelf_stats
+from shelf_stats import compute_stats, diff_stats
+
+
+def _shelf(n=50, seed=7):
+    rng = random.Random(seed)
+    books = [
+        {
+            "bookId": str(i),
+            "category": rng.choice(["历史", "科技", "小说"]),
+            "finishReading": rng.choice([0, 1]),
+            "newRatingDetail": rng.choice(["神作", "好评如潮", ""]),
+            "readUpdateTime": 1700000000 + i * 86400,
+        }
+        for i in range(n)
+    ]
+    progress = [{"bookId": str(i), "updateTime": 1690000000 + i * 3600} for i in range(0, n, 3)]
+    return {"books": books, "bookProgress": progress}
+
+
+def test_compute_stats():
+    data = {"books": [
+        {"bookId": "a", "category": "历史", "finishReading": 1, "readUpdateTime": 1704067200},
+        {"bookId": "b", "needsDetailFetch": True},
+        {"bookId": "a", "category": "重复"},
+    ]}
+    stats = compute_stats(data)
+    assert stats["total"] == 2
+    assert stats["status"] == {"read": 1, "unread": 1, "pending_details": 1}
+    assert stats["category"] == {"历史": 1, "未分类": 1}
+    assert sum(stats["finished_by_month"].values()) == 1
+
+
+def test_diff_matches_full_recompute():
+    old = _shelf()
+    old["books"][3]["finishReading"] = 1  # 完读月份取进度时间，进度变化会改变贡献
+    new = copy.deepcopy(old)
+    new["books"][0]["finishReading"] = 1 - new["books"][0]["finishReading"]  # 修改
+    new["books"][5]["category"] = "哲学"
+    del new["books"][10]  # 删除
+    new["books"].append({"bookId": "new", "category": "科技", "finishReading": 1})  # 新增
+    new["bookProgress"][1]["updateTime"] = 1600000000  # 只改进度
+
+    stats, changed = diff_stats(compute_stats(old), old, new)
+    assert stats == compute_stats(new)
+    assert changed == 5
+
+
+def test_diff_only_recomputes_changed_books(monkeypatch):
+    old = _shelf()
+    new = copy.deepcopy(old)
+    new["books"][2]["category"] = "哲学"
+    new["books"].append({"bookId": "new"})
+    base = compute_stats(old)
+
+    calls = []
+    original = shelf_stats.book_contribution
+    monkeypatch.setattr(shelf_stats, "book_contribution",
+                        lambda book, progress=None: calls.append(book["bookId"]) or original(book, progress))
+
+    stats, changed = diff_stats(base, old, new)
+    assert changed == 2
+    assert sorted(calls) == ["2", "2", "new"]
+    assert stats["category"].get("哲学") == 1
+
+
+def test_diff_does_not_mutate_input_and_handles_missing_data():
+    data = _shelf(5)
+    base = compute_stats(data)
+    snapshot = copy.deepcopy(base)
+
+    stats, changed = diff_stats(base, data, None)
+    assert base == snapshot
+    assert changed == 5 and stats["total"] == 0
+
+    stats, changed = diff_stats(compute_stats(None), None, data)
+    assert stats == base and changed == 5
@@ -0,0 +1,37 @@
+# 搜索建议：前缀树命中、拼音前缀以及命中不足时的子串补充
+from typeahead import TypeaheadIndex
+
+
+def _books():
+    return [
+        {"bookId": "1", "title": "人类简史", "author": "尤瓦尔·赫拉利", "readUpdateTime": 300},
+        {"bookId": "2", "title": "时间简史", "author": "霍金", "readUpdateTime": 200},
+        {"bookId": "3", "title": "简单的逻辑学", "author": "麦克伦尼", "readUpdateTime": 100},
+        {"bookId": "4", "title": "SRE：Google运维解密", "author": "Betsy Beyer", "readUpdateTime": 400},
+    ]
+
+
+def _ids(results):
+    return [r["bookId"] for r in results]
+
+
+def test_prefix_hits_are_ordered_by_recency():
+    index = TypeaheadIndex(_books())
+    assert _ids(index.lookup("简", limit=1)) == ["3"]
+    assert _ids(index.lookup("google")) == ["4"]
+
+
+def test_substring_fallback_fills_up_to_limit():
+    index = TypeaheadIndex(_books())
+    # "简史" 不是任何书名/片段的前缀，只能靠子串补充
+    assert _ids(index.lookup("简史")) == ["1", "2"]
+    assert _ids(index.lookup("简史", limit=1)) == ["1"]
+    # 前缀命中在前，子串补充按阅读时间排在后面且不重复
+    assert _ids(index.lookup("简")) == ["3", "1", "2"]
+    assert _ids(index.lookup("运维")) == ["4"]
+
+
+def test_no_match():
+    index = TypeaheadIndex(_books())
+    assert index.lookup("不存在") == []
+    assert index.lookup("") == []
@@ -0,0 +1,185 @@
+# 搜索建议：按用户预构建的前缀树（书名、作者、书名拼音全拼/首字母）
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:
+    print("Warning: pypinyin not installed, pinyin suggestions will be disabled")
+    lazy_pinyin = None
+
+from database import SessionLocal
+from metrics import record_cache
+from models import UserBooks
+from shelf_store import on_shelf_change, get_shelf_version
+
+_CJK_RE = re.compile(r'[\u3400-\u9fff]')
+_SPLIT_RE = re.compile(r'[\s:：,，、·\-—_()（）\[\]【】《》<>"“”\'‘’/|!！?？.。;；]+')
+
+
+def _normalize(value: str) -> str:
+    return ''.join(value.lower().split())
+
+
+def _recency(book: Dict) -> int:
+    """readUpdateTime 可能是秒也可能是毫秒，统一为秒"""
+    value = book.get('readUpdateTime') or 0
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return 0
+    return value // 1000 if value > 10 ** 11 else value
+
+
+class _TrieNode:
+    __slots__ = ('children', 'top')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.top: List[int] = []  # 经过该节点的最近阅读的若干本书（书籍下标，按阅读时间降序）
+
+
+class TypeaheadIndex:
+    """
+    单个用户书架的前缀树
+    书籍按阅读时间降序插入，每个节点只保留前 max_per_node 本，查询时直接返回节点上的列表；
+    前缀命中不足 limit 本时再按阅读时间顺序补充书名/作者中间包含查询串的书（如 "简史" 命中 "人类简史"）
+    """
+
+    def __init__(self, books: List[Dict], version: int = 0, max_per_node: int = 10, max_depth: int = 32):
+        self.version = version
+        self.max_per_node = max_per_node
+        self.max_depth = max_depth
+        self.root = _TrieNode()
+
+        valid_books = [book for book in books if book.get('bookId')]
+        valid_books.sort(key=_recency, reverse=True)
+        self.entries = [
+            {"bookId": book.get('bookId'), "title": book.get('title'), "author": book.get('author')}
+            for book in valid_books
+        ]
+        # 子串补充匹配用的规范化书名/作者，下标与 entries 一致
+        self._haystacks = [
+            _normalize(book.get('title') or '') + '\n' + _normalize(book.get('author') or '')
+            for book in valid_books
+        ]
+
+        for idx, book in enumerate(valid_books):
+            for key in self._keys_for(book):
+                self._insert(key, idx)
+
+    def _keys_for(self, book: Dict) -> set:
+        title = book.get('title') or ''
+        author = book.get('author') or ''
+        keys = {_normalize(title), _normalize(author)}
+
+        # 书名/作者中的各个片段，例如 "SRE：Google运维解密" 可以通过 "google" 命中
+        for part in _SPLIT_RE.split(title) + _SPLIT_RE.split(author):
+            keys.add(_normalize(part))
+
+        if lazy_pinyin is not None and _CJK_RE.search(title):
+            syllables = [syllable for syllable in lazy_pinyin(title) if syllable.strip()]
+            keys.add(_normalize(''.join(syllables)))
+            keys.add(_normalize(''.join(syllable[0] for syllable in syllables)))
+
+        keys.discard('')
+        return keys
+
+    def _insert(self, key: str, idx: int) -> None:
+        node = self.root
+        for char in key[:self.max_depth]:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _TrieNode()
+            node = child
+            # 同一本书的多个key可能经过同一节点；按插入顺序即为阅读时间顺序
+            if len(node.top) < self.max_per_node and (not node.top or node.top[-1] != idx):
+                node.top.append(idx)
+
+    def lookup(self, query: str, limit: int = 5) -> List[Dict]:
+        normalized = _normalize(query)
+        node = self.root
+        for char in normalized[:self.max_depth]:
+            node = node.children.get(char)
+            if node is None:
+                break
+        hits = node.top[:limit] if node is not None else []
+
+        if len(hits) < limit and normalized:
+            seen = set(hits)
+            for idx, haystack in enumerate(self._haystacks):
+                if idx not in seen and normalized in haystack:
+                    hits.append(idx)
+                    if len(hits) >= limit:
+                        break
+        return [self.entries[idx] for idx in hits]
+
+
+class TypeaheadRegistry:
+    """按用户缓存 TypeaheadIndex；书架版本变化时在后台线程重建，重建期间继续使用旧索引"""
+
+    def __init__(self):
+        self._indexes: Dict[int, TypeaheadIndex] = {}
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="typeahead")
+
+    def get(self, user_id: int, version: int, books: Optional[List[Dict]] = None) -> Optional[TypeaheadIndex]:
+        """
+        获取用户的索引
+        没有任何索引时用传入的 books 同步构建；索引过期时返回旧索引并安排后台重建
+        """
+        index = self._indexes.get(user_id)
+        record_cache("typeahead", index is not None and index.version >= version)
+        if index is None:
+            if books is None:
+                return None
+            index = TypeaheadIndex(books, version)
+            self._indexes[user_id] = index
+        elif index.version < version:
+            self.schedule_rebuild(user_id)
+        return index
+
+    def schedule_rebuild(self, user_id: int, books: Optional[List[Dict]] = None, version: int = 0) -> None:
+        with self._lock:
+            if user_id in self._pending:
+                return
+            self._pending.add(user_id)
+        self._executor.submit(self._rebuild, user_id, books, version)
+
+    def invalidate(self, user_id: int) -> None:
+        self._indexes.pop(user_id, None)
+
+    def _rebuild(self, user_id: int, books: Optional[List[Dict]], version: int) -> None:
+        try:
+            if books is None:
+                db = SessionLocal()
+                try:
+                    version = get_shelf_version(db, user_id)
+                    user_books = db.query(UserBooks).filter(UserBooks.user_id == user_id).first()
+                    books_data = user_books.books_data if user_books else None
+                    books = books_data.get('books', []) if isinstance(books_data, dict) else []
+                finally:
+                    db.close()
+
+            current = self._indexes.get(user_id)
+            if current is None or current.version < version:
+                self._indexes[user_id] = TypeaheadIndex(books, version)
+                print(f"🔤 搜索建议索引已重建: user_id={user_id}, version={version}, {len(books)} 本书")
+        except Exception as e:
+            print(f"⚠️ 搜索建议索引重建失败 user_id={user_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(user_id)
+
+
+# 全局搜索建议索引实例
+typeahead_registry = TypeaheadRegistry()
+
+
+@on_shelf_change
+def _rebuild_typeahead_on_shelf_change(db, user_id: int, old_data, new_data: Dict, version: int) -> None:
+    books = new_data.get('books', []) if isinstance(new_data, dict) else []
+    typeahead_registry.schedule_rebuild(user_id, books, version)
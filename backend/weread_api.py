@@ -1,41 +1,102 @@
 import requests
+import requests.adapters
+import http.cookiejar
 import json
 import time
-from typing import Dict, List, Optional, Tuple
-from collections import defaultdict
+import heapq
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import note_assembly
 try:
     import markdown2
 except ImportError:
     print("Warning: markdown2 not installed, markdown features will be limited")
     markdown2 = None
 
+try:
+    # rapidfuzz 在C层批量打分并释放GIL，优先使用
+    from rapidfuzz import fuzz as rf_fuzz, process as rf_process
+    import numpy as np
+except ImportError:
+    rf_fuzz = None
+    rf_process = None
+    np = None
+
 try:
     from config import settings
 except ImportError:
     from config_simple import settings
 
+from credentials import credential_manager
+import metrics
+
 
 class CookieExpiredException(Exception):
     """Cookie过期异常"""
     pass
 
+
+def _host(url: str) -> str:
+    """URL中的主机名（含端口），用于请求头的 Host"""
+    return url.split('://', 1)[-1].split('/', 1)[0]
+
+
+def _endpoint_name(url: str) -> str:
+    """URL路径的最后一段（如 bookmarklist、chapterInfos、syncBook），作为未命名请求的指标接口名"""
+    path = url.split('?', 1)[0].rstrip('/')
+    return path.rsplit('/', 1)[-1] or 'root'
+
 requests.packages.urllib3.disable_warnings()
 
+
+def create_http_session(pool_size: Optional[int] = None) -> requests.Session:
+    """
+    创建带连接池的HTTP会话，所有WeReadAPI实例共用，复用到微信读书的keep-alive连接
+    Cookie由每个请求的请求头显式携带，会话本身不保存响应设置的Cookie，避免在用户之间串用
+    """
+    pool_size = pool_size or settings.weread_http_pool_size
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+http_session = create_http_session()
+
+# 书架搜索的字段权重：书名完全命中100分，作者、分类命中按比例折算
+SEARCH_FIELD_WEIGHTS = {'title': 1.0, 'author': 0.9, 'category': 0.7}
+
 class WeReadAPI:
-    def __init__(self, cookies: str):
+    def __init__(self, cookies: str, session: Optional[requests.Session] = None):
         """
         初始化微信读书API客户端
         参考 wereader 项目，支持自动获取的cookie
 
         Args:
             cookies: cookie字符串，格式为 "key1=value1; key2=value2"
+            session: HTTP会话，默认使用共享的连接池会话
         """
+        self.session = session or http_session
         # 对cookie字符串进行编码处理，确保HTTP头部兼容
         self.cookies = self._safe_encode_cookies(cookies)
+        self._build_headers()
+
+    @property
+    def credential_key(self) -> Tuple[str, str]:
+        """(wr_vid, wr_skey)，凭证失效标记和续期以此为键"""
+        return self._credential_key
+
+    def _build_headers(self) -> None:
+        """按当前cookie构建各类请求头"""
+        cookie_values = dict(
+            item.strip().split('=', 1) for item in self.cookies.split(';') if '=' in item
+        )
+        self._credential_key = (cookie_values.get('wr_vid', ''), cookie_values.get('wr_skey', ''))
 
         # Web端请求头 - 模拟浏览器行为，用于访问网页端点
         self.headers_web = {
-            'Host': 'weread.qq.com',
+            'Host': _host(settings.weread_web_url),
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1',
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36',
@@ -50,12 +111,12 @@ class WeReadAPI:
             'Sec-Fetch-Site': 'same-origin',
             'Sec-Fetch-User': '?1',
             'Cookie': self.cookies,
-            'Referer': 'https://weread.qq.com/'
+            'Referer': f'{settings.weread_web_url}/'
         }
 
         # API请求头 - 用于访问API端点
         self.headers = {
-            'Host': 'i.weread.qq.com',
+            'Host': _host(settings.weread_base_url),
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1',
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:106.0) Gecko/20100101 Firefox/106.0',
@@ -70,7 +131,7 @@ class WeReadAPI:
             'Accept': 'application/json, text/plain, */*',
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/73.0.3683.103 Safari/537.36',
             'Content-Type': 'application/json;charset=UTF-8',
-            'Origin': 'https://weread.qq.com',
+            'Origin': settings.weread_web_url,
             'Sec-Fetch-Site': 'same-origin',
             'Sec-Fetch-Mode': 'cors',
             'Sec-Fetch-Dest': 'empty',
@@ -117,9 +178,101 @@ class WeReadAPI:
             # 如果编码失败，返回原始字符串
             return cookies
 
+    def apply_skey(self, wr_skey: str) -> None:
+        """换用续期得到的 wr_skey，重建cookie和请求头"""
+        if wr_skey == self._credential_key[1]:
+            return
+        pairs = []
+        for item in self.cookies.split(';'):
+            key = item.strip().split('=', 1)[0]
+            pairs.append(f"wr_skey={wr_skey}" if key == 'wr_skey' else item.strip())
+        self.cookies = '; '.join(pairs)
+        self._build_headers()
+
+    def _with_current_cookies(self, kwargs: Dict, sent_cookies: str) -> Dict:
+        """请求头中携带的是旧cookie时替换为当前cookie（发起请求前凭证已被续期）"""
+        headers = kwargs.get('headers')
+        if headers and headers.get('Cookie') == sent_cookies and sent_cookies != self.cookies:
+            kwargs = dict(kwargs, headers=dict(headers, Cookie=self.cookies))
+        return kwargs
+
+    def _send(self, method: str, url: str, endpoint: str, **kwargs) -> requests.Response:
+        """发送一次请求并记录耗时、状态码和响应大小"""
+        start = time.perf_counter()
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except requests.exceptions.Timeout:
+            metrics.observe_upstream(endpoint, method, "timeout", time.perf_counter() - start)
+            raise
+        except Exception:
+            metrics.observe_upstream(endpoint, method, "error", time.perf_counter() - start)
+            raise
+        metrics.observe_upstream(endpoint, method, str(r.status_code), time.perf_counter() - start, len(r.content))
+        return r
+
+    def _request(self, method: str, url: str, endpoint: Optional[str] = None, **kwargs) -> requests.Response:
+        """
+        通过连接池会话发送请求
+
+        凭证已判定失效时不发请求直接抛出 CookieExpiredException；网页端接口第一次返回401时
+        尝试用 wr_rt 续期并重试一次，续期失败则标记失效（i.weread.qq.com 的旧接口不使用网页Cookie鉴权，
+        其401不作为凭证失效的依据）
+
+        Args:
+            endpoint: 指标中的接口名，默认取URL路径的最后一段
+        """
+        endpoint = endpoint or _endpoint_name(url)
+        key = self._credential_key
+        if credential_manager.is_expired(key):
+            metrics.record_short_circuit(endpoint)
+            raise CookieExpiredException("Cookie已过期，请重新登录")
+        sent_cookies = self.cookies
+        renewed = credential_manager.renewed_skey(key)
+        if renewed:
+            self.apply_skey(renewed)
+            kwargs = self._with_current_cookies(kwargs, sent_cookies)
+
+        r = self._send(method, url, endpoint, **kwargs)
+        if r.status_code != 401 or not url.startswith(settings.weread_web_url):
+            return r
+
+        sent_cookies = self.cookies
+        if credential_manager.handle_unauthorized(self):
+            r = self._send(method, url, endpoint, **self._with_current_cookies(kwargs, sent_cookies))
+            if r.status_code != 401:
+                return r
+            credential_manager.mark_expired(self._credential_key)
+        raise CookieExpiredException("Cookie已过期，请重新登录")
+
+    def renew_session(self) -> Optional[str]:
+        """
+        用cookie中的 wr_rt 请求网页端续期接口
+
+        Returns:
+            新的 wr_skey；续期失败时返回 None
+        """
+        try:
+            r = self._send(
+                'POST',
+                f"{settings.weread_web_url}/web/login/renewal",
+                "login_renewal",
+                headers=self.headers_post,
+                json={"rq": "%2Fweb%2Fbook%2Fread", "ql": True},
+                verify=False,
+                timeout=10
+            )
+            # 会话的cookie jar不保存Cookie，新的 wr_skey 从本次响应中读取
+            new_skey = r.cookies.get('wr_skey')
+            if r.status_code == 200 and new_skey:
+                return new_skey
+            print(f"⚠️ 凭证续期失败: {r.status_code}")
+        except Exception as e:
+            print(f"⚠️ 凭证续期出错: {e}")
+        return None
+
     def request_data(self, url: str) -> Dict:
         """Request data from WeRead API"""
-        r = requests.get(url, headers=self.headers, verify=False)
+        r = self._request('GET', url, headers=self.headers, verify=False)
         if r.ok:
             return r.json()
         else:
@@ -134,8 +287,10 @@ class WeReadAPI:
             print("🔍 验证登录状态: 检查网页访问权限")
 
             # 只验证最基本的网页访问权限
-            r = requests.get(
+            r = self._request(
+                'GET',
                 f"{settings.weread_web_url}/web/shelf",
+                endpoint="web_shelf_check",
                 headers=self.headers_web,
                 verify=False,
                 timeout=10
@@ -228,15 +383,19 @@ class WeReadAPI:
                 headers = api_config.get('headers', self.headers)
 
                 if api_config['method'] == 'GET':
-                    r = requests.get(
+                    r = self._request(
+                        'GET',
                         api_config['url'],
+                        endpoint=api_config['name'],
                         headers=headers,
                         verify=False,
                         timeout=api_config['timeout']
                     )
                 else:
-                    r = requests.post(
+                    r = self._request(
+                        'POST',
                         api_config['url'],
+                        endpoint=api_config['name'],
                         headers=headers,
                         verify=False,
                         timeout=api_config['timeout']
@@ -303,6 +462,8 @@ class WeReadAPI:
                     last_error = Exception(error_msg)
                     continue
 
+            except CookieExpiredException:
+                raise
             except requests.exceptions.Timeout:
                 print(f"⚠️ 请求超时: {api_config['name']}")
                 continue
@@ -400,8 +561,8 @@ class WeReadAPI:
                         book_id = book["bookId"].strip()
                         raw_books_dict[book_id] = book
 
-            # 2. 从 rawIndexes 中提取所有书籍ID（这可能包含更完整的列表）
-            all_book_ids_from_indexes = set()
+            # 2. 从 rawIndexes 中按书架顺序提取所有书籍ID（这可能包含更完整的列表）
+            all_book_ids_from_indexes = {}
             if raw_indexes:
                 for index_item in raw_indexes:
                     if isinstance(index_item, dict):
@@ -414,36 +575,28 @@ class WeReadAPI:
                             isinstance(book_id, str) and
                             book_id.strip() != "" and
                             book_id not in ["undefined", "null", "None"]):
-                            all_book_ids_from_indexes.add(book_id.strip())
+                            all_book_ids_from_indexes.setdefault(book_id.strip(), None)
 
             print(f"📋 从 rawIndexes 提取到 {len(all_book_ids_from_indexes)} 个书籍ID")
 
-            # 3. 合并两个数据源的书籍ID
-            all_book_ids = set()
-
-            # 从 rawBooks 中获取ID
-            for book_id in raw_books_dict.keys():
-                all_book_ids.add(book_id)
-
-            # 从 rawIndexes 中获取ID
-            all_book_ids.update(all_book_ids_from_indexes)
+            # 3. 合并两个数据源的书籍ID：rawIndexes 的书架顺序在前，只出现在 rawBooks 中的按原顺序排在后面
+            all_book_ids = list(all_book_ids_from_indexes)
+            all_book_ids.extend(book_id for book_id in raw_books_dict if book_id not in all_book_ids_from_indexes)
 
             print(f"🔗 合并后总共有 {len(all_book_ids)} 个唯一书籍ID")
 
-            # 4. 按优先级提取书籍信息：先处理有完整信息的，再处理只有ID的
+            # 4. 按书架顺序提取书籍信息：rawBooks 中有完整信息的直接使用，只有ID的需要后续通过syncBook获取详情
+            # 占位书籍和完整书籍保持同一个顺序，补全前后分页位置不变
             books_with_full_info = []
             books_with_partial_info = []
 
-            # 首先添加所有有完整信息的书籍（来自rawBooks）
             for book_id in all_book_ids:
                 if book_id in raw_books_dict:
                     book_data = raw_books_dict[book_id]
                     normalized_book = self._normalize_book_data_from_html(book_data, "rawBooks")
                     books_with_full_info.append(normalized_book)
-
-            # 然后添加只有ID的书籍（需要后续通过syncBook获取详情）
-            for book_id in all_book_ids:
-                if book_id not in raw_books_dict:
+                    books.append(normalized_book)
+                else:
                     basic_book = {
                         "bookId": book_id,
                         "title": f"书籍_{book_id}",
@@ -457,10 +610,7 @@ class WeReadAPI:
                         "needsDetailFetch": True  # 标记需要获取详情
                     }
                     books_with_partial_info.append(basic_book)
-
-            # 按顺序合并：完整信息的在前，部分信息的在后
-            books.extend(books_with_full_info)
-            books.extend(books_with_partial_info)
+                    books.append(basic_book)
 
             print(f"✅ 成功提取 {len(books)} 本书籍")
             print(f"   📖 完整信息: {len(books_with_full_info)} 本")
@@ -962,8 +1112,10 @@ class WeReadAPI:
         for api_config in fallback_apis:
             try:
                 print(f"🔄 获取书籍信息: {book_id} - {api_config['name']}")
-                r = requests.get(
+                r = self._request(
+                    'GET',
                     api_config['url'],
+                    endpoint=api_config['name'],
                     headers=api_config['headers'],
                     verify=False,
                     timeout=api_config['timeout']
@@ -1020,25 +1172,11 @@ class WeReadAPI:
                     error_msg = f"获取书籍信息失败 {r.status_code}: {book_id}"
                     print(f"⚠️ {error_msg}")
                     last_error = Exception(error_msg)
-                    
-                    # 对于401认证错误，直接返回基础信息，避免继续尝试
-                    if r.status_code == 401:
-                        print(f"🔐 认证失败，返回基础书籍信息: {book_id}")
-                        return {
-                            "bookId": book_id,
-                            "title": "需要重新登录获取",
-                            "author": "未知",
-                            "cover": "",
-                            "intro": "请重新登录以获取完整书籍信息",
-                            "category": "",
-                            "publisher": "",
-                            "finishReading": 0,
-                            "newRatingDetail": {"title": ""},
-                            "error": "认证失败",
-                            "source": "auth_error"
-                        }
                     continue
 
+            except CookieExpiredException:
+                # 凭证失效时不再尝试其他接口，也不返回占位的书籍信息
+                raise
             except Exception as e:
                 print(f"⚠️ 获取书籍信息出错: {book_id} - {e}")
                 last_error = e
@@ -1073,7 +1211,7 @@ class WeReadAPI:
             return []  # WeChat articles not supported
 
         # 使用官方的POST请求格式获取章节信息
-        url = f"https://weread.qq.com/web/book/chapterInfos"
+        url = f"{settings.weread_web_url}/web/book/chapterInfos"
 
         # 构建POST请求头
         headers = {
@@ -1083,10 +1221,10 @@ class WeReadAPI:
             'Cache-Control': 'no-cache',
             'Connection': 'keep-alive',
             'Content-Type': 'application/json',
-            'Host': 'weread.qq.com',
-            'Origin': 'https://weread.qq.com',
+            'Host': _host(settings.weread_web_url),
+            'Origin': settings.weread_web_url,
             'Pragma': 'no-cache',
-            'Referer': f'https://weread.qq.com/web/reader/{book_id}',
+            'Referer': f'{settings.weread_web_url}/web/reader/{book_id}',
             'Sec-Fetch-Dest': 'empty',
             'Sec-Fetch-Mode': 'cors',
             'Sec-Fetch-Site': 'same-origin',
@@ -1100,8 +1238,7 @@ class WeReadAPI:
         }
 
         try:
-            import requests
-            response = requests.post(url, json=payload, headers=headers, verify=False, timeout=15)
+            response = self._request('POST', url, json=payload, headers=headers, verify=False, timeout=15)
 
             if response.status_code == 200:
                 data = response.json()
@@ -1127,10 +1264,20 @@ class WeReadAPI:
                 print(f"❌ 章节API返回错误: {response.status_code}")
                 return []
 
+        except CookieExpiredException:
+            raise
         except Exception as e:
             print(f"❌ 获取章节信息失败: {book_id} - {str(e)}")
             return []
 
+    def _filter_chapters(self, book_id: str, chapters: Optional[List[Tuple]], level_filter: int = None) -> List[Tuple]:
+        """使用已获取的章节列表按level过滤，未传入时请求章节接口"""
+        if chapters is None:
+            return self.get_sorted_chapters(book_id, level_filter=level_filter)
+        if level_filter is None:
+            return list(chapters)
+        return [chapter for chapter in chapters if chapter[1] == level_filter]
+
     def get_bookmarks(self, book_id: str, sync_key: str = "0") -> Dict:
         """Get bookmarks/notes for a book with fallback support and synckey"""
         # 构建与官方完全一致的请求头
@@ -1140,9 +1287,9 @@ class WeReadAPI:
             'Accept-Language': 'zh-CN,zh;q=0.9',
             'Cache-Control': 'no-cache',
             'Connection': 'keep-alive',
-            'Host': 'weread.qq.com',
+            'Host': _host(settings.weread_web_url),
             'Pragma': 'no-cache',
-            'Referer': f'https://weread.qq.com/web/reader/{book_id}',
+            'Referer': f'{settings.weread_web_url}/web/reader/{book_id}',
             'Sec-Fetch-Dest': 'empty',
             'Sec-Fetch-Mode': 'cors',
             'Sec-Fetch-Site': 'same-origin',
@@ -1150,18 +1297,18 @@ class WeReadAPI:
             'Cookie': self.cookies
         }
 
-        # 使用官方接口URL，笔记API必须使用 weread.qq.com 域名
+        # 使用官方接口URL，笔记API必须使用网页端域名（weread_web_url）
         fallback_urls = [
-            f"https://weread.qq.com/web/book/bookmarklist?bookId={book_id}&syncKey={sync_key}",
-            f"https://weread.qq.com/book/bookmarklist?bookId={book_id}",
-            f"https://weread.qq.com/web/book/bookmarklist?bookId={book_id}"
+            ("bookmarklist", f"{settings.weread_web_url}/web/book/bookmarklist?bookId={book_id}&syncKey={sync_key}"),
+            ("bookmarklist_legacy", f"{settings.weread_web_url}/book/bookmarklist?bookId={book_id}"),
+            ("bookmarklist_full", f"{settings.weread_web_url}/web/book/bookmarklist?bookId={book_id}")
         ]
 
         last_error = None
-        for url in fallback_urls:
+        for name, url in fallback_urls:
             try:
                 print(f"🔄 获取书签: {book_id} - {url.split('/')[-1]}")
-                r = requests.get(url, headers=bookmark_headers, verify=False, timeout=15)
+                r = self._request('GET', url, endpoint=name, headers=bookmark_headers, verify=False, timeout=15)
 
                 if r.status_code == 200:
                     try:
@@ -1204,6 +1351,8 @@ class WeReadAPI:
                     last_error = Exception(error_msg)
                     continue
 
+            except CookieExpiredException:
+                raise
             except Exception as e:
                 print(f"⚠️ 获取书签出错: {book_id} - {e}")
                 last_error = e
@@ -1217,6 +1366,33 @@ class WeReadAPI:
             "error": f"无法获取书签: {str(last_error) if last_error else '未知错误'}"
         }
 
+    def get_notebooks(self) -> List[Dict]:
+        """
+        获取有笔记（划线/想法/书评）的书籍列表
+
+        Returns:
+            [{"bookId", "book": {...}, "noteCount", "reviewCount", "bookmarkCount"}, ...]
+        """
+        url = f"{settings.weread_web_url}/api/user/notebook"
+        print("🔄 获取笔记本列表")
+        r = self._request('GET', url, headers=self.headers_web, verify=False, timeout=15)
+        if r.status_code == 401:
+            raise CookieExpiredException("Cookie已过期，请重新登录")
+        if r.status_code != 200:
+            raise Exception(f"获取笔记本列表失败 {r.status_code}")
+
+        data = r.json()
+        if isinstance(data, dict) and data.get('errcode') == -2012:
+            credential_manager.mark_expired(self.credential_key)
+            raise CookieExpiredException("Cookie已过期，请重新登录")
+
+        notebooks = [
+            notebook for notebook in (data.get('books') or [] if isinstance(data, dict) else [])
+            if notebook.get('bookId')
+        ]
+        print(f"✅ 笔记本列表获取成功: {len(notebooks)} 本")
+        return notebooks
+
     def get_sorted_contents_from_data(self, data: Dict) -> Dict:
         """Process bookmark data and sort by chapter and position"""
         book_id = data['book']['bookId']
@@ -1225,21 +1401,12 @@ class WeReadAPI:
         if '_' in book_id:
             return {}  # Simplified for now
 
-        contents = defaultdict(list)
-
-        for item in data['updated']:
-            chapter_uid = item['chapterUid']
-            text = item['markText']
-            text_position = int(item['range'].split('-')[0])
-            text_style = item['style']
-            contents[chapter_uid].append([text_position, text_style, text])
-
-        # Sort contents by position within each chapter
-        sorted_contents = defaultdict(list)
-        for chapter_uid in contents.keys():
-            sorted_contents[chapter_uid] = sorted(contents[chapter_uid], key=lambda x: x[0])
-
-        return sorted_contents
+        # 位置解析和排序由笔记组装统一完成
+        grouped = note_assembly.assemble_notes(data['updated'])
+        return {
+            chapter_uid: [[start, item['style'], item['markText']] for start, _, item in notes]
+            for chapter_uid, notes in grouped.items()
+        }
 
     def set_content_style(self, style: int, text: str) -> str:
         """Apply styling to content based on highlight style"""
@@ -1282,7 +1449,8 @@ class WeReadAPI:
             print(f"🔄 同步 {len(book_ids)} 本书籍的详细信息")
 
             # 使用 POST 方法发送请求
-            r = requests.post(
+            r = self._request(
+                'POST',
                 url,
                 headers=self.headers_post,
                 json=payload,
@@ -1314,14 +1482,12 @@ class WeReadAPI:
                     print(f"⚠️ syncBook 返回的不是有效JSON: {json_error}")
                     return {'books': [], 'bookProgress': [], 'error': 'JSON解析失败'}
 
-            elif r.status_code == 401:
-                print(f"🔐 syncBook 认证失败，可能需要重新登录")
-                return {'books': [], 'bookProgress': [], 'error': '认证失败'}
-
             else:
                 print(f"⚠️ syncBook 请求失败，状态码: {r.status_code}")
                 return {'books': [], 'bookProgress': [], 'error': f'请求失败: {r.status_code}'}
 
+        except CookieExpiredException:
+            raise
         except requests.exceptions.Timeout:
             print("⚠️ syncBook 请求超时")
             return {'books': [], 'bookProgress': [], 'error': '请求超时'}
@@ -1334,11 +1500,23 @@ class WeReadAPI:
             print(f"⚠️ syncBook 调用出错: {e}")
             return {'books': [], 'bookProgress': [], 'error': str(e)}
 
-    def get_user_data_enhanced(self, user_vid: str) -> Dict:
+    def get_user_data_enhanced(self, user_vid: str,
+                               progress_callback: Optional[Callable[[str, Dict], None]] = None) -> Dict:
         """
         增强版获取用户数据方法
         首先从 HTML 中获取所有 bookId，然后使用 syncBook 获取完整信息
+
+        Args:
+            progress_callback: 进度回调 callback(stage, info)，stage 为 html_fetched / batch_synced
         """
+        def report(stage: str, **info) -> None:
+            if progress_callback is None:
+                return
+            try:
+                progress_callback(stage, info)
+            except Exception as e:
+                print(f"⚠️ 进度回调出错: {e}")
+
         try:
             # 1. 先通过 HTML 解析获取所有书籍ID
             print("📋 第一步: 获取书架HTML数据")
@@ -1371,6 +1549,11 @@ class WeReadAPI:
             print(f"   📖 已有完整信息: {len(books_with_full_info)} 本")
             print(f"   🔄 需要获取详情: {len(books_need_details)} 本")
 
+            batch_size = 250  # 每批处理250本书，提高效率
+            total_batches = (len(books_need_details) + batch_size - 1) // batch_size
+            report('html_fetched', total=len(books_from_html), rawbooks=len(books_with_full_info),
+                   need_details=len(books_need_details), batches=total_batches)
+
             # 3. 如果有需要获取详情的书籍，使用 syncBook 批量获取
             synced_books = []
             all_book_progress = []
@@ -1378,7 +1561,6 @@ class WeReadAPI:
             if books_need_details:
                 print(f"🔄 开始为 {len(books_need_details)} 本书籍获取详细信息")
 
-                batch_size = 250  # 每批处理250本书，提高效率
                 for i in range(0, len(books_need_details), batch_size):
                     batch_ids = books_need_details[i:i + batch_size]
                     print(f"   处理第 {i//batch_size + 1} 批，包含 {len(batch_ids)} 本书")
@@ -1391,6 +1573,9 @@ class WeReadAPI:
                     if sync_result.get('bookProgress'):
                         all_book_progress.extend(sync_result['bookProgress'])
 
+                    report('batch_synced', batch=i // batch_size + 1, batches=total_batches,
+                           synced=len(synced_books), need_details=len(books_need_details))
+
                     # 短暂延迟，避免请求过于频繁（减少延迟提高效率）
                     import time
                     time.sleep(0.2)
@@ -1470,53 +1655,15 @@ class WeReadAPI:
 
             # 获取章节信息
             sorted_chapters = self.get_sorted_chapters(book_id)
-            chapter_map = {chapter[0]: chapter[2] for chapter in sorted_chapters}
 
             # 处理书签数据
             updated_bookmarks = bookmarks_data.get('updated', [])
             removed_bookmarks = bookmarks_data.get('removed', [])
 
-            # 按章节组织书签
-            chapter_bookmarks = {}
-
-            for bookmark in updated_bookmarks:
-                chapter_uid = bookmark.get('chapterUid')
-                if chapter_uid not in chapter_bookmarks:
-                    chapter_bookmarks[chapter_uid] = []
-                chapter_bookmarks[chapter_uid].append(bookmark)
-
-            # 生成Markdown内容
-            markdown_lines = []
-
-            for chapter in sorted_chapters:
-                chapter_uid, level, title = chapter
-                bookmarks = chapter_bookmarks.get(chapter_uid, [])
-
-                # 如果选择只显示有笔记的章节且当前章节没有笔记，则跳过
-                if is_all_chapter == 2 and not bookmarks:
-                    continue
-
-                # 添加章节标题
-                markdown_lines.append(f"{'#' * (level + 1)} {title}")
-                markdown_lines.append("")
-
-                # 添加该章节的书签
-                for bookmark in sorted(bookmarks, key=lambda x: x.get('range', '')):
-                    # 添加标注内容
-                    marked_text = bookmark.get('markText', '').strip()
-                    if marked_text:
-                        markdown_lines.append(marked_text)
-                        markdown_lines.append("")
-
-                    # 添加笔记内容
-                    note_text = bookmark.get('noteText', '').strip()
-                    if note_text:
-                        markdown_lines.append(f"**笔记：** {note_text}")
-                        markdown_lines.append("")
-
-                markdown_lines.append("")
-
-            markdown_content = '\n'.join(markdown_lines)
+            grouped = note_assembly.assemble_notes(updated_bookmarks)
+            markdown_content = '\n'.join(
+                note_assembly.iter_markdown_chapters(sorted_chapters, grouped, is_all_chapter == 2)
+            )
 
             return {
                 "markdown_content": markdown_content,
@@ -1536,153 +1683,186 @@ class WeReadAPI:
                 "error": str(e)
             }
 
-    def get_markdown_content_simple(self, book_id: str, is_all_chapter: int = 1) -> str:
+    def get_markdown_content_simple(self, book_id: str, is_all_chapter: int = 1,
+                                    bookmarks_data: Optional[Dict] = None,
+                                    chapters: Optional[List[Tuple]] = None) -> str:
         """
         简单获取书籍笔记的Markdown内容，不使用增量同步
         直接返回markdown字符串
+
+        Args:
+            bookmarks_data: 已获取的书签数据，传入时不再重复请求
+            chapters: 已获取的完整章节列表（未按level过滤），传入时不再重复请求
         """
         try:
-            # 获取书签数据 (使用默认synckey=0，获取所有数据)
-            bookmarks_data = self.get_bookmarks(book_id, "0")
+            result = '\n'.join(self.iter_markdown_chapters(book_id, is_all_chapter, bookmarks_data, chapters))
 
-            if not bookmarks_data:
+            if not result.strip():
+                print("⚠️ 未找到任何笔记内容")
                 return ""
 
-            # 使用新的章节信息API获取完整章节结构
-            if is_all_chapter == 1:
-                # 完整笔记：获取level=1的所有章节（主要章节）
-                sorted_chapters = self.get_sorted_chapters(book_id, level_filter=1)
-                print(f"📖 完整笔记模式：获取到 {len(sorted_chapters)} 个主要章节")
-            elif is_all_chapter == 2:
-                # 精选笔记：先获取所有章节，稍后只保留有笔记的章节
-                sorted_chapters = self.get_sorted_chapters(book_id, level_filter=1)
-                print(f"📖 精选笔记模式：获取到 {len(sorted_chapters)} 个主要章节")
-            else:
-                # 默认：获取所有章节
-                sorted_chapters = self.get_sorted_chapters(book_id)
-                print(f"📖 默认模式：获取到 {len(sorted_chapters)} 个章节")
-
-            # 处理书签数据 - 兼容不同的数据结构
-            all_bookmarks = []
-
-            # 检查是否有 'updated' 字段 (增量同步格式)
-            if 'updated' in bookmarks_data:
-                all_bookmarks = bookmarks_data.get('updated', [])
-            # 检查是否有 'bookmarks' 字段 (传统格式)
-            elif 'bookmarks' in bookmarks_data:
-                all_bookmarks = bookmarks_data.get('bookmarks', [])
-            # 检查是否直接是数组
-            elif isinstance(bookmarks_data, list):
-                all_bookmarks = bookmarks_data
-            else:
-                # 尝试从 data 字段获取
-                all_bookmarks = bookmarks_data.get('data', [])
+            return result
 
-            if not all_bookmarks:
-                return ""
+        except Exception as e:
+            print(f"❌ 获取Markdown内容失败: {str(e)}")
+            return ""
 
-            # 按章节组织书签
-            chapter_bookmarks = {}
+    def _assemble_note_chapters(self, book_id: str, is_all_chapter: int = 1,
+                                bookmarks_data: Optional[Dict] = None,
+                                chapters: Optional[List[Tuple]] = None) -> Optional[Tuple[List[Tuple], note_assembly.AssembledNotebook]]:
+        """
+        准备逐章节输出笔记所需的数据
+
+        Returns:
+            (章节列表, 组装好的笔记 AssembledNotebook)；没有书签时返回 None
+        """
+        # 获取书签数据 (使用默认synckey=0，获取所有数据)
+        if bookmarks_data is None:
+            bookmarks_data = self.get_bookmarks(book_id, "0")
+
+        if not bookmarks_data:
+            return None
+
+        # 使用新的章节信息API获取完整章节结构
+        if is_all_chapter == 1:
+            # 完整笔记：获取level=1的所有章节（主要章节）
+            sorted_chapters = self._filter_chapters(book_id, chapters, level_filter=1)
+            print(f"📖 完整笔记模式：获取到 {len(sorted_chapters)} 个主要章节")
+        elif is_all_chapter == 2:
+            # 精选笔记：先获取所有章节，稍后只保留有笔记的章节
+            sorted_chapters = self._filter_chapters(book_id, chapters, level_filter=1)
+            print(f"📖 精选笔记模式：获取到 {len(sorted_chapters)} 个主要章节")
+        else:
+            # 默认：获取所有章节
+            sorted_chapters = self._filter_chapters(book_id, chapters)
+            print(f"📖 默认模式：获取到 {len(sorted_chapters)} 个章节")
+
+        all_bookmarks = note_assembly.extract_bookmarks(bookmarks_data)
+        if not all_bookmarks:
+            return None
+
+        # 划线位置只解析一次，按章节分组并按数值位置排序；同一用户同一synckey的书签复用组装结果
+        sync_key = bookmarks_data.get('synckey') if isinstance(bookmarks_data, dict) else None
+        cache_key = (self.credential_key[0], book_id, sync_key) if sync_key else None
+        notebook = note_assembly.assembled_notebooks.assemble(cache_key, all_bookmarks)
+        chapters_with_notes = sum(1 for chapter in sorted_chapters if chapter[0] in notebook.grouped)
+        print(f"📝 笔记组装完成: {len(sorted_chapters)} 章节, {chapters_with_notes} 章节有笔记")
+        return sorted_chapters, notebook
+
+    def iter_markdown_chapters(self, book_id: str, is_all_chapter: int = 1,
+                               bookmarks_data: Optional[Dict] = None,
+                               chapters: Optional[List[Tuple]] = None,
+                               styled: bool = False) -> Iterator[str]:
+        """
+        逐章节生成笔记的Markdown片段，用 '\n' 连接即为完整内容
+        流式导出时每生成一章就可以发送，不需要先拼出整本书的笔记
 
-            for bookmark in all_bookmarks:
-                chapter_uid = bookmark.get('chapterUid')
-                if chapter_uid not in chapter_bookmarks:
-                    chapter_bookmarks[chapter_uid] = []
-                chapter_bookmarks[chapter_uid].append(bookmark)
+        Args:
+            styled: 按划线样式处理文字（set_content_style），默认原样输出
+        """
+        assembled = self._assemble_note_chapters(book_id, is_all_chapter, bookmarks_data, chapters)
+        if assembled is None:
+            return
+        sorted_chapters, notebook = assembled
+        mark_formatter = self.set_content_style if styled else None
+        yield from note_assembly.iter_markdown_chapters(
+            sorted_chapters, notebook.grouped, is_all_chapter == 2, mark_formatter,
+            notebook.segments('markdown', styled)
+        )
+
+    def iter_html_chapters(self, book_id: str, is_all_chapter: int = 1,
+                           bookmarks_data: Optional[Dict] = None,
+                           chapters: Optional[List[Tuple]] = None,
+                           styled: bool = False) -> Iterator[str]:
+        """
+        逐章节直接生成笔记的HTML片段（不经过Markdown再转换），参数同 iter_markdown_chapters
+        """
+        assembled = self._assemble_note_chapters(book_id, is_all_chapter, bookmarks_data, chapters)
+        if assembled is None:
+            return
+        sorted_chapters, notebook = assembled
+        yield from note_assembly.iter_html_chapters(
+            sorted_chapters, notebook.grouped, is_all_chapter == 2, styled, notebook.segments('html', styled)
+        )
+
+    def search_books(self, user_data: Dict, query: str, limit: Optional[int] = None) -> List[Dict]:
+        """
+        在用户书库中搜索书籍
+        参考 wereader 项目的搜索实现
 
-            # 生成Markdown内容
-            markdown_lines = []
-            processed_chapters = 0
-            chapters_with_notes = 0
+        Args:
+            limit: 只返回得分最高的前 limit 条结果，None 表示返回全部命中
+        """
+        results, _ = self.search_books_ranked(user_data, query, limit)
+        return results
 
-            for chapter in sorted_chapters:
-                chapter_uid, level, title = chapter
-                bookmarks = chapter_bookmarks.get(chapter_uid, [])
-                processed_chapters += 1
+    def search_books_ranked(self, user_data: Dict, query: str, limit: Optional[int] = None,
+                            weights: Optional[Dict[str, float]] = None) -> Tuple[List[Dict], int]:
+        """
+        对整个书架做一次批量模糊打分，再用堆选出 top-k
 
-                # 如果选择只显示有笔记的章节且当前章节没有笔记，则跳过
-                if is_all_chapter == 2 and not bookmarks:
-                    continue
+        Args:
+            weights: 各字段权重，书籍得分取各字段 partial_ratio × 权重 的最大值
 
-                # 添加章节标题
-                markdown_lines.append(f"{'#' * (level + 1)} {title}")
-                markdown_lines.append("")
-
-                # 添加该章节的书签
-                bookmark_count = 0
-                for bookmark in sorted(bookmarks, key=lambda x: x.get('range', '')):
-                    bookmark_count += 1
-                    # 添加标注内容
-                    marked_text = bookmark.get('markText', '').strip()
-                    if marked_text:
-                        markdown_lines.append(marked_text)
-                        markdown_lines.append("")
-
-                    # 添加笔记内容
-                    note_text = bookmark.get('noteText', '').strip()
-                    if note_text:
-                        markdown_lines.append(f"**笔记：** {note_text}")
-                        markdown_lines.append("")
-
-                if bookmarks:  # 只有当有书签时才添加空行
-                    chapters_with_notes += 1
-                    markdown_lines.append("")
-
-            print(f"📝 生成Markdown完成: 处理 {processed_chapters} 章节, {chapters_with_notes} 章节有笔记")
-            result = '\n'.join(markdown_lines)
+        Returns:
+            (按相关度排序的前 limit 条结果, 命中总数)
+        """
+        books = [book for book in user_data.get('books', []) if book.get('bookId')]
+        weights = weights or SEARCH_FIELD_WEIGHTS
 
-            if not result.strip():
-                print("⚠️ 未找到任何笔记内容")
-                return ""
+        scores = [0] * len(books)
+        for field, weight in weights.items():
+            values = [str(book.get(field, '') or '') for book in books]
+            field_scores = self._batch_partial_ratio(values, query)
+            scores = [max(current, round(score * weight)) for current, score in zip(scores, field_scores)]
 
-            return result
+        hits = [i for i, score in enumerate(scores) if score > 60]  # Lowered threshold for better results
+        total = len(hits)
 
-        except Exception as e:
-            print(f"❌ 获取Markdown内容失败: {str(e)}")
-            return ""
+        # heapq.nlargest 与稳定排序等价，同分时保持书架原有顺序
+        k = total if limit is None else min(limit, total)
+        top_indexes = heapq.nlargest(k, hits, key=scores.__getitem__)
 
-    def search_books(self, user_data: Dict, query: str) -> List[Dict]:
+        results = []
+        for i in top_indexes:
+            book = books[i]
+            results.append({
+                'bookId': book['bookId'],
+                'title': book.get('title', ''),
+                'author': book.get('author', ''),
+                'cover': book.get('cover', '').replace('s_', 't7_'),
+                'category': book.get('category', ''),
+                'finishReading': book.get('finishReading', 0),
+                'ratio': scores[i]
+            })
+        return results, total
+
+    def _batch_partial_ratio(self, titles: List[str], query: str) -> List[int]:
         """
-        在用户书库中搜索书籍
-        参考 wereader 项目的搜索实现
+        批量计算 partial_ratio 得分（0-100 的整数）
+        优先 rapidfuzz.cdist（多线程、释放GIL），其次 fuzzywuzzy 逐条计算，最后退化为子串匹配
         """
+        if not titles:
+            return []
+
+        if rf_process is not None:
+            matrix = rf_process.cdist(
+                [query], titles,
+                scorer=rf_fuzz.partial_ratio,
+                dtype=np.float32,
+                workers=-1
+            )
+            return np.rint(matrix[0]).astype(int).tolist()
+
         try:
             from fuzzywuzzy import fuzz
         except ImportError:
-            print("Warning: fuzzywuzzy not installed, using simple string matching")
-            # 简单的字符串匹配作为fallback
-            results = []
-            for book in user_data.get('books', []):
-                title = book.get('title', '')
-                if query.lower() in title.lower():
-                    results.append({
-                        'bookId': book['bookId'],
-                        'title': title,
-                        'author': book.get('author', ''),
-                        'cover': book.get('cover', '').replace('s_', 't7_'),
-                        'ratio': 80  # 固定评分
-                    })
-            return results
+            print("Warning: rapidfuzz/fuzzywuzzy not installed, using simple string matching")
+            query_lower = query.lower()
+            return [80 if query_lower in title.lower() else 0 for title in titles]  # 固定评分
 
-        results = []
+        return [fuzz.partial_ratio(title, query) for title in titles]
 
-        for book in user_data.get('books', []):
-            title = book.get('title', '')
-            ratio = fuzz.partial_ratio(title, query)
-
-            if ratio > 60:  # Lowered threshold for better results
-                results.append({
-                    'bookId': book['bookId'],
-                    'title': title,
-                    'author': book.get('author', ''),
-                    'cover': book.get('cover', '').replace('s_', 't7_'),
-                    'ratio': ratio
-                })
-
-        # Sort by relevance
-        results.sort(key=lambda x: x['ratio'], reverse=True)
-        return results
-    
     @staticmethod
     def format_cookies_from_dict(cookie_dict: Dict) -> str:
         """
@@ -0,0 +1,122 @@
+# 按用户缓存的WeReadAPI客户端：Cookie编码和请求头只在凭证变化时构建一次，请求热路径上只是一次字典查找
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from metrics import record_cache
+from models import User
+from weread_api import WeReadAPI
+
+try:
+    from config import settings
+except ImportError:
+    from config_simple import settings
+
+
+def get_user_cookies(user: User) -> str:
+    """Get formatted cookie string for user"""
+    cookies = {
+        'wr_gid': user.wr_gid,
+        'wr_vid': user.wr_vid,
+        'wr_skey': user.wr_skey,
+        'wr_pf': '0',
+        'wr_rt': user.wr_rt,
+        'wr_localvid': user.wr_localvid or '',
+        'wr_name': user.wr_name or '',
+        'wr_avatar': user.wr_avatar or '',
+        'wr_gender': user.wr_gender or ''
+    }
+    return '; '.join([f'{key}={value}' for key, value in cookies.items()])
+
+
+class WeReadClientRegistry:
+    """
+    以Cookie字符串为键的LRU客户端缓存
+    凭证变化后Cookie字符串随之变化，自然不会命中旧客户端；同时记录每个用户当前的键，
+    以便凭证更新时立即丢弃旧客户端
+
+    get(user) 的快速路径只比较 (wr_skey, wr_rt)：ORM属性读取远比字典查找慢，
+    不必每次都读全部Cookie字段再拼接字符串
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._clients: "OrderedDict[str, WeReadAPI]" = OrderedDict()
+        self._user_keys: Dict[int, str] = {}
+        # user_id -> ((wr_skey, wr_rt), Cookie字符串, 客户端)
+        self._user_clients: Dict[int, Tuple[Tuple[str, str], str, WeReadAPI]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user: User) -> WeReadAPI:
+        """用户当前凭证对应的客户端"""
+        user_id = user.id
+        fingerprint = (user.wr_skey, user.wr_rt)
+        entry = self._user_clients.get(user_id)
+        if entry is not None and entry[0] == fingerprint:
+            record_cache("weread_client", True)
+            return entry[2]
+
+        record_cache("weread_client", False)
+        cookies = get_user_cookies(user)
+        client = self.for_cookies(cookies, user_id)
+        with self._lock:
+            if self._user_keys.get(user_id) == cookies:
+                self._user_clients[user_id] = (fingerprint, cookies, client)
+        return client
+
+    def for_cookies(self, cookies: str, user_id: Optional[int] = None) -> WeReadAPI:
+        """
+        Cookie字符串对应的客户端（后台任务只持有Cookie字符串时使用）
+
+        Args:
+            user_id: 传入时记录为该用户的当前客户端，并丢弃该用户旧凭证的客户端
+        """
+        with self._lock:
+            client = self._clients.get(cookies)
+            if client is not None:
+                self._clients.move_to_end(cookies)
+                if user_id is None or self._user_keys.get(user_id) == cookies:
+                    return client
+
+        if client is None:
+            # 在锁外构建，Cookie编码和请求头构建不阻塞其他用户
+            client = WeReadAPI(cookies)
+
+        with self._lock:
+            client = self._clients.setdefault(cookies, client)
+            self._clients.move_to_end(cookies)
+            if user_id is not None:
+                old_key = self._user_keys.get(user_id)
+                self._user_keys[user_id] = cookies
+                if old_key is not None and old_key != cookies:
+                    self._clients.pop(old_key, None)
+                    self._user_clients.pop(user_id, None)
+            while len(self._clients) > self.max_size:
+                evicted, _ = self._clients.popitem(last=False)
+                self._forget_key(evicted)
+        return client
+
+    def invalidate(self, user_id: int) -> None:
+        """丢弃用户的客户端（登录更新凭证后调用）"""
+        with self._lock:
+            self._user_clients.pop(user_id, None)
+            key = self._user_keys.pop(user_id, None)
+            if key is not None:
+                self._clients.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clients.clear()
+            self._user_keys.clear()
+            self._user_clients.clear()
+
+    def _forget_key(self, key: str) -> None:
+        for user_id in [user_id for user_id, user_key in self._user_keys.items() if user_key == key]:
+            del self._user_keys[user_id]
+            self._user_clients.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+weread_clients = WeReadClientRegistry(max_size=settings.weread_client_cache_size)
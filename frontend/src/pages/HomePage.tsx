@@ -8,10 +8,71 @@ import type { Book } from '../lib/api'
 import toast from 'react-hot-toast'
 import { useAuthStore } from '../stores/authStore'
 
+interface RefreshProgressEvent {
+  seq: number
+  stage: string
+  message: string
+  info: Record<string, any>
+}
+
+// 通过 fetch 读取刷新任务的 SSE 进度流（EventSource 无法携带 Authorization 头）
+async function streamRefreshJob(
+  jobId: string,
+  token: string | null,
+  onProgress: (event: RefreshProgressEvent) => void
+): Promise<any> {
+  const response = await fetch(`/api/books/refresh/${jobId}/events`, {
+    headers: token ? { Authorization: `Bearer ${token}` } : {},
+  })
+  if (!response.ok || !response.body) {
+    throw new Error(`进度订阅失败: ${response.status}`)
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  let result: any = null
+
+  while (true) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+
+    let boundary = buffer.indexOf('\n\n')
+    while (boundary !== -1) {
+      const block = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      boundary = buffer.indexOf('\n\n')
+
+      let eventName = 'message'
+      const dataLines: string[] = []
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) eventName = line.slice(6).trim()
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim())
+      }
+      if (dataLines.length === 0) continue
+
+      const data = JSON.parse(dataLines.join('\n'))
+      if (eventName === 'progress') onProgress(data)
+      else if (eventName === 'done') result = data
+    }
+  }
+
+  return result
+}
+
+function describeRefreshProgress(event: RefreshProgressEvent): string {
+  const { stage, info, message } = event
+  if (stage === 'html_fetched') return `${message}：共 ${info.total ?? 0} 本`
+  if (stage === 'batch_synced') return `${message}：第 ${info.batch}/${info.batches} 批`
+  return message
+}
+
 export default function HomePage() {
   const [page, setPage] = useState(1)
   const [loadingMode, setLoadingMode] = useState<'rawbooks' | 'all' | 'complete'>('rawbooks')
-  const { logout } = useAuthStore()
+  const { logout, token } = useAuthStore()
+  const [refreshProgress, setRefreshProgress] = useState<string | null>(null)
   const [showAllBooks, setShowAllBooks] = useState(false)
   const [hasShownSuccessMessage, setHasShownSuccessMessage] = useState(false)
   const hasHandledLogin = useRef(false)
@@ -116,6 +177,30 @@ export default function HomePage() {
     }
   )
 
+  // 后台补全书籍详情期间轮询书架版本，版本变化后重新获取当前页
+  const enrichmentPending = !!response?.data?.data?.loading_info?.has_more_to_sync
+  const loadedShelfVersion = response?.data?.data?.loading_info?.shelf_version
+  useEffect(() => {
+    if (!enrichmentPending || loadedShelfVersion === undefined) return
+
+    const timer = setInterval(async () => {
+      try {
+        const res = await fetch('/api/books/version', {
+          headers: token ? { Authorization: `Bearer ${token}` } : {},
+        })
+        const body = await res.json()
+        if ((body?.data?.shelf_version ?? 0) > loadedShelfVersion) {
+          console.log('🧩 书架版本已更新，重新获取书籍数据')
+          refetch()
+        }
+      } catch (error) {
+        console.log('⚠️ 获取书架版本失败', error)
+      }
+    }, 3000)
+
+    return () => clearInterval(timer)
+  }, [enrichmentPending, loadedShelfVersion, token])
+
   // 检测是否从登录页跳转过来，如果是则强制刷新数据
   useEffect(() => {
     // 检查是否是从登录页面跳转来的（通过 replace: true 跳转）
@@ -316,6 +401,7 @@ export default function HomePage() {
 
 
   const handleRefresh = async () => {
+    if (refreshProgress) return
     try {
       setHasShownSuccessMessage(false) // 重置成功消息标志
 
@@ -323,10 +409,21 @@ export default function HomePage() {
       console.log('🗑️ 强制清除所有缓存')
       cache.clear()
 
+      // 刷新在后台任务中执行，接口立即返回任务ID
       const result = await booksAPI.refreshBooks()
+      const job = result?.data?.data ?? result?.data
+      if (!job?.job_id) {
+        refetch()
+        return
+      }
+
+      setRefreshProgress('刷新任务已提交')
+      const finalState = await streamRefreshJob(job.job_id, token, (event) => {
+        setRefreshProgress(describeRefreshProgress(event))
+      })
 
-      // 检查是否是cookie过期 - 支持两种可能的数据结构
-      if (result?.data?.error === 'cookie_expired' || result?.data?.data?.error === 'cookie_expired') {
+      // 检查是否是cookie过期
+      if (finalState?.error === 'cookie_expired' || finalState?.result?.error === 'cookie_expired') {
         console.log('🔐 刷新时检测到Cookie过期，跳转到登录页');
         toast.error('登录已过期，请重新登录');
         logout();
@@ -334,10 +431,17 @@ export default function HomePage() {
         return;
       }
 
+      if (finalState?.status !== 'succeeded') {
+        toast.error('刷新失败')
+        return
+      }
+
       refetch()
-      toast.success('书架已刷新')
+      toast.success(`书架已刷新，共 ${finalState?.result?.total_books ?? 0} 本书`)
     } catch (error) {
       toast.error('刷新失败')
+    } finally {
+      setRefreshProgress(null)
     }
   }
 
@@ -545,6 +649,12 @@ export default function HomePage() {
                     📚 共 {total} 本书{isActiveSearch && ` | 搜索 "${debouncedQuery}"`}
                   </p>
                 </div>
+                {refreshProgress && (
+                  <span className="flex items-center gap-2 text-sm text-sky-700 bg-sky-50 px-3 py-1 rounded-full border border-sky-200">
+                    <Loader className="h-3 w-3 animate-spin" />
+                    {refreshProgress}
+                  </span>
+                )}
                 {loadingInfo && !isActiveSearch && (
                   <div className="flex items-center gap-4 text-sm">
                     {loadingInfo.synced_books_count > 0 && (
@@ -558,9 +668,10 @@ export default function HomePage() {
             </div>
             <button
               onClick={handleRefresh}
-              className="btn btn-secondary flex items-center space-x-2 shadow-md hover:shadow-lg transition-all duration-200"
+              disabled={!!refreshProgress}
+              className="btn btn-secondary flex items-center space-x-2 shadow-md hover:shadow-lg transition-all duration-200 disabled:opacity-60"
             >
-              <RefreshCw className="h-4 w-4" />
+              <RefreshCw className={`h-4 w-4 ${refreshProgress ? 'animate-spin' : ''}`} />
               <span>刷新</span>
             </button>
           </div>
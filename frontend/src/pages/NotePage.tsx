@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import { useParams, useSearchParams, Link, useNavigate } from 'react-router-dom'
 import { useQuery } from 'react-query'
 import { ArrowLeft, Copy, Download, ChevronUp, FileText } from 'lucide-react'
@@ -105,6 +105,16 @@ const MarkdownRenderer: React.FC<{ content: string }> = ({ content }) => {
   return <div className="markdown-content space-y-1">{elements}</div>
 }
 
+// 每次按目录加载的章节数
+const NOTES_CHAPTER_BATCH = 20
+
+interface NoteSection {
+  index: number
+  chapterUid: number
+  title: string
+  content: string
+}
+
 export default function NotePage() {
   const { bookId } = useParams<{ bookId: string }>()
   const [searchParams, setSearchParams] = useSearchParams()
@@ -115,6 +125,12 @@ export default function NotePage() {
   const [readingProgress, setReadingProgress] = useState(0)
   const navigate = useNavigate()
   const { logout } = useAuthStore()
+  const [sections, setSections] = useState<NoteSection[]>([])
+  const [hasMoreChapters, setHasMoreChapters] = useState(false)
+  const [loadingChapters, setLoadingChapters] = useState(false)
+  const [pendingJump, setPendingJump] = useState<number | null>(null)
+  const loadingChaptersRef = useRef(false)
+  const sentinelRef = useRef<HTMLDivElement>(null)
 
   // 强制退出登录的函数
   const forceLogout = () => {
@@ -123,9 +139,10 @@ export default function NotePage() {
     navigate('/login', { replace: true, state: { message: '登录已过期，请重新登录' } });
   };
 
+  // 先获取目录（每章划线数），章节内容随滚动分批加载
   const { data: response, isLoading, error, refetch } = useQuery(
-    ['notes', bookId, noteMode],
-    () => notesAPI.getNotes(bookId!, noteMode),
+    ['notes-toc', bookId, noteMode],
+    () => notesAPI.getToc(bookId!, noteMode),
     { enabled: !!bookId }
   )
 
@@ -205,6 +222,72 @@ export default function NotePage() {
   }
 
   const noteData = response?.data?.data
+
+  const loadChapters = async (start: number, limit: number = NOTES_CHAPTER_BATCH) => {
+    if (loadingChaptersRef.current) return
+    loadingChaptersRef.current = true
+    setLoadingChapters(true)
+    try {
+      const res = await notesAPI.getChapterRange(bookId!, noteMode, start, Math.min(limit, 200))
+      const page = res.data.data
+      setSections(prev => [...prev.slice(0, start), ...page.chapters])
+      setHasMoreChapters(page.has_more)
+    } catch (err) {
+      console.error('加载笔记章节失败:', err)
+      toast.error('加载笔记章节失败')
+    } finally {
+      loadingChaptersRef.current = false
+      setLoadingChapters(false)
+    }
+  }
+
+  // 目录变化（首次加载、切换笔记模式）时从第一章重新加载
+  useEffect(() => {
+    setSections([])
+    setHasMoreChapters(false)
+    if (noteData?.total_chapters) {
+      loadChapters(0)
+    }
+  }, [noteData])
+
+  // 滚动到已加载内容的末尾附近时加载下一批章节
+  useEffect(() => {
+    const sentinel = sentinelRef.current
+    if (!sentinel || !hasMoreChapters) return
+    const observer = new IntersectionObserver(
+      (entries) => {
+        if (entries[0].isIntersecting) {
+          loadChapters(sections.length)
+        }
+      },
+      { rootMargin: '800px' }
+    )
+    observer.observe(sentinel)
+    return () => observer.disconnect()
+  }, [hasMoreChapters, sections.length, activeTab])
+
+  // 从目录跳转：先加载到目标章节，渲染后再滚动过去
+  const jumpToChapter = (index: number) => {
+    if (index >= sections.length) {
+      loadChapters(sections.length, index - sections.length + NOTES_CHAPTER_BATCH)
+    }
+    setActiveTab('preview')
+    setPendingJump(index)
+  }
+
+  useEffect(() => {
+    if (pendingJump === null || pendingJump >= sections.length) return
+    document.getElementById(`note-chapter-${pendingJump}`)?.scrollIntoView({ behavior: 'smooth', block: 'start' })
+    setPendingJump(null)
+  }, [pendingJump, sections.length])
+
+  const loadedMarkdown = sections.map(section => section.content).join('\n')
+
+  // 复制和下载需要完整内容，使用导出接口一次取回
+  const fetchFullMarkdown = async (): Promise<string> => {
+    const res = await notesAPI.exportNotes(bookId!, 'markdown', noteMode)
+    return res.data
+  }
   const bookData = bookResponse?.data?.data
 
   // 检查错误并自动返回登录界面
@@ -251,9 +334,9 @@ export default function NotePage() {
   }, [error, navigate]);
 
   const copyToClipboard = async () => {
-    if (noteData?.markdown_content) {
+    if (noteData?.total_chapters) {
       try {
-        await navigator.clipboard.writeText(noteData.markdown_content)
+        await navigator.clipboard.writeText(await fetchFullMarkdown())
         toast.success('已复制到剪贴板')
       } catch (error) {
         toast.error('复制失败')
@@ -261,9 +344,16 @@ export default function NotePage() {
     }
   }
 
-  const downloadMarkdown = () => {
-    if (noteData?.markdown_content) {
-      const blob = new Blob([noteData.markdown_content], { type: 'text/markdown' })
+  const downloadMarkdown = async () => {
+    if (noteData?.total_chapters) {
+      let content: string
+      try {
+        content = await fetchFullMarkdown()
+      } catch (error) {
+        toast.error('下载失败')
+        return
+      }
+      const blob = new Blob([content], { type: 'text/markdown' })
       const url = URL.createObjectURL(blob)
       const a = document.createElement('a')
       a.href = url
@@ -482,9 +572,9 @@ export default function NotePage() {
 
             {/* Right: Actions and Stats */}
             <div className="flex items-center space-x-4">
-              {noteData?.markdown_content && (
+              {noteData?.total_chapters > 0 && (
                 <div className="text-xs text-gray-500 bg-gray-100 px-3 py-2 rounded-lg">
-                  约 {Math.round(noteData.markdown_content.length / 500)} 分钟阅读
+                  {noteData.total_highlights} 条划线 · {noteData.total_notes} 条想法
                 </div>
               )}
               <button
@@ -512,6 +602,32 @@ export default function NotePage() {
           </div>
         </div>
 
+        {/* Table of Contents */}
+        {noteData.total_chapters > 0 && (
+          <div className="bg-white/90 backdrop-blur-sm rounded-2xl shadow-lg border border-white/50 p-6 mb-8">
+            <div className="text-sm font-medium text-gray-700 mb-3">
+              目录 · {noteData.total_chapters} 章
+            </div>
+            <div className="max-h-64 overflow-auto space-y-1">
+              {noteData.chapters.map((chapter: any) => (
+                <button
+                  key={chapter.index}
+                  onClick={() => jumpToChapter(chapter.index)}
+                  className="w-full flex items-center justify-between px-3 py-2 text-sm text-left rounded-lg hover:bg-sky-50 transition-colors"
+                  style={{ paddingLeft: `${chapter.level * 0.75}rem` }}
+                >
+                  <span className="truncate text-gray-700">{chapter.title}</span>
+                  {chapter.highlight_count > 0 && (
+                    <span className="ml-3 flex-shrink-0 text-xs text-sky-700 bg-sky-50 px-2 py-0.5 rounded">
+                      {chapter.highlight_count}
+                    </span>
+                  )}
+                </button>
+              ))}
+            </div>
+          </div>
+        )}
+
         {/* Tabs */}
         <div className="bg-white/90 backdrop-blur-sm rounded-2xl shadow-lg border border-white/50 mb-8 overflow-hidden">
           <div className="flex p-2 bg-slate-50/50">
@@ -542,7 +658,7 @@ export default function NotePage() {
 
         {/* Content */}
         <div className="bg-white/90 backdrop-blur-sm rounded-2xl shadow-lg border border-white/50 overflow-hidden mb-8">
-          {(!noteData.markdown_content || noteData.markdown_content.trim() === '') ? (
+          {!noteData.total_chapters ? (
             <div className="p-12 text-center">
               <div className="bg-slate-50 rounded-2xl p-8 border border-slate-200">
                 <div className="text-6xl mb-4">📝</div>
@@ -563,7 +679,11 @@ export default function NotePage() {
           ) : activeTab === 'preview' ? (
             <div className="p-8 lg:p-12">
               <div className="max-w-4xl mx-auto">
-                <MarkdownRenderer content={noteData.markdown_content} />
+                {sections.map(section => (
+                  <div key={section.index} id={`note-chapter-${section.index}`}>
+                    <MarkdownRenderer content={section.content} />
+                  </div>
+                ))}
               </div>
             </div>
           ) : (
@@ -579,19 +699,31 @@ export default function NotePage() {
                     <span className="text-sm font-mono text-gray-300">markdown</span>
                   </div>
                   <div className="text-xs text-gray-400 font-mono">
-                    {noteData.markdown_content?.split('\n').length || 0} 行
+                    {loadedMarkdown.split('\n').length} 行
+                    {hasMoreChapters && ` · 已加载 ${sections.length}/${noteData.total_chapters} 章`}
                   </div>
                 </div>
               </div>
               <div className="p-8 overflow-auto max-h-[80vh]">
                 <pre className="whitespace-pre-wrap text-sm font-mono leading-loose text-gray-100 selection:bg-sky-500/30">
-                  {noteData.markdown_content}
+                  {loadedMarkdown}
                 </pre>
               </div>
             </div>
           )}
         </div>
 
+        {/* 分批加载章节的哨兵 */}
+        {noteData.total_chapters > 0 && (
+          <div ref={sentinelRef} className="text-center text-sm text-gray-400 pb-8">
+            {loadingChapters
+              ? '正在加载章节...'
+              : hasMoreChapters
+                ? `已加载 ${sections.length}/${noteData.total_chapters} 章`
+                : null}
+          </div>
+        )}
+
         {/* Footer */}
         <div className="text-center py-8">
           <div className="text-gray-400 text-sm mb-4">